@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Benchmark for the renderers.
+
+Renders a synthetic report with 100,000 snapshots to ``/dev/null``,
+with the output buffer disabled and with the default buffer size::
+
+    $ PYTHONPATH=. python benchmarks/bench_render.py
+    $ PYTHONPATH=. python benchmarks/bench_render.py --apps 100 --format tree
+
+With ``--color``, the output is styled as if written to a terminal.
+
+'''
+import argparse
+from collections import namedtuple
+from datetime import datetime
+from datetime import timedelta
+import os
+import time
+
+from steamwatch.render import RENDER_BUFFER
+from steamwatch.render import TabularRenderer
+from steamwatch.render import TreeRenderer
+
+
+FakeApp = namedtuple('FakeApp', 'steamid name')
+FakePackage = namedtuple('FakePackage', 'steamid name')
+FakeSnapshot = namedtuple(
+    'FakeSnapshot',
+    'timestamp price release_date coming_soon supports_linux')
+
+
+def synthetic_report(apps, packages, snapshots):
+    '''Generate a report like ``Application.report_all``.'''
+    start = datetime(2015, 9, 1)
+    for app_index in range(apps):
+        app = FakeApp(str(app_index), 'Game {}'.format(app_index))
+        pkgs = []
+        for pkg_index in range(packages):
+            pkg = FakePackage(
+                '{}{:02}'.format(app_index, pkg_index),
+                'Package {} of Game {}'.format(pkg_index, app_index))
+            history = [
+                FakeSnapshot(start + timedelta(hours=i), 1999 - i,
+                             None, False, i % 2 == 0)
+                for i in range(snapshots)
+            ]
+            pkgs.append((pkg, history))
+        yield app, pkgs
+
+
+def bench(renderer_cls, buffer_size, args):
+    '''Render the synthetic report once, return the seconds it took.'''
+    options = argparse.Namespace(render_buffer=buffer_size)
+    report = list(synthetic_report(args.apps, args.packages, args.snapshots))
+    with open(os.devnull, 'w') as out:
+        renderer = renderer_cls(out, options)
+        renderer.use_color = args.color
+        started = time.perf_counter()
+        renderer.render_report(report)
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--apps', type=int, default=1000)
+    parser.add_argument('--packages', type=int, default=10)
+    parser.add_argument('--snapshots', type=int, default=10)
+    parser.add_argument('--format', choices=('tab', 'tree'), default='tab')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--color', action='store_true')
+    args = parser.parse_args()
+
+    renderer_cls = TabularRenderer if args.format == 'tab' else TreeRenderer
+    rows = args.apps * args.packages * args.snapshots
+    print('{n} rows, {f} format'.format(n=rows, f=args.format))
+    for label, buffer_size in (('unbuffered', 0), ('buffered', RENDER_BUFFER)):
+        best = min(bench(renderer_cls, buffer_size, args)
+                   for _ in range(args.repeat))
+        print('{l:<12} {s:6.2f}s'.format(l=label, s=best))
+
+
+if __name__ == '__main__':
+    main()
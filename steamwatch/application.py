@@ -15,14 +15,19 @@ for a game.
 Additional signals are emitted when one of the tracked properties of a game
 changed during :meth:`Application.fetch`.
 
+The ``threshold`` signal is emitted by :meth:`Application.check_thresholds`
+when the current price of a game drops to or below the threshold
+of one of its watchers.
+
 The following signals are emitted:
 
 ====================== ==========================
 Signal                 args
 ====================== ==========================
-app_added              app
-app_removed            app
+app_added              app, owner
+app_removed            app, owner
 package_linked         package, app
+threshold              app, price, threshold, owner
 ---------------------- --------------------------
 currency_changed       current, previous, package
 price_changed          current, previous, package
@@ -31,17 +36,105 @@ coming_soon_changed    current, previous, package
 supports_linux_changed current, previous, package
 ====================== ==========================
 
+Watchlists
+##########
+Several users can share one database.
+Each user (the ``user`` option, by default the login name) has a
+watchlist of their own, with a price threshold per game.
+Games, packages and snapshots are shared: :meth:`Application.fetch_all`
+fetches each game once, no matter how many users watch it.
+:meth:`Application.ls`, :meth:`Application.report_all` and
+:meth:`Application.recent` show the games on the user's watchlist.
+
+Polling
+#######
+:meth:`Application.fetch_all` only fetches games that are *due*.
+Games that are *coming soon* are polled more often when their release date
+is near and less often when it is far off or unknown,
+see :meth:`Application.due`.
+
+In *spread* mode, :meth:`Application.fetch_all` does not fetch all due games
+at once but assigns each game a stable slot within the ``fetch_interval``
+and fetches games one by one at their slot.
+
+Games and packages that are not found on the store are *quarantined*:
+they are skipped for ``quarantine_backoff``, a period that doubles with each
+consecutive failure up to ``quarantine_limit``.
+A successful fetch ends the quarantine.
+
+Each :meth:`Application.fetch_all` is recorded as a *fetch run* with
+per-game progress. If a run is interrupted, the next run resumes with the
+remaining games, if it starts within the ``resume_window``.
+
+Several fetch processes can share one database if ``fetch_workers``
+is set to the number of workers.
+Each worker then claims a *lease* on a batch of due games before fetching
+them, so that no game is fetched twice.
+Leases expire after ``lease_duration`` and are claimed by another worker
+if the holder did not finish.
+
+Alternatively, the watchlist can be split into *shards*, each fetched by
+a separate process into a separate database
+(see the ``shard`` parameter of :meth:`Application.fetch_all`).
+:meth:`Application.merge` combines the shard databases.
+
+Regions
+#######
+``country_code`` may name several countries, e.g. ``us,de,gb``.
+Game details are fetched once for the first (*primary*) country,
+package details with prices are fetched for each country
+and recorded as :class:`Snapshot` with the country code as ``region``.
+Reports, recent changes and thresholds refer to the primary region
+unless another region is requested.
+
+Archive
+#######
+:meth:`Application.archive` copies the price history of each package
+to a columnar file in ``archive_path``,
+:meth:`Application.history` loads it for analysis without
+reading snapshots from the database.
+
 '''
+import calendar
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from datetime import timedelta
+import getpass
 import logging
+import os
+import socket
+import time
+import zlib
 
 from pkg_resources import iter_entry_points
 
+from steamwatch import archive
 from steamwatch.exceptions import GameNotFoundError
+from steamwatch.model import add_snapshots
 from steamwatch.model import init as init_db
+from steamwatch.model import merge as merge_db
 from steamwatch.model import App
+from steamwatch.model import AppPackage
+from steamwatch.model import FetchRun
+from steamwatch.model import Lease
 from steamwatch.model import Package
+from steamwatch.model import PackageStats
+from steamwatch.model import ReadCursor
 from steamwatch.model import Snapshot
+from steamwatch.model import Watch
+from steamwatch.model import RECENT_COLUMNS
+from steamwatch.model import export_rows
+from steamwatch.model import history_rows
+from steamwatch.model import price_buckets
+from steamwatch.model import price_rows
+from steamwatch.model import ls_rows
+from steamwatch.model import recent_rows
+from steamwatch.model import report_rows
+from steamwatch import responselog
+from steamwatch import stats
 from steamwatch import storeapi
+from steamwatch.util import extract_appid
 
 
 LOG = logging.getLogger(__name__)
@@ -67,6 +160,33 @@ FIELD_SIGNALS = {
     'supports_linux': SIGNAL_SUPPORTS_LINUX,
 }
 
+# defaults for options that are not set in the configuration
+DEFAULTS = {
+    'fetch_interval': timedelta(hours=1),
+    'release_interval': timedelta(minutes=10),
+    'release_window': timedelta(days=2),
+    'coming_soon_interval': timedelta(hours=6),
+    'quarantine_backoff': timedelta(hours=1),
+    'quarantine_limit': timedelta(days=7),
+    'resume_window': timedelta(hours=1),
+    'keyframe_interval': timedelta(0),
+    'fetch_workers': 1,
+    'lease_batch': 10,
+    'lease_duration': timedelta(minutes=10),
+    'user': None,
+    'watch_workers': 8,
+    'archive_path': os.path.expanduser('~/.local/share/steamwatch/archive'),
+    'response_log': None,
+    'response_segment_size': responselog.DEFAULT_SEGMENT_SIZE,
+}
+
+# recent changes within this period raise the priority of a game
+VOLATILITY_PERIOD = timedelta(days=7)
+
+# a game becomes due a little before its polling interval is over,
+# so that a periodic job does not skip it because of timing jitter
+SCHEDULE_SLACK = 0.1
+
 
 class Application(object):
     '''Main application object.'''
@@ -77,8 +197,27 @@ class Application(object):
         Initializes the database.
         '''
         self.options = options
-        self.country_code = options.country_code
-        init_db(self.options.db_path)
+        self.country_codes = _country_codes(options.country_code)
+        # the primary region
+        self.country_code = self.country_codes[0]
+        self.user = self._option('user') or getpass.getuser()
+        init_db(self.options.db_path, owner=self.user)
+        Snapshot.assign_region(self.country_code)
+
+        self._responses = None
+        if self._option('response_log'):
+            self._responses = responselog.ResponseLog(
+                self._option('response_log'),
+                self._option('response_segment_size')
+            )
+            storeapi.record_responses(self._responses)
+
+    def close(self):
+        '''Finish the current segment of the response log, if any.'''
+        if self._responses is not None:
+            storeapi.record_responses(None)
+            self._responses.close()
+            self._responses = None
 
     def watch(self, appid, threshold=None):
         '''Start watching for changes on the steam game with the given
@@ -87,51 +226,162 @@ class Application(object):
         - If this ``appid`` is new, it is added to the database.
         - If the item is already in the database but is *disabled*, it is
           *enabled*.
-        - If the item is already being watched, nothing happens.
+        - If the item is already being watched by the user,
+          only the ``threshold`` is updated.
 
-        Emits ``SIGNAL_APP_ADDED`` when the game is added/enabled.
+        Emits ``SIGNAL_APP_ADDED`` when the game is added to the watchlist
+        of the user.
 
         :param str appid:
             The steam app id of the game to watch.
         :param int threshold:
             *optional*
-            Price threshold (**not working**).
+            Price threshold in cents,
+            see :meth:`check_thresholds`.
         '''
         should_update = False
-        known = App.by_steamid(appid)
-
-        if known and known.enabled:
-            LOG.warning(('Attempted to add {a!r} to the watchlist'
-                         ' but it is already being watched.').format(a=appid))
-            app = known
-        elif known:  # is disabled
-            app = known
-            app.enable()
-            app.save()
-            should_update = True
+        app = App.by_steamid(appid)
 
-        else:  # not previously known
+        if app is None:  # not previously known
             data = storeapi.appdetails(appid)
-            app = App.from_apidata(appid, data, threshold=threshold)
+            app = App.from_apidata(appid, data)
+            should_update = True
+        elif not app.enabled:
+            app.enable()
             app.save()
             should_update = True
 
+        watch = Watch.get_for(self.user, app)
+        if watch:
+            LOG.warning(('Attempted to add {a!r} to the watchlist'
+                         ' but it is already being watched.').format(a=appid))
+            if threshold is not None:
+                watch.threshold = threshold
+                watch.threshold_hit = False
+                watch.save()
+            return app
+
+        Watch.create(owner=self.user, app=app, threshold=threshold)
+        LOG.info('{a.name!r} was added to the watchlist.'.format(a=app))
+        self._signal(SIGNAL_APP_ADDED, app=app, owner=self.user)
         if should_update:
-            LOG.info('{a.name!r} was added to the watchlist.'.format(a=app))
-            self._signal(SIGNAL_APP_ADDED, app=app)
             self.fetch(app)
 
         return app
 
+    def watch_many(self, entries, threshold=None):
+        '''Add many games to the watchlist at once,
+        e.g. from an exported wishlist.
+
+        Entries can be appids or store URLs.
+        Details for games that are not in the database are fetched
+        concurrently (``watch_workers``) and the games are added in batches.
+        Unlike :meth:`watch`, this does not fetch prices,
+        the new games are due for the next :meth:`fetch_all`.
+
+        Emits ``SIGNAL_APP_ADDED`` for each game that is added to the
+        watchlist of the user.
+
+        :param iterable entries:
+            The appids or URLs of the games to watch.
+        :param int threshold:
+            *optional*
+            Price threshold in cents for the added games.
+        :returns:
+            A *dict* with a list of appids for each outcome:
+            ``added``, ``enabled`` (was disabled, now added),
+            ``known`` (already on the watchlist),
+            ``invalid`` (not an appid or not found on the store)
+            and ``failed`` (the store did not respond).
+        :rtype: dict
+        '''
+        summary = {'added': [], 'enabled': [], 'known': [], 'invalid': [],
+                   'failed': []}
+        appids = []
+        for entry in entries:
+            try:
+                appid = extract_appid(entry)
+            except ValueError:
+                summary['invalid'].append(entry)
+                continue
+            if appid not in appids:
+                appids.append(appid)
+
+        apps = App.by_steamids(appids)
+        watched = set(app_id for app_id, in Watch.select(Watch.app)
+                      .where(Watch.owner == self.user).tuples())
+
+        new = self._appdetails([a for a in appids if a not in apps], summary)
+        App.insert_apidata(new)
+        apps.update(App.by_steamids(new.keys()))
+
+        disabled = set(a.id for a in apps.values() if not a.enabled)
+        if disabled:
+            App.update(enabled=True).where(App.id << list(disabled)).execute()
+
+        added = []
+        for appid in appids:
+            app = apps.get(appid)
+            if app is None:
+                continue
+            if app.id in watched:
+                summary['known'].append(appid)
+                continue
+            added.append(app)
+            if app.id in disabled:
+                app.enabled = True
+                summary['enabled'].append(appid)
+            else:
+                summary['added'].append(appid)
+
+        Watch.add_many(self.user, added, threshold=threshold)
+        for app in added:
+            self._signal(SIGNAL_APP_ADDED, app=app, owner=self.user)
+
+        LOG.info('Added {n} games to the watchlist.'.format(n=len(added)))
+        return summary
+
+    def _appdetails(self, appids, summary):
+        '''Fetch details for the given ``appids`` concurrently.
+
+        Unknown and failed appids are added to ``summary``.
+
+        :returns:
+            A *dict* that maps appid to details.
+        '''
+        def get(appid):
+            try:
+                return appid, storeapi.appdetails(appid), None
+            except Exception as err:  # pylint: disable=broad-except
+                return appid, None, err
+
+        found = {}
+        with ThreadPoolExecutor(self._option('watch_workers')) as executor:
+            for appid, data, err in executor.map(get, appids):
+                if isinstance(err, GameNotFoundError):
+                    LOG.warning('Game {s!r} not found.'.format(s=appid))
+                    summary['invalid'].append(appid)
+                elif err is not None:
+                    LOG.warning('Failed to get {s!r}: {e}'.format(
+                        s=appid, e=err))
+                    summary['failed'].append(appid)
+                else:
+                    found[appid] = data
+
+        return found
+
     def unwatch(self, appid, delete=False):
         '''Stop watching the game with the given ``appid``.
 
-        - If the game is currently bein watched, it will be *disabled*,
+        - The game is removed from the watchlist of the user.
+          If no other user watches it, it will be *disabled*,
           unless the optional parameter ``delete`` is set to *True*
           (which will completely remove the game and all measures.)
-        - If the game is currently not being watched, nothing happens.
+        - If the game is currently not being watched, nothing happens,
+          except that a *disabled* game can be deleted.
 
-        Emits ``SIGNAL_APP_REMOVED`` when the application is deleted/disabled.
+        Emits ``SIGNAL_APP_REMOVED`` when the game is removed from the
+        watchlist of the user.
 
         :param str appid:
             The steam app id of the game to watch.
@@ -141,12 +391,22 @@ class Application(object):
             If *False* (=default), it is disabled.
         '''
         app = App.by_steamid(appid)
-        if app is None:
+        watch = app and Watch.get_for(self.user, app)
+        # a disabled game can still be deleted
+        if not (watch or (app and delete and not app.enabled)):
             LOG.warning(('Attempted to remove {a!r} from the watchlist'
                          ' but it was not watched.').format(a=appid))
             return
 
-        if delete:
+        if watch:
+            watch.delete_instance()
+        others = app.watches.count()
+        if others:
+            LOG.info('{a.name!r} is still watched by {n} other(s).'.format(
+                a=app, n=others))
+            if delete:
+                LOG.warning('{a.name!r} is not deleted.'.format(a=app))
+        elif delete:
             LOG.debug('Delete {a!r}.'.format(a=app))
             # packages linked to this app can be deleted
             # only if they are not linked to another app
@@ -186,23 +446,37 @@ class Application(object):
             app.save()
             LOG.info('Disabled {a.name!r}'.format(a=app))
 
-        self._signal(SIGNAL_APP_REMOVED, app=app)
+        self._signal(SIGNAL_APP_REMOVED, app=app, owner=self.user)
 
     def ls(self, include_disabled=False):  # pylint: disable=invalid-name
-        '''List games that re currently being watched.
+        '''List games that re currently being watched by the user.
 
         :param bool include_disabled:
             *optional*
             if set to *True*, include *disabled* games in the list.
-            Else (=default), list only enabled apps.
+            Else (=default), list only apps on the user's watchlist.
         :return:
             *iterable* eith waztched :class:`App` instances
         :rtype: iterable
         '''
         if include_disabled:
-            return App.select().order_by(App.enabled.desc(), App.name)
+            watched = Watch.select(Watch.app).where(Watch.owner == self.user)
+            query = (App.select()
+                     .where((App.id << watched) | (App.enabled == False))
+                     .order_by(App.enabled.desc(), App.name))
+        else:
+            query = Watch.apps(self.user).order_by(App.name)
 
-        return App.select().where(App.enabled == True).order_by(App.name)
+        return _stream(query)
+
+    def ls_rows(self, include_disabled=False):
+        '''Like :meth:`ls`, but list plain tuples for each game and package
+        with the columns in :data:`steamwatch.model.LS_COLUMNS`.
+
+        :rtype: iterable
+        '''
+        return ls_rows(self.user, include_disabled=include_disabled,
+                       region=self.country_code)
 
     def fetch(self, app):
         '''Fetch updates for the given game.
@@ -219,42 +493,468 @@ class Application(object):
             # raise error or update anyway (and skip disabled in fetch_all)
             return
 
-        appdata = storeapi.appdetails(
-            app.steamid,
-            country_code=self.country_code
-        )
+        fetched = datetime.utcnow()
+
+        try:
+            appdata = storeapi.appdetails(
+                app.steamid,
+                country_code=self.country_code
+            )
+        except GameNotFoundError:
+            LOG.warning('Game {s!r} not found.'.format(s=app.steamid))
+            self._quarantine(app)
+            return
+
         # `packages` may be string or int
         found = [str(x) for x in appdata.get('packages', [])]
         existing = {p.steamid: p for p in app.packages}
         for packageid in found:
+            # might be present but not linked to this app
+            pkg = existing.get(packageid) or Package.by_steamid(packageid)
+            if pkg and pkg.quarantined:
+                LOG.debug('Skip quarantined {p!r}.'.format(p=pkg))
+                continue
+
+            regions = self._packagedetails(packageid)
+            if not regions:
+                LOG.warning('Package {s!r} not found.'.format(s=packageid))
+                if not pkg:
+                    # keep track of failures for unknown packages, too
+                    pkg = Package.create(steamid=packageid)
+                self._quarantine(pkg)
+                continue
+
+            # name and release info do not depend on the region
+            pkgdata = regions[0][1]
+            if not pkg:
+                # not yet in db - create it
+                pkg = Package.from_apidata(packageid, pkgdata)
+            elif pkg.failures:
+                pkg.name = pkg.name or pkgdata.get('name')
+                pkg.record_success()
+                pkg.save()
+
+            if packageid not in existing:
+                pkg.link(app)
+                self._signal(SIGNAL_PACKAGE_LINKED, package=pkg, app=app)
+
+            for region, pkgdata in regions:
+                snapshot = pkg.record_snapshot(
+                    pkgdata,
+                    region=region,
+                    keyframe_interval=self._option('keyframe_interval')
+                )
+                if snapshot:
+                    self._signal_changes(snapshot)
+
+        app.last_fetch = fetched
+        app.record_success()
+        app.save()
+
+    def _packagedetails(self, packageid):
+        '''Fetch package details for each region.
+
+        :returns:
+            A list of ``(region, details)`` tuples for the regions
+            in which the package was found.
+        '''
+        results = []
+        for region in self.country_codes:
             try:
                 pkgdata = storeapi.packagedetails(
                     packageid,
-                    country_code=self.country_code
+                    country_code=region
                 )
-                if packageid in existing:
-                    pkg = existing[packageid]
-                else:
-                    # might be present but not linked to this app
-                    pkg = Package.by_steamid(packageid)
-                    if not pkg:
-                        # not yet in db - create it
-                        pkg = Package.from_apidata(packageid, pkgdata)
-                    pkg.link(app)
-                    self._signal(SIGNAL_PACKAGE_LINKED, package=pkg, app=app)
-
-                snapshot = pkg.record_snapshot(pkgdata)
-                if snapshot:
-                    self._signal_changes(snapshot)
             except GameNotFoundError:
-                LOG.warning('Game not %s found.', packageid)
+                LOG.debug('Package {s!r} not found in {r!r}.'.format(
+                    s=packageid, r=region))
                 continue
+            results.append((region, pkgdata))
+
+        return results
+
+    def _quarantine(self, entity):
+        entity.record_failure(
+            self._option('quarantine_backoff'),
+            self._option('quarantine_limit')
+        )
+        entity.save()
+        LOG.info('Quarantined {e!r} until {t} after {n} failure(s).'.format(
+            e=entity, t=entity.skip_until, n=entity.failures))
+
+    def fetch_all(self, force=False, spread=False, resume=None,
+                  deadline=None, shard=None):
+        ''':meth:`fetch` updates for all enabled games that are due.
+
+        Games are fetched in the order of :meth:`prioritize`.
+
+        Each call is recorded as a :class:`steamwatch.model.FetchRun`
+        with per-game progress.
+        If the previous run was interrupted, the remaining games of that
+        run are fetched instead of planning a new run.
+
+        If more than one ``fetch_workers`` are configured, games are claimed
+        with a :class:`steamwatch.model.Lease` in batches instead
+        and no fetch run is recorded.
+
+        :param bool force:
+            *optional*
+            If *True*, fetch all enabled games regardless of whether they
+            are due (see :meth:`due`).
+        :param bool spread:
+            *optional*
+            If *True*, spread the fetches evenly over the ``fetch_interval``
+            instead of fetching all games at once.
+            Each game is fetched at a stable slot derived from its
+            ``steamid``, so this call takes up to one ``fetch_interval``.
+        :param bool resume:
+            *optional*
+            If *True*, always resume an interrupted run,
+            if *False*, never resume.
+            By default (*None*), an interrupted run is resumed if it
+            was started within the ``resume_window``.
+        :param timedelta deadline:
+            *optional*
+            Do not start fetching another game once this time has passed.
+            Games that were not fetched remain due for the next run.
+            In *spread* mode, games whose slot is after the ``deadline``
+            are fetched at the start of the run instead.
+        :param tuple shard:
+            *optional*
+            A tuple ``(K, N)`` to fetch only the games in shard *K*
+            of *N* shards (counting from 1).
+            Games are assigned to shards by a hash of their ``steamid``.
+        '''
+        started = datetime.utcnow()
+        stop = started + deadline if deadline else None
+        if self._option('fetch_workers') > 1:
+            if spread:
+                LOG.warning('Fetches are not spread with several workers.')
+            self._fetch_leased(force, started, stop, shard)
+            self.check_thresholds()
+            return
+
+        run = self._interrupted_run(resume)
+        if run:
+            LOG.info('Resume {r!r}.'.format(r=run))
+            apps = [app for app in run.pending()
+                    if app.enabled and not app.quarantined]
+            force = True  # were due when the run was planned
+        elif spread:
+            apps = list(App.select().where(App.enabled == True))
+        else:
+            apps = self._planned(force, started)
+
+        if shard:
+            apps = [app for app in apps if _in_shard(app, shard)]
+
+        if not run:
+            run = FetchRun.start(apps)
 
-    def fetch_all(self):
-        ''':meth:`fetch` updates for all enabled games.'''
-        apps = App.select().where(App.enabled == True)
+        if spread:
+            self._fetch_spread(apps, force, run, deadline)
+        else:
+            for app in self.prioritize(apps, now=started):
+                if stop and datetime.utcnow() >= stop:
+                    LOG.warning('Deadline reached, stop fetching.')
+                    break
+                self.fetch(app)
+                run.checkpoint(app)
+
+        run.finish()
+        LOG.info('Finished {r!r}, {n} of {p} games processed.'.format(
+            r=run, n=run.completed, p=run.planned))
+        self.check_thresholds()
+
+    def check_thresholds(self):
+        '''Emit ``SIGNAL_THRESHOLD`` for each watched game whose current
+        price has dropped to or below the ``threshold`` of the watcher.
+
+        The current price of a game is the lowest price among the most
+        recent snapshots of its packages in the primary region.
+        The signal is emitted only once when the price crosses the
+        threshold, not again while it stays below.
+        All games are checked with a few bulk queries,
+        this is called at the end of :meth:`fetch_all`.
+        '''
+        crossed = Watch.cross_thresholds(region=self.country_code)
+        if not crossed:
+            return
+
+        prices = App.current_prices(region=self.country_code)
+        for watch in crossed:
+            LOG.info('{a.name!r} is at or below the threshold of {o!r}.'.format(
+                a=watch.app, o=watch.owner))
+            self._signal(SIGNAL_THRESHOLD, app=watch.app,
+                         price=prices.get(watch.app_id),
+                         threshold=watch.threshold, owner=watch.owner)
+
+    def _planned(self, force, now):
+        if force:
+            return [app for app in App.select().where(App.enabled == True)
+                    if not app.quarantined]
+        return self.due(now=now)
+
+    def _fetch_leased(self, force, started, stop, shard):
+        '''Fetch due games in batches, holding a lease for each batch.
+
+        Leases take the place of the fetch run:
+        if a worker is interrupted, its leases expire and the games are
+        still due for the other workers.
+        '''
+        worker = '{h}:{p}'.format(h=socket.gethostname(), p=os.getpid())
+        size = self._option('lease_batch')
+        duration = self._option('lease_duration')
+        apps = self._planned(force, started)
+        if shard:
+            apps = [app for app in apps if _in_shard(app, shard)]
+        pending = [app.id for app in self.prioritize(apps, now=started)]
+
+        try:
+            while pending:
+                batch, pending = pending[:size], pending[size:]
+                for app in Lease.claim(worker, batch, duration):
+                    if stop and datetime.utcnow() >= stop:
+                        LOG.warning('Deadline reached, stop fetching.')
+                        return
+                    if app.last_fetch and app.last_fetch >= started:
+                        LOG.debug('{a!r} was fetched by another worker.'.format(
+                            a=app))
+                    else:
+                        self.fetch(app)
+                    Lease.release(worker, app)
+        finally:
+            Lease.release(worker)
+
+    def _interrupted_run(self, resume):
+        if resume is False:
+            return None
+
+        run = FetchRun.unfinished()
+        if run and not resume:
+            window = self._option('resume_window')
+            if run.started < datetime.utcnow() - window:
+                LOG.info('Not resuming {r!r}, it is too old.'.format(r=run))
+                run = None
+
+        return run
+
+    def _fetch_spread(self, apps, force, run, deadline):
+        now = datetime.utcnow()
+        # slots must repeat with each run to keep games due
+        interval = self._option('fetch_interval')
+        stop = now + deadline if deadline else None
+        intervals = self._polling_intervals(now)
+        slots = []
         for app in apps:
-            self.fetch(app)
+            slot = _slot(app, now, interval)
+            if stop and slot >= stop:
+                slot = now  # the previous run also stopped before the slot
+            slots.append((slot, app))
+        slots.sort(key=lambda entry: entry[0])
+        LOG.debug('Spread {n} games over {i}.'.format(n=len(slots), i=interval))
+
+        for slot, app in slots:
+            if stop and datetime.utcnow() >= stop:
+                LOG.warning('Deadline reached, stop fetching.')
+                break
+            wait = (slot - datetime.utcnow()).total_seconds()
+            if wait > 0:
+                time.sleep(wait)
+            if app.quarantined:
+                pass
+            elif force or self._is_due(app, intervals, slot):
+                self.fetch(app)
+            run.checkpoint(app)
+
+    def prioritize(self, apps, now=None):
+        '''Order ``apps`` so that the most valuable fetches come first.
+
+        Games that were never fetched come first,
+        the others are ordered by a score that adds up:
+
+        - the time since the last fetch, in multiples of ``fetch_interval``
+        - how close the current price is to the highest ``threshold``
+          among the game's watchers
+          (1.0 when the price is at the threshold, at most 2.0)
+        - recent volatility, 0.1 for each recorded change within
+          ``VOLATILITY_PERIOD`` (at most 1.0)
+
+        :param list apps:
+            The :class:`App` instances to order.
+        :param datetime now:
+            *optional*
+            The current time (UTC).
+        :returns:
+            A new list with the apps, most valuable first.
+        :rtype: list
+        '''
+        now = now or datetime.utcnow()
+        interval = self._option('fetch_interval').total_seconds()
+        prices = App.current_prices(region=self.country_code)
+        thresholds = Watch.thresholds()
+        changes = App.change_counts(now - VOLATILITY_PERIOD)
+
+        def score(app):
+            '''Priority score for the given ``app``, higher comes first.'''
+            if app.last_fetch is None:
+                return float('inf')
+            value = (now - app.last_fetch).total_seconds() / interval
+            price = prices.get(app.id)
+            threshold = thresholds.get(app.id)
+            if threshold and price is not None:
+                value += min(2.0, threshold / max(price, 1))
+            value += min(1.0, changes.get(app.id, 0) / 10)
+            return value
+
+        return sorted(apps, key=score, reverse=True)
+
+    def due(self, now=None):
+        '''List the enabled games that are due to be fetched.
+
+        A game is due if it was never fetched or if its polling interval
+        has passed since the last fetch.
+        Games that are quarantined after failed fetches are never due.
+        The polling interval depends on the release status of the game's
+        packages:
+
+        - *coming soon* with a release date within ``release_window``
+          (before or after ``now``): ``release_interval``
+        - *coming soon* with a release date further away or unknown:
+          ``coming_soon_interval``
+        - all other games: ``fetch_interval``
+
+        :param datetime now:
+            *optional*
+            The point in time for which to check, defaults to the current
+            time (UTC).
+        :returns:
+            A list of :class:`App` instances.
+        :rtype: list
+        '''
+        now = now or datetime.utcnow()
+        intervals = self._polling_intervals(now)
+        shortest = min(
+            [self._option('fetch_interval')] + list(intervals.values()))
+
+        candidates = App.select().where(
+            App.enabled == True,
+            (App.skip_until >> None) | (App.skip_until <= now),
+            (App.last_fetch >> None)
+            | (App.last_fetch <= now - shortest * (1 - SCHEDULE_SLACK))
+        )
+        return [app for app in candidates
+                if self._is_due(app, intervals, now)]
+
+    def _polling_intervals(self, now):
+        '''Polling intervals for games with packages that are coming soon.
+
+        Uses the index on the release info of packages,
+        games not contained in the result use the ``fetch_interval``.
+
+        :returns:
+            A *dict* that maps ``App.id`` to a *timedelta*.
+        '''
+        window = self._option('release_window')
+        upcoming = (App.select(App.id)
+                    .join(AppPackage)
+                    .join(Package)
+                    .where(Package.coming_soon == True))
+        near = upcoming.where(Package.release_date.between(
+            (now - window).date(), (now + window).date()))
+
+        intervals = {}
+        for app in upcoming.tuples():
+            intervals[app[0]] = self._option('coming_soon_interval')
+        for app in near.tuples():
+            intervals[app[0]] = self._option('release_interval')
+
+        return intervals
+
+    def _is_due(self, app, intervals, now):
+        if app.last_fetch is None:
+            return True
+        interval = intervals.get(app.id, self._option('fetch_interval'))
+        return app.last_fetch <= now - interval * (1 - SCHEDULE_SLACK)
+
+    def _option(self, name):
+        return getattr(self.options, name, DEFAULTS[name])
+
+    def merge(self, paths):
+        '''Merge the databases at the given ``paths`` into this one.
+
+        This is used to combine the databases of several shards
+        (see :meth:`fetch_all`) into a single database for reporting.
+        Records are matched by their ``steamid``,
+        see :func:`steamwatch.model.merge`.
+
+        :param list paths:
+            Paths to the databases to merge.
+        '''
+        for path in paths:
+            LOG.info('Merge {p!r}.'.format(p=path))
+            merge_db(path)
+
+    def replay(self, paths, workers=None):
+        '''Rebuild or backfill the database from the recorded responses
+        of the store API (see :mod:`steamwatch.responselog`).
+
+        The segments are read in parallel by ``workers`` processes.
+        Apps, Packages and their links that do not exist are added,
+        snapshots are added with the time of the response,
+        see :func:`steamwatch.model.add_snapshots`.
+        Watches are not part of the recorded responses
+        and no signals are emitted.
+
+        :param list paths:
+            Segments or directories with segments.
+        :param int workers:
+            *optional*
+            The number of worker processes, defaults to the number of CPUs.
+        :returns:
+            The number of snapshots that were added.
+        :rtype: int
+        '''
+        segments = responselog.segments(paths)
+        LOG.info('Replay {n} segments.'.format(n=len(segments)))
+        known = set()
+        links = set()
+        packages = {}
+
+        def package_id(steamid, name):
+            if steamid not in packages:
+                pkg = Package.by_steamid(steamid)
+                if pkg is None:
+                    pkg = Package.from_apidata(steamid, {'name': name})
+                elif not pkg.name and name:
+                    pkg.name = name
+                    pkg.save()
+                packages[steamid] = pkg
+            return packages[steamid].id
+
+        def rows(results):
+            for apps, snapshots in results:
+                for steamid, appdata, found in apps:
+                    if steamid not in known and not App.by_steamid(steamid):
+                        App.from_apidata(steamid, appdata)
+                    known.add(steamid)
+                    links.update((steamid, packageid) for packageid in found)
+                for steamid, name, timestamp, region, fields in snapshots:
+                    yield package_id(steamid, name), timestamp, region, fields
+
+        if workers == 1:
+            added = add_snapshots(rows(map(_replay_segment, segments)))
+        else:
+            with ProcessPoolExecutor(workers) as executor:
+                added = add_snapshots(
+                    rows(executor.map(_replay_segment, segments)))
+
+        apps = App.by_steamids({appid for appid, _ in links})
+        for appid, packageid in sorted(links):
+            if appid in apps and packageid in packages:
+                AppPackage.get_or_create(app=apps[appid],
+                                         package=packages[packageid])
+        return added
 
     def _signal_changes(self, snapshot):
         for field, current, previous in snapshot.diff():
@@ -265,7 +965,7 @@ class Application(object):
                 package=snapshot.package
             )
 
-    def report(self, app, limit=None):
+    def report(self, app, limit=None, region=None, sparkline=None):
         '''List Snapshots for the given Game.
 
         Returns a list of packages with their snapshots:
@@ -277,30 +977,61 @@ class Application(object):
                 (<package-1>, [<snapshot-0>, <snapshot-1>, ...]),
             ]
 
+        The snapshots are streamed from the database when they are
+        iterated and can be iterated only once.
+        Each package has the :class:`PackageStats` for the region
+        as ``price_stats`` (*None* if nothing was recorded).
+        Only with ``sparkline``, each package also has a ``price_history``
+        downsampled to that many ``(lowest, highest)`` periods
+        (see :func:`steamwatch.model.price_buckets`),
+        *None* if nothing was recorded.
+
         :param object app:
             The :class:`App` instance for which the report should be generated.
         :param int limit:
             *optional*
             Limit the number of results.
+        :param str region:
+            *optional*
+            The region for which to list snapshots,
+            defaults to the primary region.
+        :param int sparkline:
+            *optional*
+            The number of periods in the price history of each package.
         :returns:
             A list of tuples with *Packages* and *Snapshots*.
         :rtype: list
         '''
+        region = region or self.country_code
+        packages = app.packages
+        stats = PackageStats.for_packages(packages, region)
+        histories = {}
+        if sparkline:
+            now = calendar.timegm(datetime.utcnow().utctimetuple())
+            histories = price_buckets([p.id for p in packages], region,
+                                      sparkline, now)
         results = []
-        for package in app.packages:
-            select = package.snapshots.order_by(Snapshot.timestamp.desc())
+        for package in packages:
+            package.price_stats = stats.get(package.id)
+            if sparkline:
+                package.price_history = histories.get(package.id)
+            select = (Snapshot.select_full()
+                      .where(Snapshot.package == package,
+                             Snapshot.region == region)
+                      .order_by(Snapshot.timestamp.desc()))
             if limit:
                 select = select.limit(limit)
-            results.append((package, [s for s in select]))
+            results.append((package, _stream(select)))
 
         return results
 
-    def report_all(self, limit=None):
-        ''':meth:`report` details for all enabled Games.
+    def report_all(self, limit=None, region=None, sparkline=None):
+        ''':meth:`report` details for all Games on the user's watchlist.
 
-        This is similar to :meth:`report` but for all enabled games.
+        This is similar to :meth:`report` but for all watched games.
 
-        Returns a list of games with packages and snapshots:
+        Yields games with packages and snapshots, one game at a time,
+        so that the report can be rendered while it is read:
 
         .. code:: python
 
@@ -319,27 +1050,247 @@ class Application(object):
         :param int limit:
             *optional*
             Limit the number of results.
+        :param str region:
+            *optional*
+            The region for which to list snapshots,
+            defaults to the primary region.
+        :param int sparkline:
+            *optional*
+            The number of periods in the price history of each package.
+        :rtype: iterator
+        '''
+        apps = Watch.apps(self.user).order_by(App.name)
+        for app in _stream(apps):
+            yield app, self.report(app, limit=limit, region=region,
+                                   sparkline=sparkline)
+
+    def report_rows(self, apps=None, limit=None, region=None):
+        '''Like :meth:`report_all`, but list plain tuples for each game,
+        package and snapshot with the columns in
+        :data:`steamwatch.model.REPORT_COLUMNS`.
+
+        :param list apps:
+            *optional*
+            Report only these :class:`App` instances.
+        :param int limit:
+            *optional*
+            Limit the number of snapshots per package.
+        :param str region:
+            *optional*
+            The region for which to list snapshots,
+            defaults to the primary region.
+        :rtype: iterable
+        '''
+        app_ids = None if apps is None else [a.id for a in apps]
+        return report_rows(self.user, app_ids=app_ids, limit=limit,
+                           region=region or self.country_code)
+
+    def compare(self, app):
+        '''Compare the current Snapshots of the given Game across regions.
+
+        Returns a list of packages with the most recent snapshot
+        for each region, ordered like ``country_code``:
+
+        .. code:: python
+
+            [
+                (<package-0>, [<snapshot-us>, <snapshot-de>, ...]),
+                (<package-1>, [<snapshot-us>, <snapshot-de>, ...]),
+            ]
+
+        :param object app:
+            The :class:`App` instance to compare.
         :rtype: list
         '''
-        apps = App.select().where(App.enabled == True).order_by(App.name)
+        packages = [p for p in app.packages]
+        latest = (Snapshot.latest()
+                  .where(Snapshot.package << [p.id for p in packages],
+                         Snapshot.region << self.country_codes))
+        by_package = {}
+        for snapshot in latest:
+            by_package.setdefault(snapshot.package_id, []).append(snapshot)
+
+        order = {r: index for index, r in enumerate(self.country_codes)}
         results = []
-        for app in apps:
-            results.append((app, self.report(app, limit=limit)))
+        for package in packages:
+            snapshots = by_package.get(package.id, [])
+            snapshots.sort(key=lambda s: order[s.region])
+            results.append((package, snapshots))
 
         return results
 
-    def recent(self, limit=None):
-        '''List recent changes.
+    def compare_all(self):
+        ''':meth:`compare` regions for all Games on the user's watchlist.
+
+        The result has the same structure as :meth:`report_all`.
+
+        :rtype: iterator
+        '''
+        apps = Watch.apps(self.user).order_by(App.name)
+        for app in _stream(apps):
+            yield app, self.compare(app)
+
+    def recent(self, limit=None, region=None, unseen=False):
+        '''List recent changes for the games on the user's watchlist.
 
         :param int limit:
             *optional*
             limit the number of results.
+        :param str region:
+            *optional*
+            The region for which to list changes,
+            defaults to the primary region.
+        :param bool unseen:
+            *optional*
+            List only changes the user has not seen yet,
+            see :meth:`mark_seen`.
+            These are listed oldest first, so that with a ``limit``
+            the next call continues where this one stopped.
         :returns:
             An iterable with recent :class:`Snapshot` instances,
-            ordered by timestamp.
+            most recent first unless ``unseen`` is set.
+        :rtype: iterable
+        '''
+        region = region or self.country_code
+        if not unseen:
+            return _stream(
+                Snapshot.recent(limit=limit, region=region, owner=self.user))
+
+        after = ReadCursor.position(self.user, region)
+        return list(Snapshot.recent(limit=limit, region=region,
+                                    owner=self.user, after=after))
+
+    def recent_rows(self, limit=None, region=None, unseen=False):
+        '''Like :meth:`recent`, but list plain tuples for each snapshot
+        with the columns in :data:`steamwatch.model.RECENT_COLUMNS`.
+
+        With ``unseen``, the changes are marked as seen
+        once all rows have been read.
+
+        :rtype: iterable
+        '''
+        region = region or self.country_code
+        if not unseen:
+            return recent_rows(self.user, limit=limit, region=region)
+
+        after = ReadCursor.position(self.user, region)
+        rows = recent_rows(self.user, limit=limit, region=region,
+                           after=after)
+        return self._mark_seen_rows(rows, region)
+
+    def _mark_seen_rows(self, rows, region):
+        index = RECENT_COLUMNS.index('id')
+        last = None
+        for row in rows:
+            last = row
+            yield row
+        if last:
+            # rows are ordered by id
+            ReadCursor.advance(self.user, region, last[index])
+
+    def export_rows(self, since=None, apps=None):
+        '''List the snapshot history of the games on the user's watchlist
+        as plain tuples with the columns in
+        :data:`steamwatch.model.EXPORT_COLUMNS`.
+
+        :param datetime since:
+            *optional*
+            Only snapshots recorded at or after this time (UTC).
+        :param list apps:
+            *optional*
+            Only snapshots for these :class:`App` instances.
         :rtype: iterable
         '''
-        return Snapshot.recent(limit=limit)
+        app_ids = None if apps is None else [a.id for a in apps]
+        return export_rows(self.user, since=since, app_ids=app_ids)
+
+    def archive(self, apps=None, path=None):
+        '''Write the price history of each package to the archive,
+        see :mod:`steamwatch.archive`.
+
+        :param list apps:
+            *optional*
+            Archive only the packages of these :class:`App` instances.
+        :param str path:
+            *optional*
+            The archive directory, defaults to ``archive_path``.
+        :returns:
+            The number of archive files written.
+        :rtype: int
+        '''
+        path = path or self._option('archive_path')
+        app_ids = None if apps is None else [a.id for a in apps]
+        written = archive.write_all(path, history_rows(app_ids=app_ids))
+        LOG.info('Wrote {n} files to archive {p!r}.'.format(n=written, p=path))
+        return written
+
+    def history(self, package, region=None, path=None):
+        '''Load the archived price history of ``package``.
+
+        :param object package:
+            The :class:`Package`.
+        :param str region:
+            *optional*
+            The region, defaults to the primary region.
+        :param str path:
+            *optional*
+            The archive directory, defaults to ``archive_path``.
+        :returns:
+            A :class:`steamwatch.archive.History`,
+            *None* if the package is not archived.
+        '''
+        filename = archive.path_for(path or self._option('archive_path'),
+                                    package.steamid,
+                                    region or self.country_code)
+        if not os.path.exists(filename):
+            return None
+        return archive.load(filename)
+
+    def stats(self, apps=None, region=None):
+        '''Compute price statistics for the packages of the games
+        on the user's watchlist, see :mod:`steamwatch.stats`.
+
+        :param list apps:
+            *optional*
+            Only the packages of these :class:`App` instances.
+        :param str region:
+            *optional*
+            The region, defaults to the primary region.
+        :returns:
+            A list of tuples with the :data:`steamwatch.stats.STATS_COLUMNS`
+            and the :class:`Package` in the first column.
+        :rtype: list
+        '''
+        app_ids = None if apps is None else [a.id for a in apps]
+        rows = price_rows(self.user, region=region or self.country_code,
+                          app_ids=app_ids)
+        now = calendar.timegm(datetime.utcnow().utctimetuple())
+        results = stats.compute(*stats.load(rows), now=now)
+        packages = Package.by_ids(r[0] for r in results)
+        return [(packages[r[0]],) + r[1:] for r in results]
+
+    def rebuild_stats(self):
+        '''Rebuild the :class:`PackageStats` of all packages
+        from the recorded snapshots.
+
+        :returns: The number of stats, one per package and region.
+        :rtype: int
+        '''
+        return PackageStats.rebuild()
+
+    def mark_seen(self, snapshots, region=None):
+        '''Remember that the user has seen the given ``snapshots``,
+        so that they are not listed by ``recent(unseen=True)`` again.
+
+        :param list snapshots:
+            :class:`Snapshot` instances from :meth:`recent`.
+        :param str region:
+            *optional*
+            The region of the snapshots, defaults to the primary region.
+        '''
+        if snapshots:
+            ReadCursor.advance(self.user, region or self.country_code,
+                               max(s.id for s in snapshots))
 
 
     def _signal(self, name, **data):
@@ -364,6 +1315,90 @@ class Application(object):
                 LOG.debug(err, exc_info=True)
 
 
+def _stream(query):
+    '''Iterate over the results of ``query`` without caching them,
+    the query is executed on the first iteration.'''
+    # like query.iterator(), which raises StopIteration in a generator
+    results = query.execute()
+    while True:
+        try:
+            row = results.iterate()
+        except StopIteration:
+            return
+        yield row
+
+
+def _replay_segment(path):
+    '''Read the responses in the segment at ``path`` for :meth:`replay`.
+
+    This runs in a worker process and does not access the database.
+
+    :returns:
+        ``(apps, snapshots)``, lists of ``(steamid, appdata, packageids)``
+        and ``(steamid, name, timestamp, region, fields)`` tuples
+        for the successful responses.
+    '''
+    apps = []
+    snapshots = []
+    for record in responselog.read(path):
+        steamid = str(record['id'])
+        result = record['response'].get(steamid) or {}
+        if not result.get('success'):
+            continue
+        data = result['data']
+        if record['endpoint'] == 'appdetails' and 'type' in data:
+            apps.append((
+                steamid,
+                {'type': data['type'], 'name': data.get('name')},
+                # `packages` may be string or int
+                [str(x) for x in data.get('packages', [])]
+            ))
+        elif record['endpoint'] == 'packagedetails':
+            snapshots.append((
+                steamid,
+                data.get('name'),
+                record['time'],
+                record['cc'],
+                Snapshot.fields_from_apidata(data)
+            ))
+    return apps, snapshots
+
+
+def _country_codes(value):
+    '''Split a comma separated list of country codes.'''
+    if isinstance(value, str):
+        value = value.split(',')
+    codes = []
+    for code in value:
+        code = code.strip().lower()
+        if code and code not in codes:
+            codes.append(code)
+    if not codes:
+        raise ValueError('At least one country code is required.')
+    return codes
+
+
+def _in_shard(app, shard):
+    '''Tell if the given ``app`` belongs to ``shard``,
+    a tuple ``(K, N)`` for shard *K* of *N*.
+    '''
+    index, count = shard
+    return zlib.crc32(app.steamid.encode('utf-8')) % count == index - 1
+
+
+def _slot(app, now, interval):
+    '''The point in time within the ``interval`` after ``now``
+    at which ``app`` is fetched in *spread* mode.
+
+    The slot is derived from the ``steamid``, so an app is always fetched at
+    the same offset within the interval.
+    '''
+    period = max(1, int(interval.total_seconds()))
+    offset = zlib.crc32(app.steamid.encode('utf-8')) % period
+    elapsed = calendar.timegm(now.utctimetuple()) % period
+    return now + timedelta(seconds=(offset - elapsed) % period)
+
+
 def log_signal(name, unused, **kwargs):  # pylint: disable=unused-argument
     '''Default hook function for signals.
 
@@ -0,0 +1,208 @@
+#-*- coding: utf-8 -*-
+'''
+Columnar archive of price histories.
+
+The archive has one file per package and region
+with all snapshots of that package, oldest first.
+The values are stored column by column, so that a complete history
+can be memory-mapped and used without decoding rows from the database.
+
+File format (little endian)::
+
+    magic       4 bytes     b'SWA1'
+    codes       uint32      number of currency codes
+    count       uint64      number of snapshots
+    currencies  4 bytes     ASCII currency code, NUL padded, for each code
+    padding                 to a multiple of 8 bytes
+    timestamps  int64       seconds since the epoch (UTC), for each snapshot
+    prices      int32       price in cents or MISSING_PRICE
+    currencies  uint8       index into the currency codes, 0 for none
+
+Columns are loaded as NumPy arrays if NumPy is installed
+and as ``memoryview`` of the mapped file otherwise.
+'''
+import array
+import mmap
+import os
+import struct
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+MAGIC = b'SWA1'
+HEADER = struct.Struct('<4sIQ')
+CODE = struct.Struct('<4s')
+SUFFIX = '.swa'
+
+# stored for snapshots without a price
+MISSING_PRICE = -1
+
+# currency codes are stored as an uint8 index, 0 stands for *no currency*
+MAX_CODES = 255
+
+
+class History(object):
+    '''The price history of a package in one region.
+
+    :var timestamps:
+        Seconds since the epoch (UTC) for each snapshot.
+    :var prices:
+        The price for each snapshot, ``MISSING_PRICE`` if there is none.
+    :var currencies:
+        Index into ``codes`` for each snapshot.
+    :var tuple codes:
+        The currency codes, ``codes[0]`` is *None*.
+    '''
+
+    def __init__(self, timestamps, prices, currencies, codes):
+        self.timestamps = timestamps
+        self.prices = prices
+        self.currencies = currencies
+        self.codes = codes
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def currency(self, index):
+        '''The currency code of the snapshot at ``index``.'''
+        return self.codes[self.currencies[index]]
+
+    def __repr__(self):
+        return '<History snapshots={n}>'.format(n=len(self))
+
+
+def path_for(directory, steamid, region):
+    '''The archive file for the package with ``steamid`` in ``region``.'''
+    return os.path.join(
+        directory, '{p}-{r}{s}'.format(p=steamid, r=region or '', s=SUFFIX))
+
+
+def write(path, snapshots):
+    '''Write the ``snapshots`` to the archive file at ``path``.
+
+    The file is replaced atomically.
+
+    :param str path:
+        The archive file.
+    :param iterable snapshots:
+        ``(timestamp, price, currency)`` tuples, oldest first,
+        with the timestamp in seconds since the epoch.
+    '''
+    timestamps = array.array('q')
+    prices = array.array('i')
+    currencies = array.array('B')
+    codes = [None]
+    index = {None: 0}
+    for timestamp, price, currency in snapshots:
+        timestamps.append(timestamp)
+        prices.append(MISSING_PRICE if price is None else price)
+        try:
+            currencies.append(index[currency])
+        except KeyError:
+            if len(codes) > MAX_CODES:
+                raise ValueError('Too many currencies for {p!r}'.format(
+                    p=path))
+            index[currency] = len(codes)
+            currencies.append(len(codes))
+            codes.append(currency)
+
+    if sys.byteorder != 'little':
+        timestamps.byteswap()
+        prices.byteswap()
+
+    partial = path + '.partial'
+    with open(partial, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, len(codes) - 1, len(timestamps)))
+        for code in codes[1:]:
+            out.write(CODE.pack(code.encode('ascii')))
+        out.write(b'\0' * _padding(out.tell()))
+        timestamps.tofile(out)
+        prices.tofile(out)
+        currencies.tofile(out)
+    os.replace(partial, path)
+
+
+def write_all(directory, rows):
+    '''Write archive files for all packages in ``rows``.
+
+    :param str directory:
+        The archive directory, created if it does not exist.
+    :param iterable rows:
+        ``(steamid, region, timestamp, price, currency)`` tuples,
+        ordered by package, region and timestamp,
+        e.g. from :func:`steamwatch.model.history_rows`.
+    :returns:
+        The number of files written.
+    :rtype: int
+    '''
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    written = 0
+    current = None
+    snapshots = []
+    for steamid, region, timestamp, price, currency in rows:
+        if (steamid, region) != current:
+            if current:
+                write(path_for(directory, *current), snapshots)
+                written += 1
+            current = (steamid, region)
+            snapshots = []
+        snapshots.append((timestamp, price, currency))
+    if current:
+        write(path_for(directory, *current), snapshots)
+        written += 1
+    return written
+
+
+def load(path):
+    '''Memory-map the archive file at ``path``.
+
+    :rtype: :class:`History`
+    '''
+    with open(path, 'rb') as archive:
+        mapped = mmap.mmap(archive.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, num_codes, count = HEADER.unpack_from(mapped)
+    if magic != MAGIC:
+        raise ValueError('Not an archive file: {p!r}'.format(p=path))
+
+    offset = HEADER.size
+    codes = [None]
+    for _ in range(num_codes):
+        code = CODE.unpack_from(mapped, offset)[0]
+        codes.append(code.rstrip(b'\0').decode('ascii'))
+        offset += CODE.size
+    offset += _padding(offset)
+
+    columns = []
+    for typecode, dtype, size in (('q', '<i8', 8), ('i', '<i4', 4),
+                                  ('B', 'u1', 1)):
+        columns.append(_column(mapped, offset, count, typecode, dtype))
+        offset += count * size
+
+    return History(columns[0], columns[1], columns[2], tuple(codes))
+
+
+def _column(mapped, offset, count, typecode, dtype):
+    if numpy is not None:
+        return numpy.frombuffer(mapped, dtype=dtype, count=count,
+                                offset=offset)
+
+    size = array.array(typecode).itemsize
+    view = memoryview(mapped)[offset:offset + count * size]
+    if sys.byteorder == 'little' or size == 1:
+        return view.cast(typecode)
+
+    # big endian, copy and swap
+    column = array.array(typecode, view.tobytes())
+    column.byteswap()
+    return column
+
+
+def _padding(offset):
+    return -offset % 8
@@ -9,6 +9,9 @@ configures logging
 and runs the program.
 '''
 import argparse
+import csv
+from datetime import datetime
+from datetime import timedelta
 import io
 import logging
 from logging import handlers
@@ -25,6 +28,9 @@ from pkg_resources import resource_stream
 import steamwatch
 from steamwatch import application
 from steamwatch.model import App
+from steamwatch.model import EXPORT_COLUMNS
+from steamwatch.render import JsonRenderer
+from steamwatch.render import NdjsonRenderer
 from steamwatch.render import TabularRenderer
 from steamwatch.render import TreeRenderer
 from steamwatch.util import extract_appid
@@ -122,7 +128,10 @@ def run(options):
         and from the config file(s).
     '''
     app = application.Application(options)
-    return options.func(app, options)
+    try:
+        return options.func(app, options)
+    finally:
+        app.close()
 
 
 # Argument parser ------------------------------------------------------------
@@ -165,6 +174,11 @@ def setup_argparser():
         help='Write nothing to stdout.',
     )
 
+    common.add_argument(
+        '-u', '--user',
+        help='Use the watchlist of this user instead of your own.',
+    )
+
     common.add_argument(
         '-l', '--logfile',
         help=('Write logs to the specified file. Use LOGFILE="syslog"'
@@ -202,6 +216,12 @@ def setup_argparser():
     fetch(subs, common)
     report(subs, common)
     recent(subs, common)
+    export(subs, common)
+    archive(subs, common)
+    stats(subs, common)
+    merge(subs, common)
+    rebuild(subs, common)
+    replay(subs, common)
     return parser
 
 
@@ -218,20 +238,45 @@ def watch(subs, common):
 
     parser.add_argument(
         'appid',
+        nargs='?',
         help='The id of the game to watch'
     )
 
+    parser.add_argument(
+        '--from',
+        dest='from_file',
+        metavar='FILE',
+        help=('Watch the games from FILE (or stdin for "-"),'
+              ' one appid or store URL per line')
+    )
+
     parser.add_argument(
         '-t', '--threshold',
         metavar='PRICE',
         type=float,
-        help='Receive a notification if the game drops below this price'
+        help=('Receive a notification if the game drops to or below'
+              ' this price, e.g. 9.99')
     )
 
     def do_watch(app, options):
         '''Execute the ``watch`` command.'''
-        appid = extract_appid(options.appid)
-        app.watch(appid, threshold=options.threshold)
+        threshold = None
+        if options.threshold is not None:
+            threshold = int(round(options.threshold * 100))  # in cents
+
+        if options.from_file:
+            summary = app.watch_many(_read_entries(options.from_file),
+                                     threshold=threshold)
+            for entry in summary['invalid'] + summary['failed']:
+                LOG.warning('Not added: {e}'.format(e=entry))
+            if not options.quiet:
+                renderer = TreeRenderer(sys.stdout, options)
+                renderer.render_watch_summary(summary)
+        elif options.appid:
+            appid = extract_appid(options.appid)
+            app.watch(appid, threshold=threshold)
+        else:
+            raise ValueError('Either an appid or --from is required.')
 
     parser.set_defaults(func=do_watch)
 
@@ -279,7 +324,7 @@ def ls(subs, common):  # pylint: disable=invalid-name
 
     parser.add_argument(
         '-f', '--format',
-        choices=('tree', 'tab'),
+        choices=('tree', 'tab', 'json', 'ndjson'),
         help='output format',
     )
 
@@ -288,10 +333,15 @@ def ls(subs, common):  # pylint: disable=invalid-name
         renderers = {
             'tree': TreeRenderer,
             'tab': TabularRenderer,
+            'json': JsonRenderer,
+            'ndjson': NdjsonRenderer,
         }
         renderer_cls = renderers[options.format or options.list_format]
         renderer = renderer_cls(sys.stdout, options)
-        renderer.render_ls(app.ls(include_disabled=options.all))
+        if renderer.rows:
+            renderer.render_ls(app.ls_rows(include_disabled=options.all))
+        else:
+            renderer.render_ls(app.ls(include_disabled=options.all))
 
     parser.set_defaults(func=do_ls)
 
@@ -306,7 +356,44 @@ def fetch(subs, common):
 
     parser.add_argument(
         '-g', '--games',
-        help='List of game ids to query. Queries all games if omitted'
+        nargs='*',
+        help='List of game ids to query. Queries all due games if omitted'
+    )
+
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Query all games, including those that are not due',
+    )
+
+    parser.add_argument(
+        '--spread',
+        action='store_true',
+        help=('Spread queries evenly over the fetch interval'
+              ' instead of querying all games at once'),
+    )
+
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help=('Continue an interrupted run, even if it was started'
+              ' before the resume window'),
+    )
+
+    parser.add_argument(
+        '--deadline',
+        type=_duration,
+        metavar='DURATION',
+        help=('Stop querying games after this time, e.g. "10m";'
+              ' overrides fetch_deadline'),
+    )
+
+    parser.add_argument(
+        '--shard',
+        type=_shard,
+        metavar='K/N',
+        help=('Query only the games in shard K of N,'
+              ' e.g. "1/4" (use a separate database for each shard)'),
     )
 
     def do_fetch(app, options):
@@ -320,8 +407,15 @@ def fetch(subs, common):
                         'Game with id {s!r} is not watched'.format(s=steamid))
                 else:
                     app.fetch(game)
+            app.check_thresholds()
         else:
-            app.fetch_all()
+            app.fetch_all(
+                force=options.force,
+                spread=options.spread or options.fetch_spread,
+                resume=options.resume or None,
+                deadline=options.deadline or options.fetch_deadline,
+                shard=options.shard,
+            )
 
     parser.set_defaults(func=do_fetch)
 
@@ -348,34 +442,84 @@ def report(subs, common):
 
     parser.add_argument(
         '-f', '--format',
-        choices=('tree', 'tab'),
+        choices=('tree', 'tab', 'json', 'ndjson'),
         help='output format',
     )
 
+    parser.add_argument(
+        '-r', '--region',
+        help='Country code of the region to report, defaults to the first',
+    )
+
+    parser.add_argument(
+        '-c', '--compare',
+        action='store_true',
+        help='Compare the current prices across all regions',
+    )
+
+    parser.add_argument(
+        '-s', '--sparkline',
+        action='store_true',
+        help='Show the price history of each package as a sparkline',
+    )
+
     def do_report(app, options):
         '''Execute the ``report`` command.'''
+        renderers = {
+            'tree': TreeRenderer,
+            'tab': TabularRenderer,
+            'json': JsonRenderer,
+            'ndjson': NdjsonRenderer,
+        }
+        renderer_cls = renderers[options.format or options.report_format]
+        renderer = renderer_cls(sys.stdout, options)
+        if renderer.rows and options.compare:
+            parser.error('--compare is not available for JSON output')
+        if renderer.rows and options.sparkline:
+            parser.error('--sparkline is not available for JSON output')
+        if options.compare and options.sparkline:
+            parser.error('--sparkline cannot be combined with --compare')
+        sparkline = renderer.sparkline_width if options.sparkline else None
+
+        region = options.region and options.region.lower()
+        games = None
         if options.games:
-            reports = []
+            games = []
             for identifier in options.games:
                 steamid = extract_appid(identifier)
                 game = App.by_steamid(steamid)
                 if not game:
                     LOG.warning(
                         'Game with id {s!r} is not watched'.format(s=steamid))
+                else:
+                    games.append(game)
+
+        if renderer.rows:
+            renderer.render_report(app.report_rows(
+                apps=games, limit=options.limit, region=region))
+            return
+
+        if games is not None:
+            reports = []
+            for game in games:
+                if options.compare:
+                    reports.append((game, app.compare(game)))
                 else:
                     reports.append(
-                        (game, app.report(game, limit=options.limit)),
+                        (game, app.report(game, limit=options.limit,
+                                          region=region,
+                                          sparkline=sparkline)),
                     )
+        elif options.compare:
+            reports = app.compare_all()
         else:
-            reports = app.report_all(limit=options.limit)
+            reports = app.report_all(limit=options.limit, region=region,
+                                     sparkline=sparkline)
 
-        renderers = {
-            'tree': TreeRenderer,
-            'tab': TabularRenderer
-        }
-        renderer_cls = renderers[options.format or options.report_format]
-        renderer = renderer_cls(sys.stdout, options)
-        renderer.render_report(reports)
+        if options.compare:
+            renderer.render_regions(reports)
+        else:
+            renderer.render_report(reports)
 
     parser.set_defaults(func=do_report)
 
@@ -394,27 +538,291 @@ def recent(subs, common):
     )
     parser.add_argument(
         '-f', '--format',
-        choices=('tree', 'tab'),
+        choices=('tree', 'tab', 'json', 'ndjson'),
         help='output format',
     )
+    parser.add_argument(
+        '-r', '--region',
+        help='Country code of the region, defaults to the first',
+    )
+
+    parser.add_argument(
+        '--unseen',
+        action='store_true',
+        help=('Show only changes that were not shown before'
+              ' (without a limit, unless --limit is given)'),
+    )
 
     def do_recent(app, options):
         '''Execute the ``recent`` command.'''
-        snapshots = app.recent(
-            limit=options.limit or options.recent_limit
-        )
+        region = options.region and options.region.lower()
+        if options.unseen:
+            limit = options.limit
+        else:
+            limit = options.limit or options.recent_limit
 
         renderers = {
             'tree': TreeRenderer,
-            'tab': TabularRenderer
+            'tab': TabularRenderer,
+            'json': JsonRenderer,
+            'ndjson': NdjsonRenderer,
         }
         renderer_cls = renderers[options.format or options.recent_format]
         renderer = renderer_cls(sys.stdout, options)
+        if renderer.rows:
+            # marks the rows as seen once they are rendered
+            renderer.render_recent(app.recent_rows(
+                limit=limit, region=region, unseen=options.unseen))
+            return
+
+        snapshots = app.recent(limit=limit, region=region,
+                               unseen=options.unseen)
         renderer.render_recent(snapshots)
+        if options.unseen:
+            app.mark_seen(snapshots, region=region)
 
     parser.set_defaults(func=do_recent)
 
 
+def export(subs, common):
+    '''Set up arguments for the ``export`` command.'''
+    parser = subs.add_parser(
+        'export',
+        parents=[common, ],
+        help='Export the recorded prices of watched games'
+    )
+
+    parser.add_argument(
+        '-f', '--format',
+        choices=('csv',),
+        default='csv',
+        help='output format',
+    )
+
+    parser.add_argument(
+        '-g', '--games',
+        nargs='*',
+        help='List of game ids to export. Exports all games if omitted'
+    )
+
+    parser.add_argument(
+        '--since',
+        type=_date,
+        metavar='DATE',
+        help='Export only prices recorded since this date, e.g. "2016-01-31"',
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        type=_path,
+        metavar='FILE',
+        help='Write to this file instead of stdout',
+    )
+
+    def do_export(app, options):
+        '''Execute the ``export`` command.'''
+        games = None
+        if options.games:
+            games = []
+            for identifier in options.games:
+                steamid = extract_appid(identifier)
+                game = App.by_steamid(steamid)
+                if not game:
+                    LOG.warning(
+                        'Game with id {s!r} is not watched'.format(s=steamid))
+                else:
+                    games.append(game)
+
+        rows = app.export_rows(since=options.since, apps=games)
+        if options.output:
+            with io.open(options.output, 'w', encoding='utf-8',
+                         newline='') as out:
+                _write_csv(out, rows)
+        else:
+            _write_csv(sys.stdout, rows)
+
+    parser.set_defaults(func=do_export)
+
+
+def _write_csv(out, rows):
+    '''Write a header and the given ``rows`` to ``out`` as CSV.'''
+    writer = csv.writer(out)
+    writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(rows)
+
+
+def archive(subs, common):
+    '''Set up arguments for the ``archive`` command.'''
+    parser = subs.add_parser(
+        'archive',
+        parents=[common, ],
+        help='Copy the price history of each package to the archive'
+    )
+
+    parser.add_argument(
+        '-g', '--games',
+        nargs='*',
+        help='List of game ids to archive. Archives all games if omitted'
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        type=_path,
+        metavar='DIR',
+        help='Archive directory, overrides archive_path',
+    )
+
+    def do_archive(app, options):
+        '''Execute the ``archive`` command.'''
+        games = None
+        if options.games:
+            games = []
+            for identifier in options.games:
+                steamid = extract_appid(identifier)
+                game = App.by_steamid(steamid)
+                if not game:
+                    LOG.warning(
+                        'Game with id {s!r} is not watched'.format(s=steamid))
+                else:
+                    games.append(game)
+
+        app.archive(apps=games, path=options.output)
+
+    parser.set_defaults(func=do_archive)
+
+
+def stats(subs, common):
+    '''Set up arguments for the ``stats`` command.'''
+    parser = subs.add_parser(
+        'stats',
+        parents=[common, ],
+        help='Show price statistics for watched games'
+    )
+
+    parser.add_argument(
+        '-g', '--games',
+        nargs='*',
+        help='List of game ids. Shows all games if omitted'
+    )
+
+    parser.add_argument(
+        '-f', '--format',
+        choices=('tab', 'json', 'ndjson'),
+        default='tab',
+        help='output format',
+    )
+
+    parser.add_argument(
+        '-r', '--region',
+        help='Country code of the region, defaults to the first',
+    )
+
+    def do_stats(app, options):
+        '''Execute the ``stats`` command.'''
+        games = None
+        if options.games:
+            games = []
+            for identifier in options.games:
+                steamid = extract_appid(identifier)
+                game = App.by_steamid(steamid)
+                if not game:
+                    LOG.warning(
+                        'Game with id {s!r} is not watched'.format(s=steamid))
+                else:
+                    games.append(game)
+
+        renderers = {
+            'tab': TabularRenderer,
+            'json': JsonRenderer,
+            'ndjson': NdjsonRenderer,
+        }
+        renderer = renderers[options.format](sys.stdout, options)
+        region = options.region and options.region.lower()
+        renderer.render_stats(app.stats(apps=games, region=region))
+
+    parser.set_defaults(func=do_stats)
+
+
+def merge(subs, common):
+    '''Set up arguments for the ``merge`` command.'''
+    parser = subs.add_parser(
+        'merge',
+        parents=[common, ],
+        help='Merge the databases of fetch shards into this database'
+    )
+
+    parser.add_argument(
+        'paths',
+        nargs='+',
+        type=_path,
+        metavar='DB',
+        help='Database files to merge'
+    )
+
+    def do_merge(app, options):
+        '''Execute the ``merge`` command.'''
+        app.merge(options.paths)
+
+    parser.set_defaults(func=do_merge)
+
+
+def rebuild(subs, common):
+    '''Set up arguments for the ``rebuild`` command.'''
+    parser = subs.add_parser(
+        'rebuild',
+        parents=[common, ],
+        help='Rebuild the price stats of all packages from the snapshots'
+    )
+
+    def do_rebuild(app, options):
+        '''Execute the ``rebuild`` command.'''
+        app.rebuild_stats()
+
+    parser.set_defaults(func=do_rebuild)
+
+
+def replay(subs, common):
+    '''Set up arguments for the ``replay`` command.'''
+    parser = subs.add_parser(
+        'replay',
+        parents=[common, ],
+        help='Rebuild or backfill the database from the response log'
+    )
+
+    parser.add_argument(
+        'paths',
+        nargs='+',
+        type=_path,
+        metavar='ARCHIVE',
+        help='Response log segments or directories with segments'
+    )
+
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        metavar='N',
+        help='Number of processes that read segments, defaults to the CPUs'
+    )
+
+    def do_replay(app, options):
+        '''Execute the ``replay`` command.'''
+        app.replay(options.paths, workers=options.workers)
+
+    parser.set_defaults(func=do_replay)
+
+
+def _read_entries(path):
+    '''Read the non-empty lines from the file at ``path``,
+    ``-`` for stdin. Lines starting with ``#`` are skipped.'''
+    if path == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(os.path.expanduser(path)) as infile:
+            lines = infile.readlines()
+    return [l.strip() for l in lines
+            if l.strip() and not l.strip().startswith('#')]
+
+
 # Argtypes --------------------------------------------------------------------
 
 
@@ -436,6 +844,126 @@ def _path(argstr):
     return path
 
 
+def _date(argstr):
+    '''Convert the given ``argstr`` into a ``datetime``.
+    To be used as the ``type`` parameter for an argument parser.
+
+    Accepts a date ("2016-01-31")
+    or a date and time ("2016-01-31 12:00"), in UTC.
+
+    :param str argstr:
+        The command line argument.
+    :rtype datetime:
+        The converted date.
+    '''
+    for fmt in ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M'):
+        try:
+            return datetime.strptime(argstr.strip(), fmt)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(
+        'Invalid date {!r}, expected YYYY-MM-DD'.format(argstr))
+
+
+_DURATION_UNITS = {
+    's': 'seconds',
+    'm': 'minutes',
+    'h': 'hours',
+    'd': 'days',
+}
+
+
+def _duration(argstr):
+    '''Convert the given ``argstr`` into a ``timedelta``.
+    To be used as the ``type`` parameter for an argument parser.
+
+    Accepts a number with an optional unit suffix,
+    ``s`` (seconds, the default), ``m`` (minutes), ``h`` (hours)
+    or ``d`` (days), e.g. "90", "10m" or "2d".
+
+    :param str argstr:
+        The command line argument.
+    :rtype timedelta:
+        The converted duration.
+    '''
+    text = argstr.strip().lower()
+    unit = 's'
+    if text and text[-1] in _DURATION_UNITS:
+        unit = text[-1]
+        text = text[:-1]
+    value = float(text)
+    if value < 0:
+        raise ValueError('Negative duration {!r}'.format(argstr))
+    return timedelta(**{_DURATION_UNITS[unit]: value})
+
+
+_SIZE_UNITS = {
+    'k': 1024,
+    'm': 1024 ** 2,
+    'g': 1024 ** 3,
+}
+
+
+def _size(argstr):
+    '''Convert the given ``argstr`` into a number of bytes.
+
+    Accepts a number with an optional unit suffix,
+    ``k``, ``m`` or ``g`` (KiB, MiB, GiB), e.g. "4096" or "16m".
+
+    :param str argstr:
+        The command line argument.
+    :rtype int:
+        The converted size.
+    '''
+    text = argstr.strip().lower()
+    factor = 1
+    if text and text[-1] in _SIZE_UNITS:
+        factor = _SIZE_UNITS[text[-1]]
+        text = text[:-1]
+    value = int(float(text) * factor)
+    if value <= 0:
+        raise ValueError('Invalid size {!r}'.format(argstr))
+    return value
+
+
+def _shard(argstr):
+    '''Convert the given ``argstr`` into a ``(K, N)`` tuple
+    for shard *K* of *N*, e.g. "2/4".
+    To be used as the ``type`` parameter for an argument parser.
+
+    :param str argstr:
+        The command line argument.
+    :rtype tuple:
+        The shard index (counting from 1) and the number of shards.
+    '''
+    try:
+        index, count = [int(part) for part in argstr.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'Invalid shard {!r}, expected K/N'.format(argstr))
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(
+            'Invalid shard {!r}, K must be between 1 and N'.format(argstr))
+    return index, count
+
+
+def _bool(argstr):
+    '''Convert the given ``argstr`` into a boolean.
+    Accepts the same values as ``ConfigParser.getboolean``.
+
+    :param str argstr:
+        The command line argument.
+    :rtype bool:
+        The converted value.
+    '''
+    value = argstr.strip().lower()
+    if value in ('1', 'yes', 'true', 'on'):
+        return True
+    elif value in ('0', 'no', 'false', 'off'):
+        return False
+    raise ValueError('Not a boolean: {!r}'.format(argstr))
+
+
 # Config ---------------------------------------------------------------------
 
 
@@ -444,6 +972,24 @@ CFG_TYPES = {
         'db_path': _path,
         'report_limit': int,
         'recent_limit': int,
+        'fetch_interval': _duration,
+        'release_interval': _duration,
+        'release_window': _duration,
+        'coming_soon_interval': _duration,
+        'fetch_spread': _bool,
+        'quarantine_backoff': _duration,
+        'quarantine_limit': _duration,
+        'resume_window': _duration,
+        'keyframe_interval': _duration,
+        'fetch_deadline': _duration,
+        'fetch_workers': int,
+        'lease_batch': int,
+        'lease_duration': _duration,
+        'watch_workers': int,
+        'render_buffer': int,
+        'archive_path': _path,
+        'response_log': _path,
+        'response_segment_size': _size,
     },
 }
 
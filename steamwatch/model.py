@@ -1,28 +1,41 @@
 #-*- coding: utf-8 -*-
 # pylint: disable=logging-format-interpolation
+# comparsion to True is required by peewee as `foo == True`
+# pylint: disable=C0121
 '''
 Model classes for *steamwatch*.
 This mirrors the Steam Store data model
 And adds *Snapshots* for collected data::
 
-    [App] <-- [AppPackage] --> [Package]
-                                   ^
-                                   |
-                               [Snapshot]
+    [Watch] --> [App] <-- [AppPackage] --> [Package] <-- [PackageStats]
+                                               ^
+                                               |
+                                           [Snapshot] --> [Currency]
 
 The main business obect is the *App*, which is either a *Game*
 or a piece downloadable content (DLC).
+Apps, Packages and Snapshots are shared by all users,
+each user's watchlist is a set of *Watches*.
 
 However, sales relevant information if available for *Packages*, which
 are aggregates of one or more *Apps*.
 Each *App* will have at least one default package with the app as its single
 member.
 
+*PackageStats* aggregate the Snapshots of each Package and region
+(e.g. the lowest price), so that they can be looked up
+without reading all Snapshots.
+
+Snapshots store their timestamp in seconds since the epoch (UTC)
+and the id of a *Currency* instead of the currency code,
+which keeps the rows and the timestamp index small.
+
 .. note::
     Not sure whether this is guaranteed by the steam API.
     If not, we can create the default package ourselves.
 
 '''
+import calendar
 import logging
 from datetime import datetime
 
@@ -35,6 +48,12 @@ from peewee import DateField
 from peewee import DateTimeField
 from peewee import BooleanField
 from peewee import IntegerField
+from peewee import TimestampField
+from peewee import fn
+from peewee import Expression
+from peewee import SQL
+from playhouse.migrate import SqliteMigrator
+from playhouse.migrate import migrate
 
 
 LOG = logging.getLogger(__name__)
@@ -46,8 +65,18 @@ LOG = logging.getLogger(__name__)
 # https://peewee.readthedocs.org/en/latest/peewee/database.html#run-time-database-configuration
 _db = SqliteDatabase(None)
 
+# stay below SQLite's limit for variables per statement
+_BATCH_SIZE = 400
+
+# currency codes by id and ids by code, see `Currency`
+_currency_codes = {}
+_currency_ids = {}
+
+# seconds since the epoch for a timestamp stored as text by older versions
+_EPOCH_SECONDS = "CAST(strftime('%s', {c}) AS INTEGER)"
 
-def init(db_path):
+
+def init(db_path, owner=None):
     '''Initialize the SQLite DB at the given ``db_path``.
 
     This is normally called from the
@@ -56,10 +85,366 @@ def init(db_path):
 
     The DB file and tables inside the datebase will be created
     if they do not exist.
+    Columns that were added in later versions are added to existing tables
+    and Snapshots from versions before :class:`Currency` are converted.
+
+    :param str owner:
+        *optional*
+        The user who adopts all enabled Apps of a database from a version
+        without per-user watchlists, see :meth:`Watch.adopt`.
     '''
     _db.init(db_path)
     _db.connect()
-    _db.create_tables([App, Package, AppPackage, Snapshot], safe=True)
+    _currency_codes.clear()
+    _currency_ids.clear()
+    models = [App, Package, AppPackage, Currency, Snapshot, PackageStats,
+              FetchRun, FetchRunApp, Lease, Watch, ReadCursor]
+    existing = _db.get_tables()
+    _db.create_tables(models, safe=True)
+    if Snapshot._meta.db_table in existing:
+        _compact_snapshots()
+    added = _upgrade(models, existing, owner)
+
+    _db.execute_sql(_snapshot_view(
+        'snapshot_full', 'snapshot',
+        [f.db_column for f in Snapshot._meta.sorted_fields]))
+    for currency in Currency.select():
+        Currency._remember(currency.id, currency.code)
+
+    if ('package', 'release_date') in added:
+        _backfill_release()
+    if PackageStats._meta.db_table not in existing:
+        PackageStats.rebuild()
+
+
+def _upgrade(models, tables, owner):
+    '''Add columns to existing tables for fields that do not exist
+    in the database yet.
+
+    If the database had Apps but no watchlists before (``tables``),
+    ``owner`` watches all enabled Apps.
+
+    :returns:
+        A list of ``(table, column)`` tuples for the columns that were added.
+    '''
+    migrator = SqliteMigrator(_db)
+    added = []
+    for model in models:
+        table = model._meta.db_table
+        existing = [c.name for c in _db.get_columns(table)]
+        for field in model._meta.sorted_fields:
+            if field.db_column not in existing:
+                LOG.info('Add column {c!r} to {t!r}.'.format(
+                    c=field.db_column, t=table))
+                migrate(migrator.add_column(table, field.db_column, field))
+                added.append((table, field.db_column))
+
+    watch_table = Watch._meta.db_table
+    if owner and App._meta.db_table in tables and watch_table not in tables:
+        Watch.adopt(owner)
+
+    return added
+
+
+def _compact_snapshots():
+    '''Convert the snapshot table of older versions, which stored
+    timestamps as text and the currency code in each row.
+
+    The snapshots are copied to a new table with timestamps in seconds
+    since the epoch and the ids of :class:`Currency` codes,
+    the times in the :class:`PackageStats` are converted in place
+    and the database file is compacted afterwards.
+    This takes a while for a long history, but happens only once.
+    '''
+    columns = [c.name for c in _db.get_columns('snapshot')]
+    if 'currency_id' in columns:
+        return
+
+    LOG.info('Convert timestamps and currencies of all snapshots.')
+    source = []
+    for field in Snapshot._meta.sorted_fields:
+        if field.name == 'timestamp':
+            source.append(_EPOCH_SECONDS.format(c='o.timestamp'))
+        elif field.name == 'currency':
+            source.append('(SELECT c.id FROM currency AS c'
+                          ' WHERE c.code = o.currency)')
+        elif field.db_column in columns:
+            source.append('o.' + field.db_column)
+        else:
+            source.append('NULL')
+
+    with _db.atomic():
+        # the view refers to the old table
+        _db.execute_sql('DROP VIEW IF EXISTS snapshot_full')
+        _db.execute_sql('INSERT OR IGNORE INTO currency (code)'
+                        ' SELECT DISTINCT currency FROM snapshot'
+                        ' WHERE currency IS NOT NULL')
+        _db.execute_sql('ALTER TABLE snapshot RENAME TO snapshot_old')
+        indexes = _db.execute_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+            " AND tbl_name = 'snapshot_old' AND sql IS NOT NULL").fetchall()
+        for (index,) in indexes:
+            _db.execute_sql('DROP INDEX {}'.format(index))
+        _db.create_table(Snapshot)
+        _db.execute_sql(
+            'INSERT INTO snapshot ({c}) SELECT {s} FROM snapshot_old AS o'
+            .format(c=', '.join(f.db_column
+                                for f in Snapshot._meta.sorted_fields),
+                    s=', '.join(source)))
+        _db.execute_sql('DROP TABLE snapshot_old')
+        # indexes are faster to create once the rows are in place
+        Snapshot._create_indexes()
+        _db.execute_sql(
+            'UPDATE package_stats SET first_seen = {f}, last_change = {c}'
+            " WHERE typeof(first_seen) = 'text'".format(
+                f=_EPOCH_SECONDS.format(c='first_seen'),
+                c=_EPOCH_SECONDS.format(c='last_change')))
+
+    _db.execute_sql('VACUUM')
+
+
+def _snapshot_view(name, table, columns):
+    '''SQL to create the view ``name`` with all fields of the snapshots
+    in ``table``, like :meth:`Snapshot.select_full`,
+    with the currency code instead of its id.
+
+    Raw queries that read the :data:`DELTA_FIELDS` or the currency
+    use the view ``snapshot_full`` instead of the ``snapshot`` table.
+
+    :param list columns:
+        The columns of ``table``; tables of older versions
+        without ``keyframe`` or ``currency_id`` are converted
+        like in :func:`_compact_snapshots`.
+    '''
+    schema = table.rpartition('.')[0]
+    currencies = schema + '.currency' if schema else 'currency'
+
+    def stored(column):
+        if 'keyframe' not in columns:
+            return 's.' + column
+        return ('COALESCE(s.{c}, (SELECT k.{c} FROM {t} AS k'
+                ' WHERE k.id = s.keyframe))').format(c=column, t=table)
+
+    if 'currency_id' in columns:
+        timestamp = 's.timestamp'
+        currency = '(SELECT c.code FROM {t} AS c WHERE c.id = {i})'.format(
+            t=currencies, i=stored('currency_id'))
+    else:
+        timestamp = _EPOCH_SECONDS.format(c='s.timestamp')
+        currency = stored('currency')
+    return (
+        'CREATE VIEW IF NOT EXISTS {v} AS SELECT s.id, s.package_id,'
+        ' {ts} AS timestamp, s.region, {c} AS currency, s.price,'
+        ' {r} AS release_date, s.coming_soon, s.supports_linux,'
+        ' {k} AS keyframe FROM {t} AS s'.format(
+            v=name, ts=timestamp, c=currency, r=stored('release_date'),
+            k='s.keyframe' if 'keyframe' in columns else 'NULL', t=table)
+    )
+
+
+def merge(path):
+    '''Merge the database at ``path`` into the current database.
+
+    Apps, Packages and their links are matched by ``steamid``;
+    records that do not exist in the current database are added.
+    Existing Apps take the fetch status from the other database
+    if it was fetched more recently there, other properties
+    (e.g. ``enabled``) are kept.
+    Watches are added for owners that do not watch the App yet.
+
+    Snapshots are added with all fields unless the current database
+    has a snapshot for the same package and timestamp.
+    Afterwards, snapshots that do not differ from their predecessor
+    are removed (unless they are the keyframe of a delta snapshot),
+    e.g. for packages that were fetched for Apps in different shards,
+    and the :class:`PackageStats` are rebuilt.
+
+    :param str path:
+        Path to the SQLite database to merge.
+    '''
+    _db.execute_sql('ATTACH DATABASE ? AS other', (path,))
+    try:
+        columns = [row[1] for row in
+                   _db.execute_sql('PRAGMA other.table_info(snapshot)')]
+        _db.execute_sql(_snapshot_view('temp.other_snapshot', 'other.snapshot',
+                                       columns))
+        with _db.atomic():
+            for statement in _MERGE_STATEMENTS:
+                _db.execute_sql(statement)
+    finally:
+        _db.execute_sql('DROP VIEW IF EXISTS temp.other_snapshot')
+        _db.execute_sql('DETACH DATABASE other')
+
+    _backfill_release()
+    PackageStats.rebuild()
+
+
+# removes snapshots of the packages selected by ``{packages}``
+# that do not differ from their predecessor
+_REMOVE_REPEATS = '''DELETE FROM snapshot WHERE id IN (
+        SELECT id FROM (
+            SELECT id, currency, price, release_date,
+                coming_soon, supports_linux,
+                LAG(id) OVER w AS prev_id,
+                LAG(currency) OVER w AS prev_currency,
+                LAG(price) OVER w AS prev_price,
+                LAG(release_date) OVER w AS prev_release_date,
+                LAG(coming_soon) OVER w AS prev_coming_soon,
+                LAG(supports_linux) OVER w AS prev_supports_linux
+            FROM snapshot_full
+            WHERE package_id IN ({packages})
+            WINDOW w AS (
+                PARTITION BY package_id, region ORDER BY timestamp, id)
+        )
+        WHERE prev_id IS NOT NULL
+        AND id NOT IN (
+            SELECT keyframe FROM snapshot WHERE keyframe IS NOT NULL)
+        AND currency IS prev_currency
+        AND price IS prev_price
+        AND release_date IS prev_release_date
+        AND coming_soon IS prev_coming_soon
+        AND supports_linux IS prev_supports_linux)'''
+
+
+_MERGE_STATEMENTS = (
+    # apps
+    '''INSERT OR IGNORE INTO app
+        (steamid, kind, enabled, name, last_fetch, failures, skip_until)
+    SELECT steamid, kind, enabled, name, last_fetch, failures, skip_until
+    FROM other.app''',
+    '''UPDATE app SET
+        (name, last_fetch, failures, skip_until) = (
+            SELECT o.name, o.last_fetch, o.failures, o.skip_until
+            FROM other.app AS o WHERE o.steamid = app.steamid)
+    WHERE EXISTS (
+        SELECT 1 FROM other.app AS o
+        WHERE o.steamid = app.steamid
+        AND o.last_fetch > COALESCE(app.last_fetch, ''))''',
+    # watches
+    '''INSERT OR IGNORE INTO watch (owner, app_id, threshold, threshold_hit)
+    SELECT ow.owner, a.id, ow.threshold, ow.threshold_hit
+    FROM other.watch AS ow
+    JOIN other.app AS oa ON oa.id = ow.app_id
+    JOIN app AS a ON a.steamid = oa.steamid''',
+    # packages
+    '''INSERT OR IGNORE INTO package
+        (steamid, name, release_date, coming_soon, failures, skip_until)
+    SELECT steamid, name, release_date, coming_soon, failures, skip_until
+    FROM other.package''',
+    # links
+    '''INSERT OR IGNORE INTO apppackage (app_id, package_id)
+    SELECT a.id, p.id
+    FROM other.apppackage AS oap
+    JOIN other.app AS oa ON oa.id = oap.app_id
+    JOIN other.package AS op ON op.id = oap.package_id
+    JOIN app AS a ON a.steamid = oa.steamid
+    JOIN package AS p ON p.steamid = op.steamid''',
+    # snapshots
+    '''INSERT OR IGNORE INTO currency (code)
+    SELECT DISTINCT currency FROM temp.other_snapshot
+    WHERE currency IS NOT NULL''',
+    '''INSERT INTO snapshot
+        (package_id, timestamp, region, currency_id, price,
+         release_date, coming_soon, supports_linux)
+    SELECT p.id, os.timestamp, os.region,
+        (SELECT c.id FROM currency AS c WHERE c.code = os.currency),
+        os.price, os.release_date, os.coming_soon, os.supports_linux
+    FROM temp.other_snapshot AS os
+    JOIN other.package AS op ON op.id = os.package_id
+    JOIN package AS p ON p.steamid = op.steamid
+    WHERE NOT EXISTS (
+        SELECT 1 FROM snapshot AS s
+        WHERE s.package_id = p.id AND s.timestamp = os.timestamp
+        AND s.region IS os.region)''',
+    # remove snapshots that repeat their predecessor
+    _REMOVE_REPEATS.format(packages='''SELECT p.id FROM package AS p
+                JOIN other.package AS op ON op.steamid = p.steamid'''),
+)
+
+
+def add_snapshots(rows):
+    '''Add snapshots that were recorded elsewhere,
+    e.g. replayed from the :mod:`steamwatch.responselog`.
+
+    Like with :func:`merge`, a snapshot is skipped if there is one
+    for the same package, region and timestamp,
+    snapshots that do not differ from their predecessor are removed
+    and the :class:`PackageStats` are rebuilt.
+
+    :param iterable rows:
+        ``(package_id, timestamp, region, fields)`` tuples
+        with the ``timestamp`` in seconds since the epoch
+        and the ``fields`` as returned by :meth:`Snapshot.fields_from_apidata`.
+    :returns:
+        The number of snapshots that were added,
+        not counting those that were removed again.
+    :rtype: int
+    '''
+    fields = [Snapshot._meta.fields[name] for name in _REPLAY_FIELDS]
+    columns = ['package_id', 'timestamp', 'region', 'currency_id']
+    columns.extend(field.db_column for field in fields)
+    insert = _ADD_SNAPSHOT.format(
+        columns=', '.join(columns),
+        values=', '.join('?' for _ in columns))
+    before = Snapshot.select().count()
+    packages = set()
+    _db.execute_sql('CREATE TEMP TABLE added_package (id INTEGER PRIMARY KEY)')
+    try:
+        with _db.atomic():
+            cursor = _db.get_cursor()
+            batch = []
+            # new currencies are not cached until they are committed
+            currencies = {}
+            for package_id, timestamp, region, values in rows:
+                code = values['currency']
+                if code is not None and code not in currencies:
+                    currencies[code] = Currency.id_for(code)
+                params = [package_id, timestamp, region, currencies.get(code)]
+                params.extend(field.db_value(values[field.name])
+                              for field in fields)
+                params.extend((package_id, timestamp, region))
+                batch.append(params)
+                packages.add(package_id)
+                if len(batch) >= _BATCH_SIZE:
+                    cursor.executemany(insert, batch)
+                    batch = []
+            cursor.executemany(insert, batch)
+            cursor.executemany('INSERT INTO temp.added_package VALUES (?)',
+                               [(package_id,) for package_id in packages])
+            _db.execute_sql(_REMOVE_REPEATS.format(
+                packages='SELECT id FROM temp.added_package'))
+    finally:
+        _db.execute_sql('DROP TABLE temp.added_package')
+
+    added = Snapshot.select().count() - before
+    LOG.info('Added {n} snapshots.'.format(n=added))
+    _backfill_release()
+    PackageStats.rebuild()
+    return added
+
+
+# besides the currency
+_REPLAY_FIELDS = ('price', 'release_date', 'coming_soon', 'supports_linux')
+
+_ADD_SNAPSHOT = '''INSERT INTO snapshot ({columns})
+    SELECT {values}
+    WHERE NOT EXISTS (
+        SELECT 1 FROM snapshot AS s
+        WHERE s.package_id = ? AND s.timestamp = ? AND s.region IS ?)'''
+
+
+def _backfill_release():
+    '''Copy release info from the most recent snapshot to each package.'''
+    LOG.info('Copy release dates from snapshots to packages.')
+    latest = ('(SELECT s.{c} FROM snapshot_full AS s'
+              ' WHERE s.package_id = package.id'
+              ' ORDER BY s.timestamp DESC, s.id DESC LIMIT 1)')
+    _db.execute_sql(
+        'UPDATE package SET release_date = {r}, coming_soon = {c}'.format(
+            r=latest.format(c='release_date'),
+            c=latest.format(c='coming_soon'),
+        )
+    )
 
 
 class BaseModel(Model):
@@ -70,7 +455,50 @@ class BaseModel(Model):
         database = _db  # global
 
 
-class App(BaseModel):
+class QuarantineMixin(object):
+    '''Failure counting for models with ``failures`` and ``skip_until``
+    fields.
+
+    Each consecutive failure doubles the time for which the entity is
+    *quarantined*, i.e. skipped during fetch.
+    A success resets the counter.
+    '''
+
+    def record_failure(self, backoff, limit, now=None):
+        '''Count a failure and quarantine this entity.
+
+        The quarantine lasts ``backoff`` after the first failure and doubles
+        with each consecutive failure, up to ``limit``.
+        The change is not saved to the database.
+
+        :param timedelta backoff:
+            Duration of the quarantine after the first failure.
+        :param timedelta limit:
+            Maximum duration of the quarantine.
+        :param datetime now:
+            *optional*
+            The time of the failure, defaults to the current time (UTC).
+        '''
+        now = now or datetime.utcnow()
+        self.failures = (self.failures or 0) + 1
+        # cap the exponent, the result is limited anyway
+        skip = backoff * 2 ** min(self.failures - 1, 32)
+        self.skip_until = now + min(skip, limit)
+
+    def record_success(self):
+        '''Reset the failure count and end the quarantine.
+        The change is not saved to the database.
+        '''
+        self.failures = 0
+        self.skip_until = None
+
+    @property
+    def quarantined(self):
+        '''*True* if this entity is currently quarantined.'''
+        return bool(self.skip_until and self.skip_until > datetime.utcnow())
+
+
+class App(BaseModel, QuarantineMixin):
     '''A game or DLC on the steam store.
 
     :var str steamid:
@@ -78,21 +506,27 @@ class App(BaseModel):
     :var str kind:
         Whther this is a game, DLC or somethng else.
     :var bool enabled:
-        Whether *watch* is enabled for this *App*.
+        Whether *watch* is enabled for this *App*,
+        i.e. whether any user watches it.
         Disabled Apps will not be updated e.g. in
         :meth:`steamwatch.application.Application.fetch`.
     :var str name:
         The display name for this *App*.
-    :var int threshold:
-        Price threshold for triggering ???
-        **NOT IMPLEMENTED**
+    :var datetime last_fetch:
+        When this App was last fetched from the store, *None* if never.
+    :var int failures:
+        Number of consecutive failed fetches.
+    :var datetime skip_until:
+        The App is quarantined and not fetched until this time.
     '''
 
     steamid = CharField(unique=True, index=True)
     kind = CharField()
     enabled = BooleanField(default=True, index=True)
     name = CharField(null=True)
-    threshold = IntegerField(null=True)
+    last_fetch = DateTimeField(null=True, index=True)
+    failures = IntegerField(null=True, default=0)
+    skip_until = DateTimeField(null=True, index=True)
 
     def link(self, package):
         '''Link this App to the given :class:`Package`.'''
@@ -119,6 +553,48 @@ class App(BaseModel):
         '''A list of :class:`Package` instances that are linked to this app.'''
         return [ap.package for ap in self.app_packages]
 
+    @classmethod
+    def current_prices(cls, region=None):
+        '''Get the current price for Apps that are watched with a
+        ``threshold``.
+
+        The current price of an App is the lowest price among the most
+        recent snapshots of its packages.
+
+        :param str region:
+            *optional*
+            Consider only snapshots for this region.
+        :returns:
+            A *dict* that maps ``App.id`` to the current price.
+        :rtype: dict
+        '''
+        with_threshold = (Watch.select(Watch.app)
+                          .where(Watch.threshold.is_null(False)))
+        query = (PackageStats.current(region)
+                 .select(AppPackage.app, fn.MIN(PackageStats.price))
+                 .join(AppPackage,
+                       on=(AppPackage.package == PackageStats.package))
+                 .where(AppPackage.app << with_threshold)
+                 .group_by(AppPackage.app))
+        return {app_id: price for app_id, price in query.tuples()}
+
+    @classmethod
+    def change_counts(cls, since):
+        '''Count the snapshots recorded for each App ``since`` the given
+        time.
+
+        :param datetime since:
+            Count snapshots recorded at or after this time.
+        :returns:
+            A *dict* that maps ``App.id`` to the number of snapshots.
+        :rtype: dict
+        '''
+        query = (Snapshot.select(AppPackage.app, fn.COUNT(Snapshot.id))
+                 .join(AppPackage, on=(AppPackage.package == Snapshot.package))
+                 .where(Snapshot.timestamp >= since)
+                 .group_by(AppPackage.app))
+        return {app_id: count for app_id, count in query.tuples()}
+
     @classmethod
     def by_steamid(cls, steamid):
         '''Retrieve an App from the database by its ``steamid``.
@@ -130,6 +606,40 @@ class App(BaseModel):
         '''
         return cls.select().where(cls.steamid == steamid).limit(1).first()
 
+    @classmethod
+    def by_steamids(cls, steamids):
+        '''Retrieve the Apps with the given ``steamids``.
+
+        :param list steamids:
+            The ``appids`` to retrieve.
+        :returns:
+            A *dict* that maps ``steamid`` to :class:`App` for the Apps
+            that exist in the database.
+        :rtype: dict
+        '''
+        found = {}
+        for batch in _batches(list(steamids)):
+            for app in cls.select().where(cls.steamid << batch):
+                found[app.steamid] = app
+        return found
+
+    @classmethod
+    def insert_apidata(cls, apidata):
+        '''Add Apps with data from the ``storeapi`` in batches.
+
+        Apps that already exist are left unchanged.
+
+        :param dict apidata:
+            A *dict* that maps ``steamid`` to app details,
+            see :meth:`from_apidata`.
+        '''
+        rows = [{'steamid': steamid, 'kind': data['type'], 'enabled': True,
+                 'name': data.get('name'), 'failures': 0}
+                for steamid, data in apidata.items()]
+        with _db.atomic():
+            for batch in _batches(rows):
+                cls.insert_many(batch).on_conflict('IGNORE').execute()
+
     @classmethod
     def from_apidata(cls, steamid, apidata, **extra):
         '''Create an App with data from the ``storeapi``.
@@ -145,7 +655,6 @@ class App(BaseModel):
                 'type':      '<type>',           # required
                 'enabled':   True,
                 'name':      'Display Name',
-                'threshold': 123,
             }
 
         :param str steamid:
@@ -161,39 +670,71 @@ class App(BaseModel):
             kind=apidata['type'],
             enabled=extra.get('enabled', True),
             name=apidata.get('name'),
-            threshold=extra.get('threshold'),
         )
 
     def __repr__(self):
         return '<App id={s.id!r} steamid={s.steamid!r}>'.format(s=self)
 
 
-class Package(BaseModel):
+class Package(BaseModel, QuarantineMixin):
     '''A *Package* on the steam store.
 
     :var str steamid:
         The id of this package on the steam store.
     :var str name:
         The display name for this package.
+    :var date release_date:
+        The release date from the most recent snapshot.
+    :var bool coming_soon:
+        The "coming soon" property from the most recent snapshot.
+    :var int failures:
+        Number of consecutive failed fetches.
+    :var datetime skip_until:
+        The Package is quarantined and not fetched until this time.
     '''
 
     steamid = CharField(unique=True, index=True)
     name = CharField(null=True)
+    release_date = DateField(null=True, index=True)
+    coming_soon = BooleanField(null=True, index=True)
+    failures = IntegerField(null=True, default=0)
+    skip_until = DateTimeField(null=True, index=True)
 
-    def record_snapshot(self, apidata):
+    def record_snapshot(self, apidata, region=None, keyframe_interval=None):
         '''Record a Snapshot from the given ``apidata``
-        *only if* it is different from the previously recorded snapshot.
+        *only if* it is different from the previously recorded snapshot
+        for the same ``region``.
+
+        The release info of the Package and its :class:`PackageStats`
+        are updated from the new snapshot.
 
         :param dict apidata:
             *dict* with package details; accepts the format from
             :func:`steamwatch.storeapi.packagedetails`.
+        :param str region:
+            *optional*
+            The country code for which the details were fetched.
+        :param timedelta keyframe_interval:
+            *optional*
+            Store the snapshot as a delta to a keyframe
+            that is at most this old (see :meth:`Snapshot.save_delta`)
+            instead of storing all fields.
         :returns:
             The :class:`Snapshot` instance if one was created, else *None*.
         :rtype: :class:`Snapshot`
         '''
-        snapshot = Snapshot.from_apidata(self, apidata)
-        if snapshot.is_different():  # to previous
-            snapshot.save()
+        snapshot = Snapshot.from_apidata(self, apidata, region=region)
+        previous = snapshot.previous
+        if snapshot.is_different(previous):
+            with _db.atomic():
+                if keyframe_interval:
+                    snapshot.save_delta(previous, keyframe_interval)
+                else:
+                    snapshot.save()
+                self.release_date = snapshot.release_date
+                self.coming_soon = snapshot.coming_soon
+                self.save()
+                PackageStats.record(snapshot)
             return snapshot
 
     def link(self, app):
@@ -206,9 +747,9 @@ class Package(BaseModel):
 
     def recent_snapshots(self, limit=None):
         '''Get a list of recent :class:`Snapshot`s for this *Package*.'''
-        query = (self.snapshots
-                 .select()
-                 .order_by(Snapshot.timestamp.desc())
+        query = (Snapshot.select_full()
+                 .where(Snapshot.package == self)
+                 .order_by(Snapshot.timestamp.desc(), Snapshot.id.desc())
                  .limit(limit or 1)
                 )
         return [snapshot for snapshot in query]
@@ -226,6 +767,20 @@ class Package(BaseModel):
         '''Find a Package by its ``steamid``'''
         return cls.select().where(cls.steamid == steamid).limit(1).first()
 
+    @classmethod
+    def by_ids(cls, ids):
+        '''Retrieve the Packages with the given database ``ids``.
+
+        :returns:
+            A *dict* that maps ``id`` to :class:`Package`.
+        :rtype: dict
+        '''
+        found = {}
+        for batch in _batches(list(ids)):
+            for package in cls.select().where(cls.id << batch):
+                found[package.id] = package
+        return found
+
     @classmethod
     def from_apidata(cls, steamid, apidata):
         '''Create a Package with data from the ``storeapi``.
@@ -270,6 +825,66 @@ class AppPackage(BaseModel):
         return '<AppPackage app={s.app!r} package={s.package!r}>'.format(s=self)
 
 
+class Currency(BaseModel):
+    '''A currency code, :class:`Snapshot` stores the ``id`` of the
+    Currency instead of the code.
+
+    :var str code: The currency code, e.g. "EUR".
+    '''
+
+    code = CharField(unique=True)
+
+    @classmethod
+    def id_for(cls, code):
+        '''The ``id`` of the currency ``code``, added if it is new.'''
+        try:
+            return _currency_ids[code]
+        except KeyError:
+            currency, _ = cls.get_or_create(code=code)
+            cls._remember(currency.id, code)
+            return currency.id
+
+    @classmethod
+    def code_for(cls, currency_id):
+        '''The currency code with the given ``currency_id``.'''
+        try:
+            return _currency_codes[currency_id]
+        except KeyError:
+            code = cls.get(cls.id == currency_id).code
+            cls._remember(currency_id, code)
+            return code
+
+    @staticmethod
+    def _remember(currency_id, code):
+        # a currency that was added in a transaction is gone
+        # if the transaction is rolled back, so it is not cached
+        # (the currencies in the database are cached by :func:`init`)
+        if not _db.transaction_depth():
+            _currency_ids[code] = currency_id
+            _currency_codes[currency_id] = code
+
+    def __repr__(self):
+        return '<Currency code={s.code!r}>'.format(s=self)
+
+
+class CurrencyField(IntegerField):
+    '''Holds a currency code, stored as the ``id`` of a :class:`Currency`.'''
+
+    def db_value(self, value):
+        return None if value is None else Currency.id_for(value)
+
+    def python_value(self, value):
+        if isinstance(value, int):
+            return Currency.code_for(value)
+        return value
+
+
+# fields that a delta snapshot stores only if they differ from its keyframe;
+# the price changes most of the time and SQLite stores booleans
+# without any payload, so these are always stored
+DELTA_FIELDS = ('currency', 'release_date')
+
+
 class Snapshot(BaseModel):
     '''A snapshot of :class:`Package` related data.
 
@@ -281,7 +896,8 @@ class Snapshot(BaseModel):
     :var object package:
         The :class:`Package`
     :var datetime timestamp:
-        Date nad time when this snapshot was recorded.
+        Date and time (UTC) when this snapshot was recorded,
+        stored in seconds since the epoch.
     :var str currency:
         The recorded *currency* property.
     :var int price:
@@ -292,18 +908,26 @@ class Snapshot(BaseModel):
         The recorded "coming soon" property.
     :var bool supports_linux:
         The recorded "supports linux" property.
+    :var str region:
+        The country code for which the values were recorded.
+    :var int keyframe:
+        The ``id`` of the snapshot that holds the :data:`DELTA_FIELDS`
+        which this snapshot does not store, see :meth:`save_delta`.
+        *None* for snapshots that store all fields.
     '''
 
     package = ForeignKeyField(Package, related_name='snapshots')
-    timestamp = DateTimeField(index=True)
-    currency = CharField(null=True)
+    timestamp = TimestampField(utc=True, index=True)
+    region = CharField(null=True, index=True)
+    currency = CurrencyField(null=True, db_column='currency_id')
     price = IntegerField(null=True)
     release_date = DateField(null=True)
     coming_soon = BooleanField(null=True)
     supports_linux = BooleanField()
+    keyframe = IntegerField(null=True)
 
     @classmethod
-    def from_apidata(cls, pkg, apidata):
+    def from_apidata(cls, pkg, apidata, region=None):
         '''Create a Snapshot instance with package details from the storeapi.
 
         The ``apidata`` dict is the same format as created by
@@ -327,26 +951,120 @@ class Snapshot(BaseModel):
 
         The Snapshot is not saved to the database.
         '''
-        price = apidata.get('price', {})
-        release = apidata.get('release_date', {})
         return cls(
             package=pkg,
-            timestamp=datetime.utcnow(),
-            currency=price.get('currency'),
-            price=price.get('final'),
-            release_date=_parse_date(release.get('date', '')),
-            coming_soon=release.get('coming_soon'),
-            supports_linux=apidata.get('platforms', {}).get('linux', False)
+            timestamp=datetime.utcnow().replace(microsecond=0),
+            region=region,
+            **cls.fields_from_apidata(apidata)
         )
 
+    @staticmethod
+    def fields_from_apidata(apidata):
+        '''The values of the tracked fields in ``apidata``
+        (see :meth:`from_apidata`) as a dict.
+
+        This does not access the database.
+        '''
+        price = apidata.get('price', {})
+        release = apidata.get('release_date', {})
+        return {
+            'currency': price.get('currency'),
+            'price': price.get('final'),
+            'release_date': _parse_date(release.get('date', '')),
+            'coming_soon': release.get('coming_soon'),
+            'supports_linux': apidata.get('platforms', {}).get('linux', False),
+        }
+
+    @classmethod
+    def select_full(cls, *selection):
+        '''Select Snapshots with all fields, like ``select()``.
+
+        Fields that a delta snapshot does not store are taken from
+        its keyframe (see :meth:`save_delta`).
+        Other models or columns can be added to the ``selection``.
+        '''
+        keyframe = cls.alias()
+        columns = []
+        for field in cls._meta.sorted_fields:
+            if field.name in DELTA_FIELDS:
+                stored = (keyframe.select(getattr(keyframe, field.name))
+                          .where(keyframe.id == cls.keyframe))
+                field = fn.COALESCE(field, stored).alias(field.name)
+            columns.append(field)
+        columns.extend(selection)
+        return cls.select(*columns)
+
+    def prepared(self):
+        # values taken from the keyframe are not converted by peewee
+        for name in DELTA_FIELDS:
+            field = self._meta.fields[name]
+            setattr(self, name, field.python_value(getattr(self, name)))
+        self._dirty.clear()
+
+    def save_delta(self, previous, interval):
+        '''Save this new Snapshot, storing only the fields that differ
+        from the keyframe of the ``previous`` snapshot.
+
+        Fields from :data:`DELTA_FIELDS` that are equal to the keyframe
+        are stored as NULL, all other fields are always stored.
+        The snapshot is saved with all fields and becomes a keyframe itself
+        if there is no ``previous`` snapshot,
+        if the keyframe is older than ``interval``
+        or if a field changed to *None*.
+        The instance keeps all values.
+
+        :param previous:
+            The previous :class:`Snapshot` or *None*.
+        :param timedelta interval:
+            The maximum age of a keyframe.
+        '''
+        keyframe = None
+        if previous:
+            keyframe = Snapshot.get(
+                Snapshot.id == (previous.keyframe or previous.id))
+            if self.timestamp - keyframe.timestamp >= interval:
+                keyframe = None
+
+        values = {name: getattr(self, name) for name in DELTA_FIELDS}
+        if keyframe and all(
+                values[name] is not None
+                or getattr(keyframe, name) is None
+                for name in DELTA_FIELDS):
+            self.keyframe = keyframe.id
+            for name in DELTA_FIELDS:
+                if values[name] == getattr(keyframe, name):
+                    setattr(self, name, None)
+        else:
+            self.keyframe = None
+
+        try:
+            self.save()
+        finally:
+            for name, value in values.items():
+                setattr(self, name, value)
+            self._dirty.clear()
+
     @property
     def previous(self):
-        '''Get the Snapshot that was recorded before this one.'''
-        return Snapshot.select().where(
+        '''Get the Snapshot that was recorded before this one
+        for the same region.
+
+        Snapshots within the same second are ordered by their ``id``,
+        a Snapshot that is not saved yet comes after them.
+        '''
+        if self.id is None:
+            before = Snapshot.timestamp <= self.timestamp
+        else:
+            before = ((Snapshot.timestamp < self.timestamp)
+                      | ((Snapshot.timestamp == self.timestamp)
+                         & (Snapshot.id < self.id)))
+        return Snapshot.select_full().where(
             Snapshot.package == self.package,
-            Snapshot.timestamp < self.timestamp
+            Snapshot.region >> self.region,  # IS also matches NULL
+            before
         ).order_by(
-            Snapshot.timestamp.desc()
+            Snapshot.timestamp.desc(),
+            Snapshot.id.desc()
         ).limit(1).first()
 
     def diff(self, other=None):
@@ -398,24 +1116,948 @@ class Snapshot(BaseModel):
         return bool(self.diff(other=other))
 
     @classmethod
-    def recent(cls, limit=None):
-        '''List recent snapshots and their associated packages.'''
+    def recent(cls, limit=None, region=None, owner=None, after=None):
+        '''List recent snapshots and their associated packages.
+
+        :param int limit:
+            *optional*
+            Limit the number of results.
+        :param str region:
+            *optional*
+            List only snapshots for this region.
+        :param str owner:
+            *optional*
+            List only snapshots for Apps watched by this user.
+        :param int after:
+            *optional*
+            List only snapshots with an ``id`` greater than this,
+            oldest first.
+        '''
         query = (
-            cls.select(cls, Package)
+            cls.select_full(Package)
             .join(Package)
-            .order_by(cls.timestamp.desc())
+            .order_by(cls.timestamp.desc(), cls.id.desc())
         )
+        # with a limit, the timestamp index is read in order,
+        # see `recent_rows`
+        unindexed = _unindexed if limit and after is None else _identity
+        if region:
+            query = query.where(unindexed(cls.region) == region)
+        if owner:
+            watched = (AppPackage.select(AppPackage.package)
+                       .join(Watch, on=(Watch.app == AppPackage.app))
+                       .where(Watch.owner == owner))
+            query = query.where(unindexed(cls.package) << watched)
+        if after is not None:
+            # oldest first, so that a cursor can advance page by page
+            query = query.where(cls.id > after).order_by(cls.id)
         if limit:
             query = query.limit(limit)
         return query
 
+    @classmethod
+    def latest(cls, region=None):
+        '''Query the most recent snapshot for each package and region.
+
+        :param str region:
+            *optional*
+            Only snapshots for this region.
+        :returns:
+            A query for :class:`Snapshot` instances that can be refined,
+            e.g. to select certain packages.
+        '''
+        previous = cls.alias()
+        latest = (previous.select(previous.id)
+                  .where(previous.package == cls.package,
+                         previous.region >> cls.region)
+                  .order_by(previous.timestamp.desc(), previous.id.desc())
+                  .limit(1))
+        query = cls.select_full().where(cls.id == latest)
+        if region:
+            query = query.where(cls.region == region)
+        return query
+
+    @classmethod
+    def assign_region(cls, region):
+        '''Assign ``region`` to snapshots that were recorded without one,
+        i.e. before multiple regions were supported.
+        '''
+        updated = cls.update(region=region).where(cls.region >> None).execute()
+        if updated:
+            LOG.info('Assigned region {r!r} to {n} snapshots.'.format(
+                r=region, n=updated))
+            PackageStats.rebuild()
+
     def __repr__(self):
         return '<Snapshot id={s.id!r} package={s.package!r}>'.format(s=self)
 
 
+class PackageStats(BaseModel):
+    '''Aggregates over the :class:`Snapshot` history of a :class:`Package`
+    in one region.
+
+    The stats are updated with each new Snapshot
+    (see :meth:`Package.record_snapshot`)
+    and can be rebuilt from all Snapshots with :meth:`rebuild`.
+
+    :var object package: The *Package*.
+    :var str region: The region of the Snapshots.
+    :var int price: The price from the most recent Snapshot.
+    :var int lowest: The lowest price ever recorded.
+    :var int highest: The highest price ever recorded.
+    :var datetime first_seen: When the first Snapshot was recorded.
+    :var datetime last_change:
+        When the price last changed, ``first_seen`` if it never changed.
+    :var int changes: The number of price changes.
+    '''
+
+    package = ForeignKeyField(Package, related_name='stats')
+    region = CharField(null=True)
+    price = IntegerField(null=True)
+    lowest = IntegerField(null=True)
+    highest = IntegerField(null=True)
+    first_seen = TimestampField(utc=True)
+    last_change = TimestampField(utc=True)
+    changes = IntegerField(default=0)
+
+    class Meta:
+        db_table = 'package_stats'
+        primary_key = CompositeKey('package', 'region')
+
+    @classmethod
+    def record(cls, snapshot):
+        '''Update the stats for the package and region of ``snapshot``,
+        which must be the most recent Snapshot.
+        '''
+        where = (cls.package == snapshot.package_id,
+                 cls.region >> snapshot.region)  # IS also matches NULL
+        stats = cls.select().where(*where).limit(1).first()
+        price = snapshot.price
+        if stats is None:
+            cls.insert(
+                package=snapshot.package_id,
+                region=snapshot.region,
+                price=price,
+                lowest=price,
+                highest=price,
+                first_seen=snapshot.timestamp,
+                last_change=snapshot.timestamp,
+                changes=0,
+            ).execute()
+        elif price != stats.price:
+            cls.update(
+                price=price,
+                lowest=_extreme(min, stats.lowest, price),
+                highest=_extreme(max, stats.highest, price),
+                last_change=snapshot.timestamp,
+                changes=stats.changes + 1,
+            ).where(*where).execute()
+
+    @classmethod
+    def rebuild(cls):
+        '''Replace all stats with aggregates over all Snapshots.
+
+        :returns: The number of stats, one per package and region.
+        :rtype: int
+        '''
+        with _db.atomic():
+            cls.delete().execute()
+            cursor = _db.execute_sql(_REBUILD_STATS)
+        LOG.info('Rebuilt stats for {n} packages and regions.'.format(
+            n=cursor.rowcount))
+        return cursor.rowcount
+
+    @classmethod
+    def current(cls, region=None):
+        '''Query the stats, optionally only for ``region``.
+
+        :returns:
+            A query for :class:`PackageStats` instances that can be refined,
+            like :meth:`Snapshot.latest`.
+        '''
+        query = cls.select()
+        if region:
+            query = query.where(cls.region == region)
+        return query
+
+    @classmethod
+    def for_packages(cls, packages, region):
+        '''Get the stats of the given ``packages`` in ``region``.
+
+        :returns:
+            A *dict* that maps ``Package.id`` to :class:`PackageStats`.
+        :rtype: dict
+        '''
+        found = {}
+        for batch in _batches([p.id for p in packages]):
+            query = cls.current(region).where(cls.package << batch)
+            for stats in query:
+                found[stats.package_id] = stats
+        return found
+
+    def __repr__(self):
+        return ('<PackageStats package={s.package_id!r}'
+                ' region={s.region!r}>').format(s=self)
+
+
+# a price change is a snapshot with another price than its predecessor
+_REBUILD_STATS = '''INSERT INTO package_stats
+    (package_id, region, price, lowest, highest,
+     first_seen, last_change, changes)
+SELECT package_id, region,
+    MAX(CASE WHEN is_last THEN price END),
+    MIN(price), MAX(price), MIN(timestamp),
+    COALESCE(MAX(CASE WHEN changed THEN timestamp END), MIN(timestamp)),
+    SUM(changed)
+FROM (
+    SELECT package_id, region, timestamp, price,
+        LAG(id) OVER w IS NOT NULL AND price IS NOT LAG(price) OVER w
+            AS changed,
+        LEAD(id) OVER w IS NULL AS is_last
+    FROM snapshot
+    WINDOW w AS (PARTITION BY package_id, region ORDER BY timestamp, id)
+)
+GROUP BY package_id, region'''
+
+
+class FetchRun(BaseModel):
+    '''A run of :meth:`steamwatch.application.Application.fetch_all`.
+
+    The run records the Apps it is going to fetch as :class:`FetchRunApp`
+    entries and checks them off one by one,
+    so that an interrupted run can be resumed.
+    The entries are removed when the run is finished.
+
+    :var datetime started:
+        When the run was started.
+    :var datetime finished:
+        When the run was finished, *None* if it is not finished.
+    :var int planned:
+        Number of Apps the run was going to fetch.
+    :var int completed:
+        Number of Apps that were processed when the run finished.
+    '''
+
+    started = DateTimeField(index=True)
+    finished = DateTimeField(null=True, index=True)
+    planned = IntegerField(default=0)
+    completed = IntegerField(null=True)
+
+    class Meta:
+        db_table = 'fetch_run'
+
+    @classmethod
+    def start(cls, apps):
+        '''Start a new run for the given ``apps``.
+
+        Entries of other unfinished runs are discarded,
+        they cannot be resumed afterwards.
+
+        :param list apps:
+            The :class:`App` instances to fetch.
+        :returns:
+            The new FetchRun, **saved to the database**.
+        :rtype: :class:`FetchRun`
+        '''
+        FetchRunApp.delete().execute()
+        run = cls.create(started=datetime.utcnow(), planned=len(apps))
+        rows = [{'run': run.id, 'app': app.id} for app in apps]
+        with _db.atomic():
+            for batch in _batches(rows):
+                FetchRunApp.insert_many(batch).execute()
+        return run
+
+    @classmethod
+    def unfinished(cls):
+        '''Get the most recently started run if it is not finished.
+
+        :rtype: :class:`FetchRun`
+        '''
+        latest = cls.select().order_by(cls.started.desc()).limit(1).first()
+        if latest and latest.finished is None:
+            return latest
+
+    def pending(self):
+        '''List the Apps that were not yet processed in this run.'''
+        return (App.select()
+                .join(FetchRunApp)
+                .where(FetchRunApp.run == self, FetchRunApp.done >> None)
+                .order_by(FetchRunApp.app))
+
+    def checkpoint(self, app):
+        '''Mark the given :class:`App` as processed in this run.'''
+        (FetchRunApp.update(done=datetime.utcnow())
+         .where(FetchRunApp.run == self, FetchRunApp.app == app)
+         .execute())
+
+    def finish(self):
+        '''Mark this run as finished and remove its entries.'''
+        entries = FetchRunApp.select().where(FetchRunApp.run == self)
+        self.completed = entries.where(~(FetchRunApp.done >> None)).count()
+        self.finished = datetime.utcnow()
+        self.save()
+        FetchRunApp.delete().where(FetchRunApp.run == self).execute()
+
+    def __repr__(self):
+        return '<FetchRun id={s.id!r} started={s.started!r}>'.format(s=self)
+
+
+class FetchRunApp(BaseModel):
+    '''Progress of a :class:`FetchRun` for a single :class:`App`.
+
+    :var object run: The *FetchRun*.
+    :var object app: The *App* to fetch.
+    :var datetime done:
+        When the App was processed, *None* if it is still pending.
+    '''
+
+    run = ForeignKeyField(FetchRun, related_name='apps')
+    app = ForeignKeyField(App, related_name='fetch_runs')
+    done = DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'fetch_run_app'
+        primary_key = CompositeKey('run', 'app')
+
+    def __repr__(self):
+        return '<FetchRunApp run={s.run!r} app={s.app!r}>'.format(s=self)
+
+
+class Lease(BaseModel):
+    '''A time-limited claim of a fetch worker on an :class:`App`.
+
+    Several fetch workers can share one database; a worker only fetches
+    Apps it holds a lease for. Expired leases can be claimed by other
+    workers.
+
+    :var object app: The leased *App*.
+    :var str worker: Identifies the worker that holds the lease.
+    :var datetime expires: When the lease expires.
+    '''
+
+    app = ForeignKeyField(App, primary_key=True, related_name='leases')
+    worker = CharField(index=True)
+    expires = DateTimeField(index=True)
+
+    class Meta:
+        db_table = 'lease'
+
+    @classmethod
+    def claim(cls, worker, app_ids, duration):
+        '''Claim leases on the given Apps for the given ``worker``.
+
+        Apps that are leased by another worker are left out,
+        unless that lease has expired.
+        The claim is a single transaction, so concurrent workers cannot
+        claim the same App.
+
+        :param str worker:
+            Identifies the worker.
+        :param list app_ids:
+            The ``App.id`` values to claim.
+        :param timedelta duration:
+            How long the leases last.
+        :returns:
+            A list of :class:`App` instances for which the worker holds a
+            lease, in the order of ``app_ids``.
+        :rtype: list
+        '''
+        now = datetime.utcnow()
+        rows = [{'app': app_id, 'worker': worker, 'expires': now + duration}
+                for app_id in app_ids]
+        with _db.atomic():
+            # reclaim expired leases
+            cls.delete().where(cls.expires <= now).execute()
+            if rows:
+                cls.insert_many(rows).on_conflict('IGNORE').execute()
+
+        leased = App.select().join(cls).where(cls.worker == worker)
+        order = {app_id: index for index, app_id in enumerate(app_ids)}
+        return sorted([app for app in leased if app.id in order],
+                      key=lambda app: order[app.id])
+
+    @classmethod
+    def release(cls, worker, app=None):
+        '''Release the lease of ``worker`` on the given ``app``,
+        or all of its leases if no ``app`` is given.
+        '''
+        query = cls.delete().where(cls.worker == worker)
+        if app is not None:
+            query = query.where(cls.app == app)
+        query.execute()
+
+    def __repr__(self):
+        return '<Lease app={s.app_id!r} worker={s.worker!r}>'.format(s=self)
+
+
+class Watch(BaseModel):
+    '''An :class:`App` on the watchlist of a user.
+
+    All users share the Apps and their Snapshots,
+    so each App is fetched once no matter how many users watch it.
+
+    :var str owner: The user who watches the App.
+    :var object app: The watched *App*.
+    :var int threshold:
+        Price threshold; a ``threshold`` signal is emitted when the current
+        price drops to or below this value.
+    :var bool threshold_hit:
+        Whether the current price was at or below the ``threshold``
+        when thresholds were last checked.
+    '''
+
+    owner = CharField()
+    app = ForeignKeyField(App, related_name='watches')
+    threshold = IntegerField(null=True)
+    threshold_hit = BooleanField(null=True, default=False)
+
+    class Meta:
+        db_table = 'watch'
+        # the key doubles as index for the watchlist of an owner
+        primary_key = CompositeKey('owner', 'app')
+
+    @classmethod
+    def get_for(cls, owner, app):
+        '''Get the Watch of ``owner`` on ``app``, *None* if there is none.
+
+        :rtype: :class:`Watch`
+        '''
+        return cls.select().where(
+            cls.owner == owner, cls.app == app).limit(1).first()
+
+    @classmethod
+    def apps(cls, owner):
+        '''Query the Apps watched by ``owner``.'''
+        return App.select().join(cls).where(cls.owner == owner)
+
+    @classmethod
+    def add_many(cls, owner, apps, threshold=None):
+        '''Add the given ``apps`` to the watchlist of ``owner`` in batches.
+
+        Apps that are already on the watchlist are left unchanged.
+        '''
+        rows = [{'owner': owner, 'app': app.id, 'threshold': threshold,
+                 'threshold_hit': False} for app in apps]
+        with _db.atomic():
+            for batch in _batches(rows):
+                cls.insert_many(batch).on_conflict('IGNORE').execute()
+
+    @classmethod
+    def thresholds(cls):
+        '''Get the highest ``threshold`` among the Watches of each App.
+
+        :returns:
+            A *dict* that maps ``App.id`` to the threshold.
+        :rtype: dict
+        '''
+        query = (cls.select(cls.app, fn.MAX(cls.threshold))
+                 .where(cls.threshold.is_null(False))
+                 .group_by(cls.app))
+        return {app_id: threshold for app_id, threshold in query.tuples()}
+
+    @classmethod
+    def adopt(cls, owner):
+        '''Let ``owner`` watch all enabled Apps if nobody watches anything.
+
+        This is done by :func:`init` for a database from a version
+        without per-user watchlists.
+
+        Thresholds are taken from the Apps if the database has them.
+
+        :returns: The number of Watches that were created.
+        :rtype: int
+        '''
+        if cls.select().exists():
+            return 0
+
+        columns = [c.name for c in _db.get_columns(App._meta.db_table)]
+        threshold = 'threshold' if 'threshold' in columns else 'NULL'
+        hit = 'threshold_hit' if 'threshold_hit' in columns else '0'
+        cursor = _db.execute_sql(
+            'INSERT INTO watch (owner, app_id, threshold, threshold_hit)'
+            ' SELECT ?, id, {t}, {h} FROM app WHERE enabled'.format(
+                t=threshold, h=hit),
+            (owner,))
+        if cursor.rowcount:
+            LOG.info('{o!r} watches {n} existing apps.'.format(
+                o=owner, n=cursor.rowcount))
+        return cursor.rowcount
+
+    @classmethod
+    def cross_thresholds(cls, region=None):
+        '''Find the Watches on enabled Apps whose current price has dropped
+        to or below their ``threshold`` since the last check.
+
+        Updates ``threshold_hit`` for all Watches, so each Watch is returned
+        only once when it crosses its threshold.
+        This takes a fixed number of queries, regardless of the number of
+        Watches.
+
+        :param str region:
+            *optional*
+            Consider only snapshots for this region.
+        :returns:
+            A list of :class:`Watch` instances that crossed their threshold.
+        :rtype: list
+        '''
+        # correlated with the Watch in the outer query
+        price = (PackageStats.current(region)
+                 .select(fn.MIN(PackageStats.price))
+                 .join(AppPackage,
+                       on=(AppPackage.package == PackageStats.package))
+                 .where(AppPackage.app == cls.app))
+        below = cls.threshold >= price
+        above = (price >> None) | (cls.threshold < price)
+        enabled = App.select(App.id).where(App.enabled == True)
+        not_hit = (cls.threshold_hit >> None) | (cls.threshold_hit == False)
+        with _db.atomic():
+            crossed = list(cls.select(cls, App).join(App)
+                           .where(cls.app << enabled, below, not_hit))
+            (cls.update(threshold_hit=False)
+             .where(cls.threshold_hit == True, above)
+             .execute())
+            (cls.update(threshold_hit=True)
+             .where(cls.app << enabled, below, not_hit)
+             .execute())
+        return crossed
+
+    def __repr__(self):
+        return '<Watch owner={s.owner!r} app={s.app_id!r}>'.format(s=self)
+
+
+class ReadCursor(BaseModel):
+    '''The most recent :class:`Snapshot` a user has seen in a region.
+
+    :var str owner: The user.
+    :var str region: The region of the snapshots.
+    :var int snapshot: The ``id`` of the last seen Snapshot.
+    '''
+
+    owner = CharField()
+    region = CharField()
+    snapshot = IntegerField(default=0)
+
+    class Meta:
+        db_table = 'read_cursor'
+        primary_key = CompositeKey('owner', 'region')
+
+    @classmethod
+    def position(cls, owner, region):
+        '''Get the ``id`` of the last Snapshot ``owner`` has seen in
+        ``region``, 0 if there is none.
+
+        :rtype: int
+        '''
+        cursor = cls.select().where(
+            cls.owner == owner, cls.region == region).limit(1).first()
+        return cursor.snapshot if cursor else 0
+
+    @classmethod
+    def advance(cls, owner, region, snapshot_id):
+        '''Move the cursor of ``owner`` in ``region`` forward to
+        ``snapshot_id``. The cursor never moves back.
+        '''
+        with _db.atomic():
+            if snapshot_id > cls.position(owner, region):
+                cls.insert(owner=owner, region=region,
+                           snapshot=snapshot_id).upsert().execute()
+
+    def __repr__(self):
+        return '<ReadCursor owner={s.owner!r} region={s.region!r}>'.format(
+            s=self)
+
+
+# Rows ------------------------------------------------------------------------
+# Plain tuples for machine-readable output.
+# The queries are read row by row from the cursor without creating model
+# instances, so that large exports need constant memory.
+
+
+APP_COLUMNS = ('steamid', 'name', 'kind', 'enabled', 'quarantined')
+PACKAGE_COLUMNS = ('steamid', 'name', 'release_date', 'coming_soon',
+                   'quarantined', 'lowest', 'highest', 'last_change')
+SNAPSHOT_COLUMNS = ('id', 'region', 'timestamp', 'currency', 'price',
+                    'release_date', 'coming_soon', 'supports_linux')
+
+# columns of the rows returned by the functions below
+LS_COLUMNS = APP_COLUMNS + PACKAGE_COLUMNS
+REPORT_COLUMNS = APP_COLUMNS + PACKAGE_COLUMNS + SNAPSHOT_COLUMNS
+RECENT_COLUMNS = PACKAGE_COLUMNS + SNAPSHOT_COLUMNS
+
+_APP_SELECT = ('a.steamid, a.name, a.kind, a.enabled,'
+               ' COALESCE(a.skip_until > ?, 0)')
+# lowest, highest and last change from `_STATS_JOIN`
+_PACKAGE_SELECT = ('p.steamid, p.name, p.release_date, p.coming_soon,'
+                   ' COALESCE(p.skip_until > ?, 0), ps.lowest, ps.highest,'
+                   " strftime('%Y-%m-%dT%H:%M:%SZ', ps.last_change, 'unixepoch')")
+_STATS_JOIN = ('LEFT JOIN package_stats AS ps'
+               ' ON ps.package_id = p.id AND ps.region = ?')
+# timestamps are UTC
+_SNAPSHOT_SELECT = ('s.id, s.region,'
+                    " strftime('%Y-%m-%dT%H:%M:%SZ', s.timestamp,"
+                    " 'unixepoch'),"
+                    ' s.currency, s.price, s.release_date, s.coming_soon,'
+                    ' s.supports_linux')
+_WATCHED_PACKAGES = ('SELECT ap.package_id FROM apppackage AS ap'
+                     ' JOIN watch AS w ON w.app_id = ap.app_id'
+                     ' WHERE w.owner = ?')
+
+
+def ls_rows(owner, include_disabled=False, region=None):
+    '''Query the Apps watched by ``owner`` with their Packages.
+
+    Yields one row per App and Package with the :data:`LS_COLUMNS`,
+    the package columns are *None* for Apps without Packages.
+
+    :param str owner:
+        The owner of the watchlist.
+    :param bool include_disabled:
+        *optional*
+        Also list disabled Apps, after the enabled ones.
+    :param str region:
+        *optional*
+        The region for the lowest and highest price.
+    :rtype: iterable
+    '''
+    now = datetime.utcnow()
+    condition = 'a.id IN (SELECT app_id FROM watch WHERE owner = ?)'
+    if include_disabled:
+        condition += ' OR NOT a.enabled'
+    return _db.execute_sql(
+        'SELECT {a}, {p} FROM app AS a'
+        ' LEFT JOIN apppackage AS ap ON ap.app_id = a.id'
+        ' LEFT JOIN package AS p ON p.id = ap.package_id'
+        ' {stats}'
+        ' WHERE {c}'
+        ' ORDER BY a.enabled DESC, a.name, a.id, ap.rowid'.format(
+            a=_APP_SELECT, p=_PACKAGE_SELECT, stats=_STATS_JOIN,
+            c=condition),
+        (now, now, region, owner))
+
+
+def report_rows(owner, app_ids=None, limit=None, region=None):
+    '''Query the Snapshots for the Apps watched by ``owner``.
+
+    Yields one row per App, Package and Snapshot
+    with the :data:`REPORT_COLUMNS`, most recent Snapshots first.
+    Columns for Packages and Snapshots are *None*
+    for Apps and Packages without them.
+
+    :param str owner:
+        The owner of the watchlist.
+    :param list app_ids:
+        *optional*
+        Only rows for the Apps with these ids.
+    :param int limit:
+        *optional*
+        Limit the number of Snapshots per Package.
+    :param str region:
+        *optional*
+        Only Snapshots for this region.
+    :rtype: iterable
+    '''
+    now = datetime.utcnow()
+    params = [now, now, region]
+    snapshots = 'snapshot_full'
+    on = 's.package_id = p.id'
+    if limit:
+        # number the snapshots of each package, most recent first,
+        # and complete only those within the limit
+        snapshots = ('(SELECT f.* FROM (SELECT id, ROW_NUMBER() OVER ('
+                     'PARTITION BY package_id, region'
+                     ' ORDER BY timestamp DESC, id DESC) AS position'
+                     ' FROM snapshot{w}) AS n'
+                     ' JOIN snapshot_full AS f ON f.id = n.id'
+                     ' WHERE n.position <= ?)').format(
+                         w=' WHERE region = ?' if region else '')
+        if region:
+            params.append(region)
+        params.append(limit)
+    elif region:
+        on += ' AND s.region = ?'
+        params.append(region)
+
+    condition = 'w.owner = ?'
+    params.append(owner)
+    if app_ids is not None:
+        condition += ' AND a.id IN ({})'.format(
+            ', '.join('?' for _ in app_ids))
+        params.extend(app_ids)
+
+    return _db.execute_sql(
+        'SELECT {a}, {p}, {s} FROM app AS a'
+        ' JOIN watch AS w ON w.app_id = a.id'
+        ' LEFT JOIN apppackage AS ap ON ap.app_id = a.id'
+        ' LEFT JOIN package AS p ON p.id = ap.package_id'
+        ' {stats}'
+        ' LEFT JOIN {snapshots} AS s ON {on}'
+        ' WHERE {c}'
+        ' ORDER BY a.name, a.id, ap.rowid, s.timestamp DESC, s.id DESC'
+        .format(
+            a=_APP_SELECT, p=_PACKAGE_SELECT, s=_SNAPSHOT_SELECT,
+            stats=_STATS_JOIN, snapshots=snapshots, on=on, c=condition),
+        params)
+
+
+def recent_rows(owner, limit=None, region=None, after=None):
+    '''Query recent Snapshots for the Apps watched by ``owner``,
+    like :meth:`Snapshot.recent`.
+
+    Yields one row per Snapshot with the :data:`RECENT_COLUMNS`,
+    most recent first.
+
+    :param str owner:
+        The owner of the watchlist.
+    :param int limit:
+        *optional*
+        Limit the number of results.
+    :param str region:
+        *optional*
+        Only Snapshots for this region.
+    :param int after:
+        *optional*
+        Only Snapshots with an ``id`` greater than this, oldest first.
+    :rtype: iterable
+    '''
+    params = [datetime.utcnow(), region, owner]
+    # with a limit, the timestamp index is read in order until enough
+    # snapshots are found, the unary + keeps SQLite from using the indexes
+    # on the package or region instead and sorting all of their snapshots
+    unary = '+' if limit and after is None else ''
+    conditions = ['{u}s.package_id IN ({w})'.format(
+        u=unary, w=_WATCHED_PACKAGES)]
+    order = 's.timestamp DESC, s.id DESC'
+    if region:
+        conditions.append('{u}s.region = ?'.format(u=unary))
+        params.append(region)
+    if after is not None:
+        conditions.append('s.id > ?')
+        params.append(after)
+        order = 's.id'
+    sql = (
+        'SELECT {p}, {s} FROM snapshot_full AS s'
+        ' JOIN package AS p ON p.id = s.package_id'
+        ' {stats}'
+        ' WHERE {c} ORDER BY {o}'.format(
+            p=_PACKAGE_SELECT, s=_SNAPSHOT_SELECT, stats=_STATS_JOIN,
+            c=' AND '.join(conditions), o=order)
+    )
+    if limit:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return _db.execute_sql(sql, params)
+
+
+# snapshot history, see `export_rows`
+EXPORT_COLUMNS = ('app', 'app_name', 'package', 'package_name', 'region',
+                  'timestamp', 'currency', 'price', 'release_date',
+                  'coming_soon', 'supports_linux')
+
+
+def export_rows(owner, since=None, app_ids=None):
+    '''Query the Snapshots of all Packages of the Apps watched by ``owner``.
+
+    Yields one row per App and Snapshot with the :data:`EXPORT_COLUMNS`,
+    grouped by App and Package, Snapshots in the order they were recorded.
+    Timestamps are UTC, formatted as ``YYYY-MM-DD HH:MM:SS``.
+
+    :param str owner:
+        The owner of the watchlist.
+    :param datetime since:
+        *optional*
+        Only Snapshots recorded at or after this time.
+    :param list app_ids:
+        *optional*
+        Only Snapshots for the Apps with these ids.
+    :rtype: iterable
+    '''
+    conditions = ['w.owner = ?']
+    params = [owner]
+    if since:
+        conditions.append('s.timestamp >= ?')
+        params.append(calendar.timegm(since.utctimetuple()))
+    if app_ids is not None:
+        conditions.append('a.id IN ({})'.format(
+            ', '.join('?' for _ in app_ids)))
+        params.extend(app_ids)
+    # ordered like the indexes used for the joins, so no sort is needed
+    return _db.execute_sql(
+        'SELECT a.steamid, a.name, p.steamid, p.name, s.region,'
+        " datetime(s.timestamp, 'unixepoch'), s.currency, s.price,"
+        ' s.release_date,'
+        ' s.coming_soon, s.supports_linux'
+        ' FROM watch AS w'
+        ' JOIN app AS a ON a.id = w.app_id'
+        ' JOIN apppackage AS ap ON ap.app_id = a.id'
+        ' JOIN package AS p ON p.id = ap.package_id'
+        ' JOIN snapshot_full AS s ON s.package_id = p.id'
+        ' WHERE {c} ORDER BY w.app_id, ap.package_id, s.id'.format(
+            c=' AND '.join(conditions)),
+        params)
+
+
+def history_rows(app_ids=None):
+    '''Query the price history of all Packages for the archive,
+    see :mod:`steamwatch.archive`.
+
+    Yields ``(steamid, region, timestamp, price, currency)`` tuples
+    ordered by Package, region and timestamp,
+    with timestamps in seconds since the epoch.
+
+    :param list app_ids:
+        *optional*
+        Only Packages of the Apps with these ids.
+    :rtype: iterable
+    '''
+    condition = ''
+    params = []
+    if app_ids is not None:
+        condition = (' WHERE s.package_id IN (SELECT package_id'
+                     ' FROM apppackage WHERE app_id IN ({}))').format(
+                         ', '.join('?' for _ in app_ids))
+        params.extend(app_ids)
+    return _db.execute_sql(
+        'SELECT p.steamid, s.region, s.timestamp, s.price, s.currency'
+        ' FROM snapshot_full AS s'
+        ' JOIN package AS p ON p.id = s.package_id'
+        '{c} ORDER BY s.package_id, s.region, s.timestamp, s.id'.format(
+            c=condition),
+        params)
+
+
+def price_rows(owner, region=None, app_ids=None):
+    '''Query the prices of the Packages of the Apps watched by ``owner``,
+    see :mod:`steamwatch.stats`.
+
+    Yields ``(package_id, timestamp, price)`` tuples
+    ordered by Package and timestamp,
+    with timestamps in seconds since the epoch.
+    Snapshots without a price are left out.
+
+    :param str owner:
+        The owner of the watchlist.
+    :param str region:
+        *optional*
+        Only Snapshots for this region.
+    :param list app_ids:
+        *optional*
+        Only Packages of the Apps with these ids.
+    :rtype: iterable
+    '''
+    packages = _WATCHED_PACKAGES
+    params = [owner]
+    if app_ids is not None:
+        packages += ' AND ap.app_id IN ({})'.format(
+            ', '.join('?' for _ in app_ids))
+        params.extend(app_ids)
+    conditions = ['s.price IS NOT NULL',
+                  's.package_id IN ({})'.format(packages)]
+    if region:
+        conditions.append('s.region = ?')
+        params.append(region)
+    return _db.execute_sql(
+        'SELECT s.package_id, s.timestamp, s.price FROM snapshot AS s'
+        ' WHERE {c} ORDER BY s.package_id, s.timestamp, s.id'.format(
+            c=' AND '.join(conditions)),
+        params)
+
+
+def price_buckets(package_ids, region, buckets, now):
+    '''Downsample the price history of each of the Packages
+    with ``package_ids`` to ``buckets`` periods of equal length,
+    from the first Snapshot (see :class:`PackageStats`) until ``now``.
+
+    The Snapshots are aggregated in the database,
+    only one row per package and period is read.
+    Each period has the lowest and highest price within it,
+    including the price that still held from the previous period,
+    so that a short sale is not lost in a long history.
+
+    :param list package_ids:
+        The ids of the Packages.
+    :param str region:
+        Only Snapshots for this region.
+    :param int buckets:
+        The number of periods.
+    :param int now:
+        The end of the last period in seconds since the epoch.
+    :returns:
+        A *dict* that maps ``Package.id`` to a list with a
+        ``(lowest, highest)`` tuple for each period.
+    :rtype: dict
+    '''
+    histories = {}
+    for batch in _batches(list(package_ids)):
+        params = [buckets, now, buckets - 1, region]
+        params.extend(batch)
+        cursor = _db.execute_sql(
+            _PRICE_BUCKETS.format(ids=', '.join('?' for _ in batch)), params)
+        for package_id, bucket, lowest, highest, last in cursor:
+            history = histories.setdefault(package_id, [])
+            # the price holds until the next snapshot,
+            # periods before the first price are (None, None)
+            held = history[-1][2] if history else None
+            history.extend([(held, held, held)] * (bucket - len(history)))
+            if held is not None:
+                lowest, highest = min(lowest, held), max(highest, held)
+            history.append((lowest, highest, last))
+
+    for package_id, history in histories.items():
+        held = history[-1][2]
+        history.extend([(held, held, held)] * (buckets - len(history)))
+        histories[package_id] = [entry[:2] for entry in history]
+    return histories
+
+
+# period of each snapshot, from the first snapshot until now
+_PRICE_BUCKET = ('MIN((s.timestamp - ps.first_seen) * ?'
+                 ' / MAX(? - ps.first_seen, 1), ?)')
+
+# snapshots are found by package, the unary + keeps SQLite from using
+# the index on the region instead, which hardly narrows them down
+_PRICE_BUCKETS = '''SELECT package_id, bucket, MIN(price), MAX(price), last
+FROM (
+    SELECT package_id, bucket, price,
+        LAST_VALUE(price) OVER (
+            PARTITION BY package_id, bucket ORDER BY timestamp, id
+            ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+        ) AS last
+    FROM (
+        SELECT s.id, s.package_id, s.timestamp, s.price, {bucket} AS bucket
+        FROM snapshot AS s
+        JOIN package_stats AS ps
+            ON ps.package_id = s.package_id AND ps.region = +s.region
+        WHERE ps.region = ? AND ps.package_id IN ({{ids}})
+        AND s.price IS NOT NULL
+    )
+)
+GROUP BY package_id, bucket
+ORDER BY package_id, bucket'''.format(bucket=_PRICE_BUCKET)
+
+
 # Helpers ---------------------------------------------------------------------
 
 
+def _batches(items):
+    for offset in range(0, len(items), _BATCH_SIZE):
+        yield items[offset:offset + _BATCH_SIZE]
+
+
+def _unindexed(field):
+    '''``+field``, which keeps SQLite from using an index on ``field``.'''
+    return Expression(SQL(''), '+', field)
+
+
+def _identity(field):
+    return field
+
+
+def _extreme(func, *values):
+    '''Apply ``func`` (e.g. ``min``) to the ``values`` that are not *None*.'''
+    values = [v for v in values if v is not None]
+    return func(values) if values else None
+
+
 # https://docs.python.org/3.3/library/datetime.html#strftime-and-strptime-behavior
 DATEFORMAT = '%d %B, %Y'  # e.g. "30 May, 2014"
 
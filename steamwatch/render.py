@@ -7,15 +7,47 @@ Each renderer must implement
 - render ls
 - render report
 
+Renderers collect their output in a buffer and write it to the output
+stream in blocks of ``render_buffer`` characters.
+Each ``render_xxx`` method flushes the buffer when it is done.
+
 '''
+import itertools
+import json
+from json.encoder import encode_basestring_ascii as _encode_json_string
+
 try:
     import basestring
 except ImportError:
     basestring = str
 
+from steamwatch.model import APP_COLUMNS
+from steamwatch.model import PACKAGE_COLUMNS
+from steamwatch.model import SNAPSHOT_COLUMNS
+from steamwatch.stats import STATS_COLUMNS
+
+
+# characters to collect before writing to the output stream
+RENDER_BUFFER = 8192
+
+# outcomes of ``watch --from`` in the order they are listed
+WATCH_OUTCOMES = ('added', 'enabled', 'known', 'invalid', 'failed')
+
 
 class Renderer:
-    '''Renderer base class'''
+    '''Renderer base class
+
+    Renderers with ``rows`` set to *True* are passed plain tuples
+    from :meth:`steamwatch.application.Application.ls_rows` etc.
+    instead of model instances.
+
+    ``sparkline_width`` is the number of characters
+    for the price history of a package in a report.
+    '''
+
+    rows = False
+    sparkline_width = 16
+
     def __init__(self, out, options):
         self.out = out
         self.options = options
@@ -23,6 +55,9 @@ class Renderer:
             self.use_color = self.out.isatty()
         except AttributeError:
             self.use_color = False
+        self._buffer = []
+        self._buffered = 0
+        self._buffer_size = getattr(options, 'render_buffer', RENDER_BUFFER)
 
     def render_ls(self, apps):
         '''Render the output for the ``ls`` command.'''
@@ -44,6 +79,8 @@ class Renderer:
             ]),
         ]
 
+        Each level can be any iterable, e.g. a generator that streams
+        rows from the database; it is consumed only once.
         '''
         pass
 
@@ -51,9 +88,44 @@ class Renderer:
         '''Render the output for the ``recent`` command.'''
         pass
 
+    def render_regions(self, comparison):
+        '''Render a comparison of regions.
+
+        The structure is the same as for :meth:`render_report`
+        with one snapshot per region for each package.
+        '''
+        pass
+
+    def render_stats(self, stats):
+        '''Render price statistics, a list of tuples with the
+        :data:`steamwatch.stats.STATS_COLUMNS`
+        and a :class:`Package` in the first column.
+        '''
+        pass
+
+    def render_watch_summary(self, summary):
+        '''Render the outcome of ``watch --from``, see
+        :meth:`steamwatch.application.Application.watch_many`.'''
+        pass
+
     def write(self, text):
-        '''Write the given text to ``self.out``.'''
-        self.out.write(str(text))
+        '''Write the given text to ``self.out``.
+
+        The text is buffered until ``render_buffer`` characters
+        have been collected or :meth:`flush` is called.
+        '''
+        text = str(text)
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self._buffer_size:
+            self.flush()
+
+    def flush(self):
+        '''Write the buffered text to ``self.out``.'''
+        if self._buffer:
+            self.out.write(''.join(self._buffer))
+            del self._buffer[:]
+            self._buffered = 0
 
     def writeln(self, text=None):
         '''Write the given text to ``self.out``, append a newline.'''
@@ -63,15 +135,21 @@ class Renderer:
 
     def red(self, text):
         '''Color the given text *red*.'''
-        return red(text, enabled=self.use_color)
+        if self.use_color:
+            return _RED + text + _RESET
+        return text
 
     def bold(self, text):
         '''Make the given text *bold*.'''
-        return bold(text, enabled=self.use_color)
+        if self.use_color:
+            return _BOLD + text + _RESET
+        return text
 
     def dim(self, text):
         '''*dim* the given text.'''
-        return dim(text, enabled=self.use_color)
+        if self.use_color:
+            return _DIM + text + _RESET
+        return text
 
     def neutral(self, text):
         '''Undecorated text.'''
@@ -114,22 +192,24 @@ class TreeRenderer(Renderer):
 
     def render_report(self, report):
         self._render_root()
-        for app_index, app_pkgs in enumerate(report):
-            last_app = app_index + 1 >= len(report)
-            app, pkgs = app_pkgs  # unpack
+        for (app, pkgs), last_app in _lookahead(report):
             self._render_app(app, last_app)
 
-            for pkg_index, pkg_snapshots in enumerate(pkgs):
-                last_pkg = pkg_index + 1 >= len(pkgs)
-                pkg, snapshots = pkg_snapshots  # unpack
+            for (pkg, snapshots), last_pkg in _lookahead(pkgs):
                 self._render_pkg(pkg, last_app, last_pkg)
 
-                for snapshot_index, snapshot in enumerate(snapshots):
-                    last_snapshot = snapshot_index + 1 >= len(snapshots)
-                    self._render_snapshot(snapshot, last_app, last_pkg, last_snapshot)
+                lowest = _lowest(pkg)
+                # next to the current price
+                sparkline = _sparkline(getattr(pkg, 'price_history', None))
+                for snapshot, last_snapshot in _lookahead(snapshots):
+                    self._render_snapshot(snapshot, last_app, last_pkg,
+                                          last_snapshot, lowest, sparkline)
+                    sparkline = None
+
+        self.flush()
 
-    def _render_root(self):
-        self.writeln('Report')
+    def _render_root(self, title='Report'):
+        self.writeln(title)
 
     def _render_app(self, app, last_app):
         # app level
@@ -140,7 +220,7 @@ class TreeRenderer(Renderer):
         # app details
         self.write(self.bold(app.name))
         self.write(' ')
-        self.write(dim('[{s: >6}]'.format(s=app.steamid)))
+        self.write(self.dim('[{s: >6}]'.format(s=app.steamid)))
         self.writeln()
 
     def _render_pkg(self, pkg, last_app, last_pkg):
@@ -158,9 +238,14 @@ class TreeRenderer(Renderer):
         self.write(pkg.name)
         self.write(' ')
         self.write(self.dim('[{s: >6}]'.format(s=pkg.steamid)))
+        stats = getattr(pkg, 'price_stats', None)
+        if stats and stats.lowest is not None:
+            self.write(self.dim('  lowest {s.lowest}, changed {d}'.format(
+                s=stats, d=stats.last_change.strftime('%Y-%m-%d'))))
         self.writeln()
 
-    def _render_snapshot(self, snapshot, last_app, last_pkg, last_snapshot):
+    def _render_snapshot(self, snapshot, last_app, last_pkg, last_snapshot,
+                         lowest=None, sparkline=None):
         # app level
         self.write(self.gut if last_app else self.vert_bold)
         self.write(self.gut)
@@ -189,23 +274,75 @@ class TreeRenderer(Renderer):
         else:
             self.write('-----------')
         self.write('  ')
+        # the lowest price ever recorded stands out
+        style = self.bold
+        if lowest is not None and snapshot.price == lowest:
+            style = self.red
+        self.write(style('{s.price:>5}'.format(s=snapshot)))
+        if sparkline:
+            self.write('  ')
+            self.write(sparkline)
+        self.writeln()
+
+    def render_regions(self, comparison):
+        self._render_root('Regions')
+        for (app, pkgs), last_app in _lookahead(comparison):
+            self._render_app(app, last_app)
+
+            for (pkg, snapshots), last_pkg in _lookahead(pkgs):
+                self._render_pkg(pkg, last_app, last_pkg)
+
+                for snapshot, last_snapshot in _lookahead(snapshots):
+                    self._render_region(snapshot, last_app, last_pkg,
+                                        last_snapshot)
+
+        self.flush()
+
+    def _render_region(self, snapshot, last_app, last_pkg, last_snapshot):
+        # app level
+        self.write(self.gut if last_app else self.vert_bold)
+        self.write(self.gut)
+        self.write(self.gut)
+
+        # pkg level
+        self.write(self.gut if last_pkg else self.vert)
+        self.write(self.gut)
+        self.write(self.gut)
+
+        # snapshot level
+        self.write(self.turn if last_snapshot else self.split)
+        self.write(self.hor)
+        self.write(self.hor_end)
+
+        # details
+        self.write('{s: <3}'.format(s=snapshot.region.upper()))
+        self.write(' ')
         self.write(self.bold('{s.price:>5}'.format(s=snapshot)))
+        self.write(' ')
+        self.write(snapshot.currency or '')
+        self.write('  ')
+        self.write(self.dim(_timestamp(snapshot.timestamp)))
         self.writeln()
 
+    def render_watch_summary(self, summary):
+        for outcome in WATCH_OUTCOMES:
+            if summary[outcome]:
+                self.writeln('{k:<8} {n:>5}'.format(
+                    k=outcome, n=len(summary[outcome])))
+        self.flush()
+
     def render_ls(self, apps):
         # root
         self.write('Watched Apps + Packages')
         self.writeln()
 
-        apps = [a for a in apps]  # trigger query
-        for app_index, app in enumerate(apps):
-            last_app = app_index == len(apps) - 1
+        for app, last_app in _lookahead(apps):
             self._render_app_ls(app, last_app)
-            packages = [p for p in app.packages]  # trigger query
-            for pkg_index, package in enumerate(packages):
-                last_pkg = pkg_index == len(packages) - 1
+            for package, last_pkg in _lookahead(app.packages):
                 self._render_package(package, last_app, last_pkg, app.enabled)
 
+        self.flush()
+
     def _render_app_ls(self, app, last_app):
         # app level
         self.write(self.turn if last_app else self.split)
@@ -222,6 +359,8 @@ class TreeRenderer(Renderer):
         self.write(style(app.name))
         if not app.enabled:
             self.write(self.red(' (disabled)'))
+        elif app.quarantined:
+            self.write(self.red(' (quarantined)'))
         self.writeln()
 
     def _render_package(self, pkg, last_app, last_pkg, app_enabled):
@@ -240,16 +379,18 @@ class TreeRenderer(Renderer):
         self.write(' ')
         style = self.neutral if app_enabled else self.dim
         self.write(style(pkg.name))
+        if pkg.quarantined:
+            self.write(self.red(' (quarantined)'))
         self.writeln()
 
     def render_recent(self, recent):
         self.write('Recent Changes')
         self.writeln()
-        snapshots = [ss for ss in recent]  # trigger query to determine length
-        for index, snapshot in enumerate(snapshots):
-            last_snapshot = index == len(snapshots) - 1
+        for snapshot, last_snapshot in _lookahead(recent):
             self._render_snapshot_recent(snapshot, last_snapshot)
 
+        self.flush()
+
     def _render_snapshot_recent(self, snapshot, last_ss):
         self.write(self.turn if last_ss else self.split)
         self.write(self.hor)
@@ -267,7 +408,7 @@ class TreeRenderer(Renderer):
         self.write(self.vert)
         self.write(self.gut)
         self.write(self.gut)
-        self.write(bold(snapshot.package.name))
+        self.write(self.bold(snapshot.package.name))
         self.writeln()
 
         diffs = snapshot.diff()
@@ -377,32 +518,90 @@ class TabularRenderer(Renderer):
             self.hor = '-'
 
     def render_report(self, report):
-        col_widths = self._calc_col_widths()
-
-        self._render_top_grid(col_widths)
-        self._render_header(col_widths)
-
-        for app_index, app_packages in enumerate(report):
-            app, packages = app_packages
-            last_app = app_index == len(report) - 1
-            self._render_app(app)
-            self._render_body_grid_below_cellspan(col_widths)
-
-            for pkg_index, pkg_snapshots in enumerate(packages):
-                pkg, snapshots = pkg_snapshots
-                last_pkg = pkg_index == len(packages) -1
+        widths = self._calc_col_widths()
+        labels = [column[1] for column in self.columns]
+        # the table grows by a column for the price history
+        sparkline, report = _has_price_history(report)
+        if sparkline:
+            widths += (self.sparkline_width,)
+            labels.append('History')
+        inner = len(widths) - 2
+        cells = [_cell(width) for width in widths[2:len(self.columns)]]
+        # snapshots have no release date, that column stays blank
+        converters = tuple(
+            (attr, convert) for attr, _, _, convert in self.columns[2:]
+        )
 
-                for snapshot_index, snapshot in enumerate(snapshots):
-                    last_snapshot = snapshot_index == len(snapshots) - 1
-                    self._render_snapshot(col_widths, pkg, snapshot)
+        # compile grid lines and row formats once per report
+        top = self._grid(self.top_left, self.top,
+                         (self.top_split,) + (self.top,) * inner,
+                         self.top_right, widths)
+        hgrid = self._grid(self.left_split, self.hor, self.cross,
+                           self.right_split, widths)
+        below_cellspan = self._grid(
+            self.left_split, self.hor,
+            (self.cross,) + (self.top_split_body,) * inner,
+            self.right_split, widths)
+        above_cellspan = self._grid(
+            self.left_split, self.hor,
+            (self.cross,) + (self.bottom_split_body,) * inner,
+            self.right_split, widths)
+        bottom = self._grid(self.bottom_left, self.bottom, self.bottom_split,
+                            self.bottom_right, widths)
+        # the name spans all columns right of the ID in the first header
+        # and in app rows
+        span = sum(widths[1:]) + 3 * inner
+        header = self._row([_pad('ID', widths[0]), _pad('Name', span)])
+        header += self._row([_pad(label, width)
+                             for label, width in zip(labels, widths)])
+        app_row = self._row(['{}', '{}'])
+        app_cell = _cell(span)
+        # the price is styled separately, see below
+        price_cell = cells.pop()
+        cells.append('{}')
+        if sparkline:
+            cells.append('{}')
+            sparkline_cell = _cell(self.sparkline_width)
+        snapshot_row = self._row(['{}', _cell(widths[1])] + cells)
+
+        self.write(top)
+        self.write(header)
+        self.write(hgrid)
+
+        for (app, packages), last_app in _lookahead(report):
+            self.write(app_row.format(
+                self.dim('{s: >6}'.format(s=app.steamid)),
+                self.bold(app_cell.format(app.name))))
+            self.write(below_cellspan)
+
+            for (pkg, snapshots), last_pkg in _lookahead(packages):
+                steamid = self.dim('{s: >6}'.format(s=pkg.steamid))
+                lowest = _lowest(pkg)
+                if sparkline:
+                    history = sparkline_cell.format(
+                        _sparkline(getattr(pkg, 'price_history', None)))
+                for snapshot, last_snapshot in _lookahead(snapshots):
+                    values = [convert(getattr(snapshot, attr, None))
+                              for attr, convert in converters]
+                    price = price_cell.format(values.pop())
+                    # the lowest price ever recorded stands out
+                    if lowest is not None and snapshot.price == lowest:
+                        price = self.red(price)
+                    values.append(price)
+                    if sparkline:
+                        # next to the current price
+                        values.append(history)
+                        history = sparkline_cell.format('')
+                    self.write(snapshot_row.format(steamid, pkg.name, *values))
 
                     if not (last_app and last_pkg and last_snapshot):
                         if last_snapshot and last_pkg:
-                            self._render_body_grid_above_cellspan(col_widths)
+                            self.write(above_cellspan)
                         else:
-                            self._render_hgrid(col_widths)
+                            self.write(hgrid)
 
-        self._render_bottom_grid(col_widths)
+        self.write(bottom)
+        self.flush()
 
     def _calc_col_widths(self):
         available = 79
@@ -420,302 +619,76 @@ class TabularRenderer(Renderer):
             16, 6, 10, 5
         )
 
-    def _render_header(self, col_widths):
-        # first header
-        self.write(self.left)
-        self.write(' ')  # gutter
-        self.write('ID')
-        self.write(' ' * (col_widths[0] - 2))
-        self.write(' ')  # gutter
-        self.write(self.center)
-        self.write(' ')  # gutter
-        self.write('Name')
-        self.write(' ' * (col_widths[1] - 4))
-        for i in range(2, len(col_widths)):
-            self.write(' ' * col_widths[i])
-            self.write(' ')  # gutter
-            self.write(' ')  # gutter
-            self.write(' ')  # gutter
-        self.write(' ')  # gutter
-        self.write(self.right)
-        self.writeln()
-
-        # second header
-        for index, column in enumerate(self.columns):
-            if index == 0:  # first
-                self.write(self.left)
-                self.write(' ')  # gutter
-            label = column[1]
-            self.write(label)
-            width = col_widths[index]
-            self.write(' ' * (width - len(label)))
-            self.write(' ')  # gutter
-            if index >= len(self.columns) - 1:  # last
-                self.write(self.right)
-            else:
-                self.write(self.center)
-                self.write(' ')  # gutter
-
-        self.writeln()
-        self._render_hgrid(col_widths)
-
-
-    def _render_hgrid(self, col_widths):
-        num_columns = len(self.columns)
-        for index in range(num_columns):
-            if index == 0:  # first
-                self.write(self.left_split)
-
-            self.write(self.hor) # gutter
-            self.write(self.hor * col_widths[index])
-            self.write(self.hor) # gutter
-            if index == num_columns - 1:  # last
-                self.write(self.right_split)
-            else:
-                self.write(self.cross)
-
-        self.writeln()
-
-    def _render_body_grid_below_cellspan(self, col_widths):
-        num_columns = len(self.columns)
-        for index in range(num_columns):
-            if index == 0:  # first
-                self.write(self.left_split)
-
-            self.write(self.hor) # gutter
-            self.write(self.hor * col_widths[index])
-            self.write(self.hor) # gutter
-            if index == num_columns - 1:  # last
-                self.write(self.right_split)
-            elif index == 0:
-                self.write(self.cross)
-            else:
-                self.write(self.top_split_body)
-
-        self.writeln()
-
-    def _render_body_grid_above_cellspan(self, col_widths):
-        num_columns = len(self.columns)
-        for index in range(num_columns):
-            if index == 0:  # first
-                self.write(self.left_split)
-
-            self.write(self.hor) # gutter
-            self.write(self.hor * col_widths[index])
-            self.write(self.hor) # gutter
-            if index == num_columns - 1:  # last
-                self.write(self.right_split)
-            elif index == 0:
-                self.write(self.cross)
-            else:
-                self.write(self.bottom_split_body)
-
-        self.writeln()
-
-    def _render_top_grid(self, col_widths):
-        # grid
-        self.write(self.top_left)
-        self.write(self.top)  # gutter
-        self.write(self.top * col_widths[0])
-        self.write(self.top)  # gutter
-        self.write(self.top_split)
-        self.write(self.top)  # gutter
-        for i in range(1, len(col_widths)):
-            #self.write(i)
-            self.write(self.top * col_widths[i])
-            self.write(self.top)  # gutter
-            if i >= len(col_widths) - 1:  # last column
-                self.write(self.top_right)
-            else:
-                self.write(self.top)  # would be top split
-                self.write(self.top)  # gutter
-        self.writeln()
-
-    def _render_bottom_grid(self, col_widths):
-        for index, width in enumerate(col_widths):
-            if index == 0:
-                self.write(self.bottom_left)
-
-            self.write(self.bottom) # gutter
-            self.write(self.bottom * width)
-            self.write(self.bottom) # gutter
-
-            if index == len(col_widths) -1:
-                self.write(self.bottom_right)
-            else:
-                self.write(self.bottom_split)
-        self.writeln()
-
-    def _render_app(self, app):
-        self.write(self.left)
-        self.write(' ')
-        self.write(self.dim('{s: >6}'.format(s=app.steamid)))
-        self.write(' ')
-        self.write(self.center)
-        self.write(' ')
-        name = app.name
-        self.write(self.bold(name))
-        #TODO remove hard-coded 79
-        width = 79 - 2 - 6 - 3 - 2 - len(name) + 1
-        self.write(' ' * width)
-        self.write(' ')
-        self.write(self.right)
-        self.writeln()
-
-    def _render_snapshot(self, col_widths, pkg, snapshot):
-        for index, column in enumerate(self.columns):
-            if index == 0:  #first
-                self.write(self.left)
-            else:
-                self.write(' ')
-                self.write(self.center)
-            self.write(' ')
-
-            if index == 0:
-                self.write(self.dim('{s: >6}'.format(s=pkg.steamid)))
-            elif index == 1:
-                name = pkg.name
-                if len(name) > col_widths[1]:
-                    name = pkg.name[:col_widths[1]]
-                    #TODO ellipsis
-                self.write(name)
-                self.write(' ' * max(0, col_widths[1] - len(name)))
-            else:
-                value = self._get(column, snapshot)
-                width = col_widths[index]
-                self.write(value[:width])
-                self.write(' ' * max(0, width - len(value)))
-
-            if index == len(self.columns) - 1:  # last
-                self.write(' ')
-                self.write(self.right)
-
-        self.writeln()
-
-    def _get(self, column, snapshot):
-        if column[0] == 'release':
-            return ''
-        else:
-            raw = getattr(snapshot, column[0])
-            if column[3]:
-                return column[3](raw)
-            else:
-                return str(raw)
+    def _grid(self, left, fill, joints, right, widths):
+        '''Compile a horizontal grid line for columns of the given widths.
 
+        ``joints`` is either one character for all inner grid lines
+        or a sequence with one character per inner grid line.
+        '''
+        if isinstance(joints, basestring):
+            joints = (joints,) * (len(widths) - 1)
+        parts = [left, fill * (widths[0] + 2)]
+        for joint, width in zip(joints, widths[1:]):
+            parts.append(joint)
+            parts.append(fill * (width + 2))
+        parts.append(right)
+        parts.append('\n')
+        return ''.join(parts)
+
+    def _row(self, cells):
+        '''Compile a table row from the given cells.
+
+        The cells are literal text or format fields
+        (see :func:`_cell`), the result is a format string.
+        '''
+        separator = ' ' + self.center + ' '
+        return self.left + ' ' + separator.join(cells) + ' ' + self.right + '\n'
 
     def render_ls(self, apps):
         available = 79
-        used_by_fields = 6 + 8  # ID and disabled
+        used_by_fields = 6 + 11  # ID and status
         used_by_grid = 4
         used_by_gutter = 6
         name_width = available - used_by_fields - used_by_grid - used_by_gutter
-
-        def grid():
-            self.write(self.left_split)
-            self.write(self.hor)
-            self.write(self.hor * 6)  # length of ID
-            self.write(self.hor)
-            self.write(self.cross)
-            self.write(self.hor)
-            self.write(self.hor * name_width)  # length of Name
-            self.write(self.hor)
-            self.write(self.cross)
-            self.write(self.hor)
-            self.write(self.hor * 8)  # length of Disabled
-            self.write(self.hor)
-            self.write(self.right_split)
-            self.writeln()
-
-        # header grid
-        self.write(self.top_left)
-        self.write(self.top)
-        self.write(self.top * 6)  # length of ID
-        self.write(self.top)
-        self.write(self.top_split)
-        self.write(self.top)
-        self.write(self.top * name_width)  # length of Name
-        self.write(self.top)
-        self.write(self.top_split)
-        self.write(self.top)
-        self.write(self.top * 8)  # length of Disabled
-        self.write(self.top)
-        self.write(self.top_right)
-        self.writeln()
-
-        # header
-        self.write(self.left)
-        self.write(' ')
-        self.write('{s: <6}'.format(s='ID'))
-        self.write(' ')
-        self.write(self.center)
-        self.write(' ')
-        self.write('Name')
-        self.write(' ' * (name_width - 4))
-        self.write(' ')
-        self.write(self.center)
-        self.write(' ')
-        self.write('{s: <8}'.format(s='Status'))
-        self.write(' ')
-        self.write(self.right)
-        self.writeln()
-
-        grid()
-        apps = [a for a in apps]  # trigger query
-        for index, app in enumerate(apps):
-            last = index == len(apps) - 1
-            self.write(self.left)
-            self.write(' ')
-            self.write(self.dim('{s: >6}'.format(s=app.steamid)))  # length of ID
-            self.write(' ')
-            self.write(self.center)
-            self.write(' ')
+        widths = (6, name_width, 11)  # ID, Name, Status
+
+        grid = self._grid(self.left_split, self.hor, self.cross,
+                          self.right_split, widths)
+        row = self._row(['{}', '{}', '{}'])
+        name_cell = _cell(name_width)
+        status_cell = _cell(11)
+        no_status = ' ' * 11
+
+        self.write(self._grid(self.top_left, self.top, self.top_split,
+                              self.top_right, widths))
+        self.write(self._row([_pad('ID', 6), _pad('Name', name_width),
+                              _pad('Status', 11)]))
+        self.write(grid)
+
+        for app, last in _lookahead(apps):
             style = self.bold if app.enabled else self.neutral
-            self.write(style(app.name[:name_width]))
-            self.write(' ' * max(0, name_width - len(app.name)))
-            self.write(' ')
-            self.write(self.center)
-            self.write(' ')
-            self.write(' ' * 8 if app.enabled else self.red('disabled'))
-            self.write(' ')
-            self.write(self.right)
-            self.writeln()
-
+            status = _status(app)
+            self.write(row.format(
+                self.dim('{s: >6}'.format(s=app.steamid)),
+                style(name_cell.format(app.name)),
+                self.red(status_cell.format(status)) if status else no_status
+            ))
+
+            style = self.neutral if app.enabled else self.dim
             for pkg in app.packages:
-                self.write(self.left)
-                self.write(' ')
-                self.write(dim('{s: >6}'.format(s=pkg.steamid)))
-                self.write(' ')
-                self.write(self.center)
-                self.write(' ')
-                style = self.neutral if app.enabled else self.dim
-                self.write(style(pkg.name[:name_width]))
-                self.write(' ' * max(0, name_width - len(pkg.name)))
-                self.write(' ')
-                self.write(self.center)
-                self.write(' ')
-                self.write(' ' * 8)
-                self.write(' ')
-                self.write(self.right)
-                self.writeln()
+                status = _status(pkg)
+                self.write(row.format(
+                    self.dim('{s: >6}'.format(s=pkg.steamid)),
+                    style(name_cell.format(pkg.name)),
+                    self.red(status_cell.format(status)) if status else no_status
+                ))
 
             if not last:
-                grid()
-
-        # bottom grid
-        self.write(self.bottom_left)
-        self.write(self.bottom)
-        self.write(self.bottom * 6)  # length of ID
-        self.write(self.bottom)
-        self.write(self.bottom_split)
-        self.write(self.bottom)
-        self.write(self.bottom * name_width)  # length of Name
-        self.write(self.bottom)
-        self.write(self.bottom_split)
-        self.write(self.bottom)
-        self.write(self.bottom * 8)  # length of Disabled
-        self.write(self.bottom)
-        self.write(self.bottom_right)
-        self.writeln()
+                self.write(grid)
+
+        self.write(self._grid(self.bottom_left, self.bottom, self.bottom_split,
+                              self.bottom_right, widths))
+        self.flush()
 
     def render_recent(self, recent):
         '''Table with recent changes::
@@ -729,160 +702,118 @@ class TabularRenderer(Renderer):
         name_width = 36
         prop_width = 8
         value_width = 5
+        widths = (timestamp_width, name_width, prop_width,
+                  value_width, value_width)
+
+        grid = self._grid(self.left_split, self.hor, self.cross,
+                          self.right_split, widths)
+        snapshot_row = self._row(
+            [_cell(timestamp_width), _cell(name_width)]
+            + [' ' * width for width in widths[2:]])
+        diff_row = self._row(
+            [' ' * timestamp_width, ' ' * name_width]
+            + [_cell(width) for width in widths[2:]])
+
+        self.write(self._grid(self.top_left, self.top, self.top_split,
+                              self.top_right, widths))
+        self.write(self._row([
+            _pad(label, width) for label, width in zip(
+                ('Timestamp', 'Name', 'Property', 'Old', 'New'), widths)
+        ]))
+        self.write(grid)
+
+        for snapshot, last_snapshot in _lookahead(recent):
+            self.write(snapshot_row.format(
+                _timestamp(snapshot.timestamp), snapshot.package.name))
 
-        def grid():
-            self.write(self.left_split)
-            self.write(self.hor)
-            self.write(self.hor * timestamp_width)
-            self.write(self.hor)
-            self.write(self.cross)
-            self.write(self.hor)
-            self.write(self.hor * name_width)
-            self.write(self.hor)
-            self.write(self.cross)
-            self.write(self.hor)
-            self.write(self.hor * prop_width)
-            self.write(self.hor)
-            self.write(self.cross)
-            self.write(self.hor)
-            self.write(self.hor * value_width)
-            self.write(self.hor)
-            self.write(self.cross)
-            self.write(self.hor)
-            self.write(self.hor * value_width)
-            self.write(self.hor)
-            self.write(self.right_split)
-            self.writeln()
+            diffs = snapshot.diff()
+            for prop, new, old in diffs:
+                self.write(diff_row.format(str(prop), str(old), str(new)))
 
-        # header grid
-        self.write(self.top_left)
-        self.write(self.top)
-        self.write(self.top * timestamp_width)
-        self.write(self.top)
-        self.write(self.top_split)
-        self.write(self.top)
-        self.write(self.top * name_width)
-        self.write(self.top)
-        self.write(self.top_split)
-        self.write(self.top)
-        self.write(self.top * prop_width)
-        self.write(self.top)
-        self.write(self.top_split)
-        self.write(self.top)
-        self.write(self.top * value_width)
-        self.write(self.top)
-        self.write(self.top_split)
-        self.write(self.top)
-        self.write(self.top * value_width)
-        self.write(self.top)
-        self.write(self.top_right)
-        self.writeln()
+            if not last_snapshot:
+                self.write(grid)
 
-        # header
-        self.write(self.left)
-        self.write(' ')
-        self.write(_pad('Timestamp', timestamp_width))
-        self.write(' ')
-        self.write(self.center)
-        self.write(' ')
-        self.write(_pad('Name', name_width))
-        self.write(' ')
-        self.write(self.center)
-        self.write(' ')
-        self.write(_pad('Property', prop_width))
-        self.write(' ')
-        self.write(self.center)
-        self.write(' ')
-        self.write(_pad('Old', value_width))
-        self.write(' ')
-        self.write(self.center)
-        self.write(' ')
-        self.write(_pad('New', value_width))
-        self.write(' ')
-        self.write(self.right)
-        self.writeln()
+        self.write(self._grid(self.bottom_left, self.bottom, self.bottom_split,
+                              self.bottom_right, widths))
+        self.flush()
 
-        grid()
+    def render_regions(self, comparison):
+        '''Table with the current price per region::
 
-        snapshots = [ss for ss in recent]  # trigger query
-        for index, snapshot in enumerate(snapshots):
-            last_snapshot = index == len(snapshots) - 1
-            self.write(self.left)
-            self.write(' ')
-            self.write(_timestamp(snapshot.timestamp))
-            self.write(' ')
-            self.write(self.center)
-            self.write(' ')
-            self.write(_pad(snapshot.package.name, name_width))
-            self.write(' ')
-            self.write(self.center)
-            self.write(' ')
-            self.write(' ' * prop_width)
-            self.write(' ')
-            self.write(self.center)
-            self.write(' ')
-            self.write(' ' * value_width)
-            self.write(' ')
-            self.write(self.center)
-            self.write(' ')
-            self.write(' ' * value_width)
-            self.write(' ')
-            self.write(self.right)
-            self.writeln()
+            | ID     | Name        | Region | Currency | Price |
+            | 000006 | One Game    |        |          |       |
+            | 000011 | One Package | US     | USD      |  1999 |
+            |        |             | DE     | EUR      |  1799 |
 
-            diffs = snapshot.diff()
-            last = (len(diffs) == 0) and last_snapshot
-            for diff_index, diff in enumerate(diffs):
-                last = (diff_index == len(diffs) - 1) and last_snapshot
-                self.write(self.left)
-                self.write(' ')
-                self.write(' ' * timestamp_width)
-                self.write(' ')
-                self.write(self.center)
-                self.write(' ')
-                self.write(' ' * name_width)
-                self.write(' ')
-                self.write(self.center)
-                self.write(' ')
-                self.write(_pad(diff[0], prop_width))
-                self.write(' ')
-                self.write(self.center)
-                self.write(' ')
-                self.write(_pad(diff[2], value_width))
-                self.write(' ')
-                self.write(self.center)
-                self.write(' ')
-                self.write(_pad(diff[1], value_width))
-                self.write(' ')
-                self.write(self.right)
-                self.writeln()
+        '''
+        widths = (6, 38, 6, 8, 5)
+
+        grid = self._grid(self.left_split, self.hor, self.cross,
+                          self.right_split, widths)
+        app_row = self._row(['{}', '{}'] + [' ' * w for w in widths[2:]])
+        snapshot_row = self._row(
+            ['{}', _cell(widths[1]), _cell(widths[2]), _cell(widths[3]), '{}'])
+        name_cell = _cell(widths[1])
+        no_steamid = ' ' * widths[0]
+
+        self.write(self._grid(self.top_left, self.top, self.top_split,
+                              self.top_right, widths))
+        self.write(self._row([_pad(h, w) for h, w in zip(
+            ('ID', 'Name', 'Region', 'Currency', 'Price'), widths)]))
+
+        for app, pkgs in comparison:
+            self.write(grid)
+            self.write(app_row.format(
+                self.dim('{s: >6}'.format(s=app.steamid)),
+                self.bold(name_cell.format(app.name))))
+
+            for pkg, snapshots in pkgs:
+                steamid = self.dim('{s: >6}'.format(s=pkg.steamid))
+                name = pkg.name
+                for snapshot in snapshots:
+                    self.write(snapshot_row.format(
+                        steamid, name,
+                        snapshot.region.upper(), snapshot.currency or '',
+                        TabularRenderer._price(snapshot.price)))
+                    steamid, name = no_steamid, ''
 
-            if not last:
-                grid()
-
-        # bottom grid
-        self.write(self.bottom_left)
-        self.write(self.bottom)
-        self.write(self.bottom * timestamp_width)
-        self.write(self.bottom)
-        self.write(self.bottom_split)
-        self.write(self.bottom)
-        self.write(self.bottom * name_width)
-        self.write(self.bottom)
-        self.write(self.bottom_split)
-        self.write(self.bottom)
-        self.write(self.bottom * prop_width)
-        self.write(self.bottom)
-        self.write(self.bottom_split)
-        self.write(self.bottom)
-        self.write(self.bottom * value_width)
-        self.write(self.bottom)
-        self.write(self.bottom_split)
-        self.write(self.bottom)
-        self.write(self.bottom * value_width)
-        self.write(self.bottom)
-        self.write(self.bottom_right)
-        self.writeln()
+        self.write(self._grid(self.bottom_left, self.bottom, self.bottom_split,
+                              self.bottom_right, widths))
+        self.flush()
+
+    def render_stats(self, stats):
+        '''Table with price statistics::
+
+            | Name    | Lowest | Now  | Median | Off % | Since | Chg | Sale |
+            | Abc ... |    499 |  999 |    999 |   0.0 |    12 |   4 |   30 |
+
+        '''
+        labels = ('Name', 'Lowest', 'Now', 'Median', 'Off %', 'Since',
+                  'Chg', 'Sale')
+        values = (6, 6, 6, 5, 5, 4, 5)
+        # the name takes the remaining space
+        available = 79 - sum(values) - (len(labels) + 1) - 2 * len(labels)
+        widths = (available,) + values
+
+        grid = self._grid(self.left_split, self.hor, self.cross,
+                          self.right_split, widths)
+        row = self._row([
+            _cell(available), '{:>6}', '{:>6}', '{:>6.0f}', '{:>5.1f}',
+            '{:>5.0f}', '{:>4}', '{:>5.0f}'])
+
+        self.write(self._grid(self.top_left, self.top, self.top_split,
+                              self.top_right, widths))
+        self.write(self._row([_pad(label, width)
+                              for label, width in zip(labels, widths)]))
+        self.write(grid)
+        for package, lowest, current, median, discount, since, changes, sale \
+                in stats:
+            self.write(row.format(package.name or package.steamid, lowest,
+                                  current, median, discount, since, changes,
+                                  sale))
+        self.write(self._grid(self.bottom_left, self.bottom, self.bottom_split,
+                              self.bottom_right, widths))
+        self.flush()
 
     @staticmethod
     def _timestamp(value):
@@ -907,6 +838,149 @@ class TabularRenderer(Renderer):
         return 'Yes' if value else 'No'
 
 
+class NdjsonRenderer(Renderer):
+    '''Machine-readable output with one JSON object per line.
+
+    Each object has a ``type`` (*app*, *package* or *snapshot*),
+    the ``steamid`` of its parent and the columns
+    listed in :mod:`steamwatch.model`::
+
+        {"type": "app", "steamid": "316750", "name": "Game", ...}
+        {"type": "package", "app": "316750", "steamid": "81948", ...}
+        {"type": "snapshot", "package": "81948", "id": 17, ...}
+
+    The objects are written as the rows are read,
+    so the output can be of any size.
+    '''
+
+    rows = True
+
+    def render_ls(self, rows):
+        self._render_rows(rows, ('app', 'package'))
+
+    def render_report(self, rows):
+        self._render_rows(rows, ('app', 'package', 'snapshot'))
+
+    def render_recent(self, rows):
+        self._render_rows(rows, ('package', 'snapshot'))
+
+    def render_stats(self, stats):
+        self._begin()
+        for row in stats:
+            package = row[0]
+            fields = [('type', 'stats'), ('package', package.steamid),
+                      ('name', package.name)]
+            fields.extend(zip(STATS_COLUMNS[1:], row[1:]))
+            self._object('{' + ', '.join(
+                '"{k}": {v}'.format(k=key, v=json.dumps(value))
+                for key, value in fields
+            ) + '}')
+        self._end()
+        self.flush()
+
+    def _render_rows(self, rows, levels):
+        # one (offset, length, template, converters) per level
+        layouts = []
+        offset = 0
+        for depth, level in enumerate(levels):
+            columns = _JSON_COLUMNS[level]
+            fields = ['"type": "{}"'.format(level)]
+            if depth:
+                fields.append('"{}": {{}}'.format(levels[depth - 1]))
+            fields.extend('"{}": {{}}'.format(c) for c in columns)
+            template = '{{' + ', '.join(fields) + '}}'
+            converters = tuple(_JSON_TYPES[c] for c in columns)
+            layouts.append((offset, len(columns), template, converters))
+            offset += len(columns)
+
+        current = [None] * len(levels)
+        self._begin()
+        for row in rows:
+            changed = False
+            parent = ()
+            for depth, (offset, length, template, converters) in enumerate(
+                    layouts):
+                values = row[offset:offset + length]
+                key = values[0]  # steamid or snapshot id
+                if key is None:
+                    break
+                if changed or key != current[depth]:
+                    changed = True
+                    current[depth] = key
+                    self._object(template.format(*parent + tuple(
+                        convert(v) for convert, v in zip(converters, values)
+                    )))
+                parent = (converters[0](key),)
+        self._end()
+        self.flush()
+
+    def _begin(self):
+        pass
+
+    def _object(self, text):
+        self.write(text)
+        self.write('\n')
+
+    def _end(self):
+        pass
+
+
+class JsonRenderer(NdjsonRenderer):
+    '''Like :class:`NdjsonRenderer`, but the objects are written
+    as one JSON array.'''
+
+    def _begin(self):
+        self._separator = '[\n'
+
+    def _object(self, text):
+        self.write(self._separator)
+        self.write(text)
+        self._separator = ',\n'
+
+    def _end(self):
+        self.write('[]\n' if self._separator == '[\n' else '\n]\n')
+
+
+# Helpers ---------------------------------------------------------------------
+
+
+def _lookahead(iterable):
+    '''Yield ``(item, is_last)`` for each item in ``iterable``.
+
+    Reads one item ahead, so that iterables of unknown length,
+    e.g. query cursors, can be rendered as they are consumed.
+    '''
+    iterator = iter(iterable)
+    try:
+        previous = next(iterator)
+    except StopIteration:
+        return
+    for item in iterator:
+        yield previous, False
+        previous = item
+    yield previous, True
+
+
+def _has_price_history(report):
+    '''Whether the packages in ``report`` have a ``price_history``,
+    see :meth:`steamwatch.application.Application.report`.
+
+    Reads ahead up to the first package.
+
+    :returns:
+        ``(has_history, report)`` with the report to render instead.
+    '''
+    iterator = iter(report)
+    ahead = []
+    for app, packages in iterator:
+        packages = list(packages)
+        ahead.append((app, packages))
+        if packages:
+            has_history = hasattr(packages[0][0], 'price_history')
+            return has_history, itertools.chain(ahead, iterator)
+    return False, ahead
+
+
 # Formatters ------------------------------------------------------------------
 
 
@@ -914,6 +988,12 @@ def _pad(value, length):
     strvalue = str(value)
     return strvalue[:length] + ' ' * max(0, (length - len(strvalue)))
 
+
+def _cell(length):
+    '''Format field that pads or truncates a string to ``length``.'''
+    return '{{:<{0}.{0}}}'.format(length)
+
+
 def _timestamp(value):
     if value:
         return value.strftime('%Y-%m-%d %H:%M')
@@ -921,6 +1001,91 @@ def _timestamp(value):
         return ''
 
 
+def _json_str(value):
+    return 'null' if value is None else _encode_json_string(value)
+
+
+def _json_int(value):
+    return 'null' if value is None else str(int(value))
+
+
+def _json_bool(value):
+    return 'null' if value is None else ('true' if value else 'false')
+
+
+_JSON_TYPES = {
+    'steamid': _json_str,
+    'name': _json_str,
+    'kind': _json_str,
+    'enabled': _json_bool,
+    'quarantined': _json_bool,
+    'release_date': _json_str,
+    'coming_soon': _json_bool,
+    'id': _json_int,
+    'region': _json_str,
+    'timestamp': _json_str,
+    'currency': _json_str,
+    'price': _json_int,
+    'supports_linux': _json_bool,
+    'lowest': _json_int,
+    'highest': _json_int,
+    'last_change': _json_str,
+}
+
+_JSON_COLUMNS = {
+    'app': APP_COLUMNS,
+    'package': PACKAGE_COLUMNS,
+    'snapshot': SNAPSHOT_COLUMNS,
+}
+
+_SPARKS = '\u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588'  # ▁▂▃▄▅▆▇█
+
+
+def _sparkline(history):
+    '''Draw a price history of ``(lowest, highest)`` periods
+    (see :func:`steamwatch.model.price_buckets`) as a sparkline.
+
+    Each character shows the lowest or highest price of its period,
+    whichever differs more from the previous character,
+    so that short sales and price hikes remain visible.
+    '''
+    if not history:
+        return ''
+    known = [entry for entry in history if entry[0] is not None]
+    if not known:
+        return ' ' * len(history)
+    bottom = min(lowest for lowest, _ in known)
+    top = max(highest for _, highest in known)
+    scale = (len(_SPARKS) - 1) / ((top - bottom) or 1)
+    chars = []
+    previous = known[0][1]
+    for lowest, highest in history:
+        if lowest is None:
+            chars.append(' ')
+            continue
+        if abs(highest - previous) > abs(previous - lowest):
+            previous = highest
+        else:
+            previous = lowest
+        chars.append(_SPARKS[int(round((previous - bottom) * scale))])
+    return ''.join(chars)
+
+
+def _lowest(package):
+    '''The lowest price ever recorded for ``package``, if it is known.'''
+    stats = getattr(package, 'price_stats', None)
+    return stats.lowest if stats else None
+
+
+def _status(item):
+    if not getattr(item, 'enabled', True):
+        return 'disabled'
+    elif item.quarantined:
+        return 'quarantined'
+    else:
+        return ''
+
+
 # Style -----------------------------------------------------------------------
 
 
@@ -967,11 +1132,30 @@ BG_CYAN = '46'
 BG_WHITE = '47'
 
 
+def _escape(*codes):
+    '''The ANSI escape sequence that switches on the given codes.'''
+    return '\033[' + ';'.join(codes) + 'm'
+
+
+# precomputed escape sequences for the renderers
+_RESET = _escape(NEUTRAL)
+_BOLD = _escape(BOLD)
+_DIM = _escape(DIM)
+_RED = _escape(FG_RED)
+
+# escape sequences for combinations of codes used by `Style`
+_ESCAPES = {}
+
+
 class Style:
     '''
     https://en.wikipedia.org/wiki/ANSI_escape_code#graphics
     https://github.com/lepture/terminal/
 
+    Styled text that behaves like a ``str``.
+    The renderers do not use it, their ``red``, ``bold`` and ``dim``
+    methods return plain strings.
+
     Color
 
     Font Style
@@ -1069,12 +1253,12 @@ class Style:
         #if not self.should():
         #    return self.raw()
         if self.codes and self.options.get('enabled', True):
-            styled = Style.ESC + '['
-            styled += ';'.join(self.codes)
-            styled += 'm'
-            styled += self.text
-            styled += Style.RESET
-            return styled
+            codes = tuple(self.codes)
+            try:
+                escape = _ESCAPES[codes]
+            except KeyError:
+                escape = _ESCAPES[codes] = _escape(*codes)
+            return escape + self.text + Style.RESET
         else:
             return self.text
 
@@ -0,0 +1,138 @@
+#-*- coding: utf-8 -*-
+# pylint: disable=logging-format-interpolation
+'''
+Append-only log of raw responses from the store API.
+
+With ``response_log`` configured, every response of
+:func:`steamwatch.storeapi.appdetails` and
+:func:`steamwatch.storeapi.packagedetails` is appended to a segment
+in that directory, so that the history can be processed again later
+(see :meth:`steamwatch.application.Application.replay`).
+
+Segments are gzip compressed files with one JSON object per line::
+
+    {"cc": "us", "endpoint": "packagedetails", "id": "12345",
+     "response": {"12345": {"success": true, "data": {...}}},
+     "time": 1445000000}
+
+``time`` is the time of the response in seconds since the epoch (UTC),
+``response`` is the complete response, including unsuccessful ones.
+
+Each process writes segments of its own, named after the time
+the segment was started, so that concurrent fetches do not interfere.
+A new segment is started once the current one reaches ``segment_size``
+(compressed) bytes.
+'''
+import calendar
+from datetime import datetime
+import gzip
+import json
+import logging
+import os
+import threading
+
+
+SUFFIX = '.jsonl.gz'
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+
+LOG = logging.getLogger(__name__)
+
+
+class ResponseLog(object):
+    '''Writes responses to segments in ``directory``.
+
+    Responses can be written from several threads.
+    The current segment is complete only after :meth:`close`.
+
+    :param str directory:
+        The directory for the segments, created if it does not exist.
+    :param int segment_size:
+        *optional*
+        Start a new segment after this many bytes.
+    '''
+
+    def __init__(self, directory, segment_size=None):
+        self.directory = directory
+        self.segment_size = segment_size or DEFAULT_SEGMENT_SIZE
+        self._lock = threading.Lock()
+        self._file = None
+        self._segment = None
+
+    def write(self, endpoint, steamid, country_code, response):
+        '''Append a ``response`` from ``endpoint`` (e.g. "appdetails")
+        for the given ``steamid`` and ``country_code``.'''
+        record = {
+            'endpoint': endpoint,
+            'id': steamid,
+            'cc': country_code,
+            'time': calendar.timegm(datetime.utcnow().utctimetuple()),
+            'response': response,
+        }
+        line = json.dumps(record, sort_keys=True, separators=(',', ':'))
+        with self._lock:
+            if self._segment is None:
+                self._open()
+            self._segment.write(line.encode('utf-8') + b'\n')
+            if self._file.tell() >= self.segment_size:
+                self._close()
+
+    def close(self):
+        '''Finish the current segment.'''
+        with self._lock:
+            self._close()
+
+    def _open(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        name = '{t:%Y%m%dT%H%M%S%f}-{p}{s}'.format(
+            t=datetime.utcnow(), p=os.getpid(), s=SUFFIX)
+        path = os.path.join(self.directory, name)
+        LOG.debug('Start response log segment {p!r}.'.format(p=path))
+        # never append to a segment of another process
+        self._file = open(path, 'xb')
+        self._segment = gzip.GzipFile(fileobj=self._file, mode='wb')
+
+    def _close(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._file.close()
+            self._segment = None
+            self._file = None
+
+    def __repr__(self):
+        return '<ResponseLog directory={s.directory!r}>'.format(s=self)
+
+
+def segments(paths):
+    '''List the segments in ``paths``, oldest first.
+
+    :param list paths:
+        Segment files or directories with segments.
+    :rtype: list
+    '''
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(os.path.join(path, name)
+                         for name in os.listdir(path)
+                         if name.endswith(SUFFIX))
+        else:
+            found.append(path)
+    return sorted(found, key=os.path.basename)
+
+
+def read(path):
+    '''Yield the records from the segment at ``path`` as dicts.
+
+    A segment that was cut off, e.g. because the process was killed
+    while writing it, is read up to the last complete record.
+    '''
+    with gzip.open(path, 'rb') as segment:
+        try:
+            for line in segment:
+                if not line.endswith(b'\n'):
+                    LOG.warning('Incomplete record in {p!r}.'.format(p=path))
+                    break
+                yield json.loads(line.decode('utf-8'))
+        except EOFError:
+            LOG.warning('Segment {p!r} is incomplete.'.format(p=path))
@@ -0,0 +1,179 @@
+#-*- coding: utf-8 -*-
+'''
+Price statistics for packages.
+
+The price history of all packages is loaded as three columns
+(package, timestamp and price, ordered by package and timestamp)
+and the statistics are computed for all packages at once,
+vectorized with NumPy if it is installed and in plain Python otherwise.
+
+For each package:
+
+lowest
+    The lowest price ever recorded.
+current
+    The most recent price.
+median
+    The median of all recorded prices.
+discount
+    Percent by which the current price is below the median.
+days_since_change
+    Days since the price last changed, or since the first snapshot.
+changes
+    The number of price changes.
+days_on_sale
+    Days during which the price was below the median.
+
+Snapshots without a price are ignored.
+'''
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+STATS_COLUMNS = ('package', 'lowest', 'current', 'median', 'discount',
+                 'days_since_change', 'changes', 'days_on_sale')
+
+DAY = 24 * 60 * 60
+
+# rows fetched from the cursor at once
+_CHUNK_SIZE = 4096
+
+
+def load(cursor):
+    '''Read ``(package, timestamp, price)`` rows from ``cursor``
+    into three integer columns.
+
+    :returns:
+        ``(packages, timestamps, prices)`` as ``array.array``.
+    '''
+    packages = array.array('q')
+    timestamps = array.array('q')
+    prices = array.array('q')
+    while True:
+        rows = cursor.fetchmany(_CHUNK_SIZE)
+        if not rows:
+            break
+        for package, timestamp, price in rows:
+            packages.append(package)
+            timestamps.append(timestamp)
+            prices.append(price)
+    return packages, timestamps, prices
+
+
+def compute(packages, timestamps, prices, now):
+    '''Compute the statistics for each package.
+
+    :param packages:
+        The package for each snapshot.
+    :param timestamps:
+        Seconds since the epoch for each snapshot.
+    :param prices:
+        The price for each snapshot.
+    :param int now:
+        The current time in seconds since the epoch.
+    :returns:
+        A list of tuples with the :data:`STATS_COLUMNS`,
+        ordered like the packages.
+    :rtype: list
+    '''
+    if not len(packages):
+        return []
+    if numpy is not None:
+        return _compute_numpy(packages, timestamps, prices, now)
+    return _compute_python(packages, timestamps, prices, now)
+
+
+def _compute_numpy(packages, timestamps, prices, now):
+    packages = numpy.frombuffer(packages, dtype=numpy.int64)
+    timestamps = numpy.frombuffer(timestamps, dtype=numpy.int64)
+    prices = numpy.frombuffer(prices, dtype=numpy.int64)
+
+    # segments of consecutive snapshots for the same package
+    first = numpy.empty(len(packages), dtype=bool)
+    first[0] = True
+    numpy.not_equal(packages[1:], packages[:-1], out=first[1:])
+    starts = numpy.flatnonzero(first)
+    ends = numpy.append(starts[1:], len(packages))
+    lengths = ends - starts
+
+    lowest = numpy.minimum.reduceat(prices, starts)
+    current = prices[ends - 1]
+
+    # median per segment, from prices sorted within each segment
+    ordered = prices[numpy.lexsort((prices, packages))]
+    median = (ordered[starts + (lengths - 1) // 2]
+              + ordered[starts + lengths // 2]) / 2.0
+
+    changed = numpy.zeros(len(prices), dtype=bool)
+    changed[1:] = prices[1:] != prices[:-1]
+    changed &= ~first
+    changes = numpy.add.reduceat(changed.astype(numpy.int64), starts)
+    since = numpy.where(changed, timestamps,
+                        numpy.repeat(timestamps[starts], lengths))
+    last_change = numpy.maximum.reduceat(since, starts)
+
+    # each price holds until the next snapshot of the package
+    until = numpy.append(timestamps[1:], now)
+    until[ends - 1] = now
+    on_sale = prices < numpy.repeat(median, lengths)
+    sale = numpy.add.reduceat((until - timestamps) * on_sale, starts)
+
+    discount = numpy.zeros(len(starts))
+    positive = median > 0
+    discount[positive] = ((median - current)[positive]
+                          / median[positive] * 100)
+
+    return list(zip(
+        packages[starts].tolist(),
+        lowest.tolist(),
+        current.tolist(),
+        median.tolist(),
+        discount.round(1).tolist(),
+        ((now - last_change) / DAY).round(1).tolist(),
+        changes.tolist(),
+        (sale / DAY).round(1).tolist(),
+    ))
+
+
+def _compute_python(packages, timestamps, prices, now):
+    results = []
+    start = 0
+    count = len(packages)
+    while start < count:
+        end = start
+        while end < count and packages[end] == packages[start]:
+            end += 1
+
+        history = prices[start:end]
+        ordered = sorted(history)
+        median = (ordered[(len(ordered) - 1) // 2]
+                  + ordered[len(ordered) // 2]) / 2.0
+        current = history[-1]
+        changes = 0
+        last_change = timestamps[start]
+        sale = 0
+        for index in range(start, end):
+            if index > start and prices[index] != prices[index - 1]:
+                changes += 1
+                last_change = timestamps[index]
+            if prices[index] < median:
+                until = timestamps[index + 1] if index + 1 < end else now
+                sale += until - timestamps[index]
+
+        discount = (median - current) / median * 100 if median > 0 else 0.0
+        results.append((
+            packages[start],
+            min(history),
+            current,
+            median,
+            round(discount, 1),
+            round((now - last_change) / DAY, 1),
+            changes,
+            round(sale / DAY, 1),
+        ))
+        start = end
+    return results
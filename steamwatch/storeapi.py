@@ -25,8 +25,24 @@ from steamwatch.exceptions import GameNotFoundError
 
 
 BASEURL = 'http://store.steampowered.com/api'
+# seconds to wait for a response
+TIMEOUT = 30
 LOG = logging.getLogger(__name__)
 
+# see :func:`record_responses`
+_responses = None
+
+
+def record_responses(log):
+    '''Append every response to ``log``,
+    a :class:`steamwatch.responselog.ResponseLog`.
+
+    :param log:
+        The response log, *None* to stop recording.
+    '''
+    global _responses  # pylint: disable=global-statement
+    _responses = log
+
 
 def appdetails(appid, country_code=None):
     '''Get details for a single steamapp.
@@ -53,6 +69,8 @@ def appdetails(appid, country_code=None):
     )
     response = _get(url)
     result = _readjson(response)
+    if _responses is not None:
+        _responses.write('appdetails', appid, country_code, result)
 
     try:
         success = result[appid]['success']
@@ -90,6 +108,8 @@ def packagedetails(packageid, country_code=None):
     )
     response = _get(url)
     result = _readjson(response)
+    if _responses is not None:
+        _responses.write('packagedetails', packageid, country_code, result)
 
     try:
         success = result[packageid]['success']
@@ -106,7 +126,7 @@ def _get(url):
     LOG.debug('GET {u!r}'.format(u=url))
     # TODO proper error handling - or none
     try:
-        response = urlopen(url)
+        response = urlopen(url, timeout=TIMEOUT)
     except HTTPError:
         raise
     except ContentTooShortError:
@@ -8,12 +8,19 @@ test_application
 Tests for `application` module.
 """
 import argparse
+import datetime
+import gzip
+import json
+
 import pytest
 
 from steamwatch import application
+from steamwatch.exceptions import GameNotFoundError
 from steamwatch import storeapi
 from steamwatch import model
+from steamwatch import responselog
 from steamwatch.model import App
+from steamwatch.model import Package
 
 
 @pytest.fixture
@@ -36,6 +43,26 @@ def app():
     return app
 
 
+@pytest.fixture
+def clock(monkeypatch):
+    '''Replace the current time in the application module,
+    ``clock.sleep`` advances it.'''
+
+    class Clock(datetime.datetime):
+        current = datetime.datetime(2015, 9, 1, 12, 0, 0)
+
+        @classmethod
+        def utcnow(cls):
+            return cls.current
+
+        @classmethod
+        def sleep(cls, seconds):
+            cls.current += datetime.timedelta(seconds=seconds)
+
+    monkeypatch.setattr(application, 'datetime', Clock)
+    return Clock
+
+
 @pytest.fixture
 def mockapi(monkeypatch):
 
@@ -81,6 +108,59 @@ def test_unwatch(app, mockapi):
     assert App.by_steamid('123') is None
 
 
+def test_watchlists(app, mockapi, monkeypatch):
+    monkeypatch.setattr(app, 'fetch', lambda game: None)
+    app.user = 'alice'
+    app.watch('123', threshold=999)
+    app.watch('111')
+    app.user = 'bob'
+    app.watch('123')
+    assert [a.steamid for a in app.ls()] == ['123']
+
+    # still watched by alice
+    app.unwatch('123', delete=True)
+    game = App.by_steamid('123')
+    assert game.enabled
+    assert list(app.ls()) == []
+
+    app.user = 'alice'
+    assert [a.steamid for a in app.ls()] == ['111', '123']
+    assert model.Watch.get_for('alice', game).threshold == 999
+    app.unwatch('123')
+    assert not App.by_steamid('123').enabled
+
+
+def test_watch_many(app, mockapi, monkeypatch):
+    original = storeapi.appdetails
+
+    def appdetails(appid, country_code=None):
+        if appid == '404':
+            raise GameNotFoundError
+        return original(appid, country_code=country_code)
+
+    monkeypatch.setattr(storeapi, 'appdetails', appdetails)
+    app.watch_many(['111'])
+    summary = app.watch_many([
+        '111',
+        '333',
+        'http://store.steampowered.com/app/555/Some_Game/',
+        '555',
+        '404',
+        'not an appid',
+    ], threshold=999)
+
+    assert summary['added'] == ['555']
+    assert summary['enabled'] == ['333']
+    assert summary['known'] == ['111']
+    assert summary['invalid'] == ['not an appid', '404']
+    assert App.by_steamid('333').enabled
+    assert App.by_steamid('555').name == 'Name of the Game'
+    assert App.by_steamid('404') is None
+    watched = [a.steamid for a in app.ls()]
+    assert watched == ['111', '333', '555']
+    assert model.Watch.get_for(app.user, App.by_steamid('555')).threshold == 999
+
+
 def test_unwatch_non_existing(app):
     app.unwatch('does-not-exist')
 
@@ -99,5 +179,575 @@ def test_watch_enable(app, mockapi):
     assert game.enabled  # precondition
 
 
+def test_due(app):
+    now = datetime.datetime(2015, 9, 1, 12, 0, 0)
+    due = [a.steamid for a in app.due(now=now)]
+    assert sorted(due) == ['111', '222']  # never fetched, 333 is disabled
+
+    recently = now - datetime.timedelta(minutes=30)
+    App.update(last_fetch=recently).execute()
+    assert app.due(now=now) == []
+
+    # release in one day, polled more often
+    near = Package.create(steamid='01', coming_soon=True,
+                          release_date=datetime.date(2015, 9, 2))
+    near.link(App.by_steamid('111'))
+    # release date far off, polled less often
+    far = Package.create(steamid='02', coming_soon=True,
+                         release_date=datetime.date(2016, 1, 1))
+    far.link(App.by_steamid('222'))
+
+    assert [a.steamid for a in app.due(now=now)] == ['111']
+
+    later = now + datetime.timedelta(hours=2)
+    assert [a.steamid for a in app.due(now=later)] == ['111']
+
+    much_later = now + datetime.timedelta(hours=7)
+    due = [a.steamid for a in app.due(now=much_later)]
+    assert sorted(due) == ['111', '222']
+
+
+def test_fetch_quarantine(app, monkeypatch):
+    calls = []
+
+    def not_found(appid, country_code=None):
+        calls.append(appid)
+        raise GameNotFoundError
+
+    monkeypatch.setattr(storeapi, 'appdetails', not_found)
+
+    app.fetch_all()
+    assert sorted(calls) == ['111', '222']
+    game = App.by_steamid('111')
+    assert game.failures == 1
+    assert game.quarantined
+
+    # quarantined games are skipped
+    app.fetch_all(force=True)
+    assert len(calls) == 2
+    assert app.due() == []
+
+
+def test_fetch_regions(app, mockapi, monkeypatch):
+    app.country_codes = ['us', 'de', 'gb']
+    app.country_code = 'us'
+    appdetails_calls = []
+    original = storeapi.appdetails
+
+    def appdetails(appid, country_code=None):
+        appdetails_calls.append(country_code)
+        data = original(appid, country_code=country_code)
+        data['packages'] = ['01']
+        return data
+
+    def packagedetails(packageid, country_code=None):
+        if country_code == 'gb':
+            raise GameNotFoundError
+        return {
+            'name': 'Package',
+            'price': {'currency': country_code.upper(),
+                      'final': 999 if country_code == 'us' else 899},
+        }
+
+    monkeypatch.setattr(storeapi, 'appdetails', appdetails)
+    monkeypatch.setattr(storeapi, 'packagedetails', packagedetails)
+
+    game = App.by_steamid('111')
+    app.fetch(game)
+    assert appdetails_calls == ['us']
+
+    pkg = Package.by_steamid('01')
+    assert not pkg.quarantined  # found in some regions
+    assert [s.price for s in app.report(game)[0][1]] == [999]
+    assert [s.price for s in app.report(game, region='de')[0][1]] == [899]
+
+    compared = app.compare(game)
+    assert [(s.region, s.currency, s.price) for s in compared[0][1]] == [
+        ('us', 'US', 999), ('de', 'DE', 899)]
+
+
+def test_fetch_resume(app, monkeypatch):
+    fetched = []
+
+    def interrupted(game):
+        if fetched:
+            raise KeyboardInterrupt
+        fetched.append(game.steamid)
+
+    monkeypatch.setattr(app, 'fetch', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        app.fetch_all()
+    assert fetched == ['111']
+
+    run = model.FetchRun.unfinished()
+    assert run.planned == 2
+    assert [a.steamid for a in run.pending()] == ['222']
+
+    # next run continues with the remaining game
+    monkeypatch.setattr(app, 'fetch', lambda game: fetched.append(game.steamid))
+    app.fetch_all()
+    assert fetched == ['111', '222']
+    assert model.FetchRun.unfinished() is None
+
+    run = model.FetchRun.get(model.FetchRun.id == run.id)
+    assert run.completed == 2
+    assert run.apps.count() == 0
+
+
+def test_prioritize(app):
+    now = datetime.datetime(2015, 9, 1, 12, 0, 0)
+    App.update(last_fetch=now - datetime.timedelta(hours=2)).execute()
+    App.update(last_fetch=now - datetime.timedelta(hours=3)).where(
+        App.steamid == '222').execute()
+    games = list(App.select().where(App.enabled == True))
+    assert [a.steamid for a in app.prioritize(games, now=now)] == ['222', '111']
+
+    # never fetched comes first
+    App.update(last_fetch=None).where(App.steamid == '111').execute()
+    games = list(App.select().where(App.enabled == True))
+    assert [a.steamid for a in app.prioritize(games, now=now)] == ['111', '222']
+
+
+def test_fetch_deadline(app, clock, monkeypatch):
+    fetched = []
+
+    def slow_fetch(game):
+        fetched.append(game.steamid)
+        clock.sleep(20 * 60)
+
+    monkeypatch.setattr(app, 'fetch', slow_fetch)
+    app.fetch_all(deadline=datetime.timedelta(minutes=10))
+    assert len(fetched) == 1
+    assert model.FetchRun.unfinished() is None
+
+
+def test_fetch_leased(app, monkeypatch):
+    app.options.fetch_workers = 2
+    other = model.App.by_steamid('222')
+    model.Lease.claim('other-worker', [other.id], datetime.timedelta(hours=1))
+
+    fetched = []
+    monkeypatch.setattr(app, 'fetch', lambda game: fetched.append(game.steamid))
+    app.fetch_all()
+
+    # 222 is leased by the other worker
+    assert fetched == ['111']
+    leases = [(l.app.steamid, l.worker) for l in model.Lease.select()]
+    assert leases == [('222', 'other-worker')]
+
+
+def test_lease_expired(app):
+    game = model.App.by_steamid('111')
+    model.Lease.claim('a', [game.id], datetime.timedelta(hours=1))
+    assert model.Lease.claim('b', [game.id], datetime.timedelta(hours=1)) == []
+
+    model.Lease.update(expires=datetime.datetime(2000, 1, 1)).execute()
+    claimed = model.Lease.claim('b', [game.id], datetime.timedelta(hours=1))
+    assert [a.steamid for a in claimed] == ['111']
+
+
+def test_fetch_shard(app, monkeypatch):
+    fetched = []
+    monkeypatch.setattr(app, 'fetch', lambda game: fetched.append(game.steamid))
+    app.fetch_all(shard=(1, 2))
+    app.fetch_all(shard=(2, 2))
+    assert sorted(fetched) == ['111', '222']
+
+    fetched[:] = []
+    app.fetch_all(shard=(1, 1), force=True)
+    assert sorted(fetched) == ['111', '222']
+
+
+def test_merge(app, tmp_path):
+    shard_path = str(tmp_path / 'shard.db')
+    model._db.close()
+    model.init(shard_path)
+    game = App.create(steamid='111', kind='game', name='Game One',
+                      last_fetch=datetime.datetime(2015, 9, 1))
+    pkg = Package.create(steamid='01', name='Package')
+    pkg.link(game)
+    for hour, price in ((1, 100), (2, 100), (3, 200)):
+        model.Snapshot.create(
+            package=pkg,
+            timestamp=datetime.datetime(2015, 9, 1, hour),
+            price=price,
+            supports_linux=True,
+        )
+    model._db.close()
+
+    model.init(str(tmp_path / 'main.db'))
+    old = App.create(steamid='111', kind='game', name='Old Name')
+    model.Watch.create(owner='someone', app=old, threshold=10)
+    App.create(steamid='999', kind='game', name='Unrelated')
+    app.merge([shard_path])
+    app.merge([shard_path])  # merging twice does not duplicate
+
+    game = App.by_steamid('111')
+    assert game.name == 'Game One'
+    assert model.Watch.get_for('someone', game).threshold == 10
+    assert [p.steamid for p in game.packages] == ['01']
+    prices = [s.price for s in game.packages[0].snapshots.order_by(
+        model.Snapshot.timestamp)]
+    assert prices == [100, 200]
+    assert App.select().count() == 2
+
+
+def test_replay(app, tmp_path):
+    directory = str(tmp_path / 'responses')
+    log = responselog.ResponseLog(directory)
+    log.write('appdetails', '111', 'de', {'111': {'success': True, 'data': {
+        'type': 'game', 'name': 'Game One', 'packages': [1, 2]}}})
+    for price in (100, 100, 200):
+        log.write('packagedetails', '1', 'de', {'1': {'success': True, 'data': {
+            'name': 'Package', 'price': {'currency': 'EUR', 'final': price},
+            'platforms': {'linux': True}}}})
+    log.write('packagedetails', '2', 'de', {'2': {'success': False}})
+    log.close()
+
+    # different times, otherwise the same snapshot is not added again
+    segment, = responselog.segments([directory])
+    records = list(responselog.read(segment))
+    for offset, record in enumerate(records):
+        record['time'] += offset
+    with open(segment, 'wb') as outfile:
+        outfile.write(gzip.compress(''.join(
+            json.dumps(r) + '\n' for r in records).encode('utf-8')))
+
+    assert app.replay([directory], workers=1) == 2
+    assert app.replay([directory], workers=2) == 0
+
+    game = App.by_steamid('111')
+    assert [p.steamid for p in game.packages] == ['1']
+    pkg = game.packages[0]
+    assert pkg.name == 'Package'
+    snapshots = list(pkg.snapshots.order_by(model.Snapshot.timestamp))
+    assert [s.price for s in snapshots] == [100, 200]
+    assert snapshots[0].currency == 'EUR'
+    assert snapshots[0].region == 'de'
+    assert Package.by_steamid('2') is None
+
+
+def test_adopt_watches(app, tmp_path):
+    # a database from a version without per-user watchlists
+    path = str(tmp_path / 'old.db')
+    model._db.close()
+    model._db.init(path)
+    model._db.execute_sql(
+        'CREATE TABLE app (id INTEGER NOT NULL PRIMARY KEY,'
+        ' steamid VARCHAR(255) NOT NULL, kind VARCHAR(255) NOT NULL,'
+        ' enabled SMALLINT NOT NULL, name VARCHAR(255))')
+    model._db.execute_sql(
+        "INSERT INTO app (steamid, kind, enabled, name)"
+        " VALUES ('111', 'game', 1, 'Game One')")
+    model._db.close()
+
+    def start(user):
+        options = argparse.Namespace()
+        options.db_path = path
+        options.country_code = 'de'
+        options.user = user
+        model._db.close()
+        return application.Application(options)
+
+    alice = start('alice')
+    assert [a.steamid for a in model.Watch.apps('alice')] == ['111']
+    alice.unwatch('111')
+
+    # adopted only once, not whenever nobody watches anything
+    start('bob')
+    assert list(model.Watch.apps('bob')) == []
+
+
+def test_compact_snapshots(app, tmp_path):
+    # a database from a version that stored text timestamps and currencies
+    path = str(tmp_path / 'old.db')
+    model._db.close()
+    model._db.init(path)
+    model._db.execute_sql(
+        'CREATE TABLE snapshot (id INTEGER NOT NULL PRIMARY KEY,'
+        ' package_id INTEGER NOT NULL, timestamp DATETIME NOT NULL,'
+        ' region VARCHAR(255), currency VARCHAR(255), price INTEGER,'
+        ' release_date DATE, coming_soon SMALLINT,'
+        ' supports_linux SMALLINT NOT NULL)')
+    model._db.execute_sql(
+        'CREATE INDEX snapshot_timestamp ON snapshot (timestamp)')
+    model._db.get_cursor().executemany(
+        'INSERT INTO snapshot (package_id, timestamp, region, currency,'
+        ' price, supports_linux) VALUES (1, ?, ?, ?, ?, 1)',
+        (('2015-09-01 01:00:00.250000', 'de', 'EUR', 100),
+         ('2015-09-01 02:00:00', 'de', 'EUR', 200),
+         ('2015-09-01 02:00:00', 'us', 'USD', 300)))
+    model._db.close()
+
+    model.init(path)
+    pkg = Package.create(steamid='01', name='Package')
+    assert pkg.id == 1  # precondition
+    snapshots = pkg.recent_snapshots(limit=3)
+    assert [(s.timestamp, s.currency, s.price) for s in snapshots] == [
+        (datetime.datetime(2015, 9, 1, 2), 'USD', 300),
+        (datetime.datetime(2015, 9, 1, 2), 'EUR', 200),
+        (datetime.datetime(2015, 9, 1, 1), 'EUR', 100),
+    ]
+    stored = model._db.execute_sql(
+        'SELECT typeof(timestamp), typeof(currency_id) FROM snapshot'
+    ).fetchall()
+    assert set(stored) == {('integer', 'integer')}
+    assert model.Currency.select().count() == 2
+    stats = model.PackageStats.for_packages([pkg], 'de')[pkg.id]
+    assert stats.first_seen == datetime.datetime(2015, 9, 1, 1)
+    assert stats.last_change == datetime.datetime(2015, 9, 1, 2)
+
+    model.init(path)  # converted only once
+    assert len(pkg.recent_snapshots(limit=5)) == 3
+
+
+def test_recent_unseen(app):
+    game = App.by_steamid('111')
+    model.Watch.create(owner=app.user, app=game)
+    pkg = Package.create(steamid='01', name='Package')
+    pkg.link(game)
+
+    def record(hour):
+        return model.Snapshot.create(
+            package=pkg,
+            timestamp=datetime.datetime(2015, 9, 1, hour),
+            region='de',
+            price=hour,
+            supports_linux=True,
+        )
+
+    first = [record(1), record(2), record(3)]
+    unseen = app.recent(limit=2, unseen=True)
+    assert [s.id for s in unseen] == [first[0].id, first[1].id]
+    app.mark_seen(unseen)
+
+    unseen = app.recent(unseen=True)
+    assert [s.id for s in unseen] == [first[2].id]
+    app.mark_seen(unseen)
+    assert app.recent(unseen=True) == []
+
+    latest = record(4)
+    assert [s.id for s in app.recent(unseen=True)] == [latest.id]
+    # the cursor does not move back
+    app.mark_seen(first)
+    assert [s.id for s in app.recent(unseen=True)] == [latest.id]
+
+
+def test_rows(app):
+    game = App.by_steamid('111')
+    model.Watch.create(owner=app.user, app=game)
+    pkg = Package.create(steamid='01', name='Package')
+    pkg.link(game)
+    for hour in (1, 2, 3):
+        model.Snapshot.create(
+            package=pkg,
+            timestamp=datetime.datetime(2015, 9, 1, hour),
+            region='de',
+            price=hour,
+            supports_linux=True,
+        )
+    app.rebuild_stats()
+
+    package = len(model.APP_COLUMNS)
+    assert [r[:2] + r[package:package + 2] for r in app.ls_rows()] == [
+        ('111', 'Game One', '01', 'Package')]
+    rows = list(app.ls_rows(include_disabled=True))
+    assert [(r[0], r[package]) for r in rows] == [('111', '01'), ('333', None)]
+    lowest = len(model.APP_COLUMNS) + model.PACKAGE_COLUMNS.index('lowest')
+    assert rows[0][lowest:lowest + 3] == (1, 3, '2015-09-01T03:00:00Z')
+
+    rows = list(app.report_rows(limit=2))
+    index = model.REPORT_COLUMNS.index('timestamp')
+    assert [r[index] for r in rows] == [
+        '2015-09-01T03:00:00Z', '2015-09-01T02:00:00Z']
+    assert list(app.report_rows(region='us')) == [
+        ('111', 'Game One', 'game', 1, 0, '01', 'Package', None, None, 0)
+        + (None,) * 3 + (None,) * len(model.SNAPSHOT_COLUMNS)
+    ]
+    assert list(app.report_rows(apps=[App.by_steamid('222')])) == []
+
+    index = model.RECENT_COLUMNS.index('price')
+    assert [r[index] for r in app.recent_rows()] == [3, 2, 1]
+    assert [r[index] for r in app.recent_rows(limit=2, unseen=True)] == [1, 2]
+    assert [r[index] for r in app.recent_rows(unseen=True)] == [3]
+    assert list(app.recent_rows(unseen=True)) == []
+
+
+def test_export_rows(app):
+    game = App.by_steamid('111')
+    model.Watch.create(owner=app.user, app=game)
+    pkg = Package.create(steamid='01', name='Package')
+    pkg.link(game)
+    for day in (1, 2, 3):
+        model.Snapshot.create(
+            package=pkg,
+            timestamp=datetime.datetime(2015, 9, day, 12, 30, 1, 500),
+            region='de',
+            price=day,
+            supports_linux=True,
+        )
+
+    rows = list(app.export_rows())
+    assert len(rows) == 3
+    assert rows[0] == ('111', 'Game One', '01', 'Package', 'de',
+                       '2015-09-01 12:30:01', None, 1, None, None, 1)
+    since = datetime.datetime(2015, 9, 2)
+    index = model.EXPORT_COLUMNS.index('price')
+    assert [r[index] for r in app.export_rows(since=since)] == [2, 3]
+    assert list(app.export_rows(apps=[App.by_steamid('222')])) == []
+
+
+def test_archive(app, tmp_path):
+    game = App.by_steamid('111')
+    pkg = Package.create(steamid='01', name='Package')
+    pkg.link(game)
+    for hour in (1, 2):
+        model.Snapshot.create(
+            package=pkg,
+            timestamp=datetime.datetime(2015, 9, 1, hour),
+            region='de',
+            currency='EUR',
+            price=hour * 100,
+            supports_linux=True,
+        )
+
+    path = str(tmp_path)
+    assert app.archive(path=path) == 1
+    history = app.history(pkg, path=path)
+    assert list(history.prices) == [100, 200]
+    assert history.timestamps[0] == 1441069200  # 2015-09-01 01:00 UTC
+    assert history.currency(1) == 'EUR'
+    assert app.history(pkg, region='us', path=path) is None
+
+
+def test_stats(app):
+    game = App.by_steamid('111')
+    model.Watch.create(owner=app.user, app=game)
+    pkg = Package.create(steamid='01', name='Package')
+    pkg.link(game)
+    for day, price in ((1, 1000), (2, 500), (3, 1000)):
+        model.Snapshot.create(
+            package=pkg,
+            timestamp=datetime.datetime(2015, 9, day),
+            region=app.country_code,
+            currency='EUR',
+            price=price,
+            supports_linux=True,
+        )
+
+    result = app.stats()
+    assert len(result) == 1
+    package, lowest, current, median, discount, since, changes, sale = result[0]
+    assert package.steamid == '01'
+    assert (lowest, current, median, discount) == (500, 1000, 1000.0, 0.0)
+    assert changes == 2
+    assert sale == 1.0
+    assert app.stats(region='xx') == []
+
+
+def test_check_thresholds(app, monkeypatch):
+    signals = []
+    monkeypatch.setattr(
+        app, '_signal', lambda name, **kwargs: signals.append((name, kwargs)))
+
+    game = App.by_steamid('111')
+    model.Watch.create(owner='someone', app=game, threshold=1000)
+    pkg = Package.create(steamid='01')
+    pkg.link(game)
+
+    def record(hour, price):
+        model.PackageStats.record(model.Snapshot.create(
+            package=pkg,
+            timestamp=datetime.datetime(2015, 9, 1, hour),
+            region='de',
+            price=price,
+            supports_linux=True,
+        ))
+
+    record(1, 1500)
+    app.check_thresholds()
+    assert signals == []
+
+    record(2, 999)
+    app.check_thresholds()
+    assert signals == [
+        (application.SIGNAL_THRESHOLD,
+         {'app': game, 'price': 999, 'threshold': 1000,
+          'owner': 'someone'}),
+    ]
+
+    # no new signal while the price stays below
+    record(3, 899)
+    app.check_thresholds()
+    assert len(signals) == 1
+
+    # above and below again
+    record(4, 1500)
+    app.check_thresholds()
+    record(5, 1000)
+    app.check_thresholds()
+    assert len(signals) == 2
+
+
+def test_fetch_spread(app, monkeypatch):
+    waits = []
+    fetched = []
+    monkeypatch.setattr(application.time, 'sleep', waits.append)
+    monkeypatch.setattr(app, 'fetch', fetched.append)
+
+    app.fetch_all(spread=True)
+
+    assert sorted(a.steamid for a in fetched) == ['111', '222']
+    assert len(waits) <= 2
+    assert all(0 < wait <= 3600 for wait in waits)
+
+
+def test_fetch_spread_deadline(app, clock, monkeypatch):
+    for number in range(40):
+        App.create(steamid=str(1000 + number), kind='game', name='Game')
+    games = App.select().where(App.enabled == True).count()
+
+    fetched = []
+
+    def fetch(game):
+        fetched.append((game.steamid, clock.current))
+        game.last_fetch = clock.current
+        game.save()
+
+    monkeypatch.setattr(application.time, 'sleep', clock.sleep)
+    monkeypatch.setattr(app, 'fetch', fetch)
+    deadline = datetime.timedelta(minutes=50)
+
+    # two hourly runs
+    clock.current = datetime.datetime(2015, 9, 1, 12, 0, 0)
+    app.fetch_all(spread=True, deadline=deadline)
+    first = dict(fetched)
+    del fetched[:]
+    clock.current = datetime.datetime(2015, 9, 1, 13, 0, 0)
+    app.fetch_all(spread=True, deadline=deadline)
+    second = dict(fetched)
+
+    # no game is skipped, each keeps its slot
+    assert len(first) == len(second) == games
+    hour = datetime.timedelta(hours=1)
+    for steamid, when in first.items():
+        assert when < datetime.datetime(2015, 9, 1, 12, 50, 0)
+        assert second[steamid] == when + hour
+
+
+def test_slot():
+    game = App(steamid='111')
+    interval = datetime.timedelta(hours=1)
+    now = datetime.datetime(2015, 9, 1, 12, 0, 0)
+    slot = application._slot(game, now, interval)
+    assert now <= slot < now + interval
+
+    # stable across runs
+    later = now + datetime.timedelta(minutes=10)
+    next_slot = application._slot(game, later, interval)
+    assert later <= next_slot < later + interval
+    assert (next_slot - slot) in (datetime.timedelta(0), interval)
+
+
 if __name__ == '__main__':
     pytest.main(__file__)
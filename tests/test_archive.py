@@ -0,0 +1,41 @@
+#-*- coding: utf-8 -*-
+'''
+Tests for the columnar price history archive.
+'''
+import pytest
+
+from steamwatch import archive
+
+
+def test_write_load(tmp_path):
+    path = str(tmp_path / 'p1-us.swa')
+    archive.write(path, [
+        (1441065600, 1999, 'USD'),
+        (1441069200, None, None),
+        (1441072800, 999, 'EUR'),
+    ])
+    history = archive.load(path)
+    assert len(history) == 3
+    assert list(history.timestamps) == [1441065600, 1441069200, 1441072800]
+    assert list(history.prices) == [1999, archive.MISSING_PRICE, 999]
+    assert [history.currency(i) for i in range(3)] == ['USD', None, 'EUR']
+
+
+def test_write_all(tmp_path):
+    directory = str(tmp_path / 'archive')
+    written = archive.write_all(directory, [
+        ('1', 'de', 10, 100, 'EUR'),
+        ('1', 'us', 10, 200, 'USD'),
+        ('1', 'us', 20, 150, 'USD'),
+        ('2', 'us', 10, 300, 'USD'),
+    ])
+    assert written == 3
+    history = archive.load(archive.path_for(directory, '1', 'us'))
+    assert list(history.prices) == [200, 150]
+
+
+def test_load_invalid(tmp_path):
+    path = tmp_path / 'invalid.swa'
+    path.write_bytes(b'\0' * 32)
+    with pytest.raises(ValueError):
+        archive.load(str(path))
@@ -2,6 +2,7 @@
 '''
 Tests for models
 '''
+import calendar
 import datetime
 
 from peewee import IntegrityError
@@ -11,6 +12,11 @@ from steamwatch.model import App
 from steamwatch.model import Package
 from steamwatch.model import AppPackage
 from steamwatch.model import Snapshot
+from steamwatch.model import Currency
+from steamwatch.model import PackageStats
+from steamwatch.model import Watch
+from steamwatch.model import price_buckets
+from steamwatch.model import _db
 
 import pytest
 
@@ -25,14 +31,12 @@ def test_app_create():
         kind='game',
         enabled=False,
         name='The Name',
-        threshold=1000
     )
     assert app.id is not None
     assert app.steamid == '1'
     assert app.kind == 'game'
     assert not app.enabled
     assert app.name == 'The Name'
-    assert app.threshold == 1000
 
 
 def test_app_from_apidata():
@@ -40,13 +44,12 @@ def test_app_from_apidata():
         'type': 'game',
         'name': 'The Name',
     }
-    app = App.from_apidata('2', apidata, threshold=1000)
+    app = App.from_apidata('2', apidata)
     assert app.id is not None
     assert app.steamid == '2'
     assert app.kind == 'game'
     assert app.enabled
     assert app.name == 'The Name'
-    assert app.threshold == 1000
 
 
 def test_app_integrity():
@@ -58,6 +61,69 @@ def test_app_integrity():
         App.create(steamid='4')  # missing 'kind'
 
 
+def test_app_quarantine():
+    app = App.create(steamid='quarantine', kind='game')
+    assert app.failures == 0
+    assert not app.quarantined
+
+    now = datetime.datetime(2015, 9, 1, 12, 0, 0)
+    backoff = datetime.timedelta(hours=1)
+    limit = datetime.timedelta(hours=5)
+    app.record_failure(backoff, limit, now=now)
+    assert app.failures == 1
+    assert app.skip_until == now + backoff
+
+    app.record_failure(backoff, limit, now=now)
+    assert app.skip_until == now + 2 * backoff
+
+    for _ in range(10):
+        app.record_failure(backoff, limit, now=now)
+    assert app.failures == 12
+    assert app.skip_until == now + limit
+
+    app.record_failure(backoff, limit)
+    assert app.quarantined
+
+    app.record_success()
+    assert app.failures == 0
+    assert not app.quarantined
+
+
+def test_app_current_prices():
+    app = App.create(steamid='prices', kind='game')
+    Watch.create(owner='someone', app=app, threshold=1000)
+    cheap = Package.create(steamid='prices-0')
+    expensive = Package.create(steamid='prices-1')
+    cheap.link(app)
+    expensive.link(app)
+    for pkg, price, hour in ((cheap, 500, 1), (cheap, 900, 2),
+                             (expensive, 2000, 1)):
+        PackageStats.record(Snapshot.create(
+            package=pkg,
+            timestamp=datetime.datetime(2015, 9, 1, hour, 0, 0),
+            price=price,
+            supports_linux=False,
+        ))
+
+    prices = App.current_prices()
+    assert prices[app.id] == 900
+
+    changes = App.change_counts(datetime.datetime(2015, 9, 1, 2, 0, 0))
+    assert changes[app.id] == 1
+
+
+def test_watch_adopt():
+    Watch.delete().execute()
+    app = App.create(steamid='adopt', kind='game')
+    assert Watch.adopt('someone') > 0
+    assert Watch.get_for('someone', app) is not None
+
+    # only if nobody watches anything
+    assert Watch.adopt('other') == 0
+    assert app in list(Watch.apps('someone'))
+    assert list(Watch.apps('other')) == []
+
+
 # Package ---------------------------------------------------------------------
 
 
@@ -149,12 +215,119 @@ def test_recent_snapshots():
     ss1 = package.record_snapshot(apidata1)
     ss2 = package.record_snapshot(apidata2)
 
-    assert ss0.timestamp != ss1.timestamp != ss2.timestamp  # precondition
-
+    # timestamps have whole seconds, snapshots recorded within the same
+    # second are ordered by id
     recent = package.recent_snapshots(limit=2)
     assert len(recent) == 2
-    assert recent[0].timestamp > recent[1].timestamp
+    assert recent[0].timestamp >= recent[1].timestamp
+    assert [s.id for s in recent] == [ss2.id, ss1.id]
     assert recent[0].price == 2500
+    assert ss1.previous.id == ss0.id
+    assert ss2.previous.id == ss1.id
+
+
+def test_snapshot_save_delta():
+    pkg = Package.create(steamid='delta', kind='game')
+    week = datetime.timedelta(days=7)
+
+    def record(day, price, currency='EUR', release=datetime.date(2015, 9, 1)):
+        snapshot = Snapshot(
+            package=pkg,
+            timestamp=datetime.datetime(2015, 9, day),
+            currency=currency,
+            price=price,
+            release_date=release,
+            supports_linux=True,
+        )
+        previous = snapshot.previous
+        snapshot.save_delta(previous, week)
+        assert snapshot.currency == currency  # values are kept
+        return snapshot
+
+    first = record(1, 100)
+    second = record(2, 200)
+    third = record(3, 300, currency='USD')
+    fourth = record(4, 400, release=None)  # change to None
+    fifth = record(12, 500)  # keyframe too old
+    sixth = record(13, 600)
+
+    assert first.keyframe is None
+    assert second.keyframe == first.id
+    assert third.keyframe == first.id
+    assert fourth.keyframe is None
+    assert fifth.keyframe is None
+    assert sixth.keyframe == fifth.id
+
+    stored = _db.execute_sql(
+        'SELECT currency_id, release_date FROM snapshot WHERE id = ?',
+        (second.id,)).fetchone()
+    assert stored == (None, None)
+    stored = _db.execute_sql(
+        'SELECT currency_id, release_date FROM snapshot WHERE id = ?',
+        (third.id,)).fetchone()
+    assert stored == (Currency.id_for('USD'), None)
+
+    # reconstructed from the keyframe
+    assert second.id == third.previous.id
+    assert third.previous.currency == 'EUR'
+    assert third.previous.release_date == datetime.date(2015, 9, 1)
+    assert third.diff() == [('currency', 'USD', 'EUR'), ('price', 300, 200)]
+    assert [s.currency for s in pkg.recent_snapshots(limit=6)] == [
+        'EUR', 'EUR', 'EUR', 'USD', 'EUR', 'EUR']
+
+    recent = Snapshot.recent().where(Snapshot.package == pkg)
+    assert [s.release_date for s in recent][-2:] == [
+        datetime.date(2015, 9, 1), datetime.date(2015, 9, 1)]
+    full = _db.execute_sql(
+        'SELECT currency, release_date FROM snapshot_full WHERE id = ?',
+        (second.id,)).fetchone()
+    assert full == ('EUR', '2015-09-01')
+
+
+def test_package_stats():
+    package = Package.create(steamid='stats')
+    apidata = {'platforms': {'linux': True}}
+    for price in (1500, 1500, 999, 2000, 1500):
+        data = dict(apidata, price={'currency': 'EUR', 'final': price})
+        package.record_snapshot(data, region='de')
+    package.record_snapshot(dict(apidata, price={'final': 10}), region='us')
+
+    def current():
+        return [(s.region, s.price, s.lowest, s.highest, s.changes,
+                 s.last_change, s.first_seen)
+                for s in package.stats.order_by(PackageStats.region)]
+
+    recorded = current()
+    de = recorded[0]
+    assert de[:5] == ('de', 1500, 999, 2000, 3)
+    assert de[5] >= de[6]  # last change not before first seen
+    assert recorded[1][:5] == ('us', 10, 10, 10, 0)
+
+    assert PackageStats.rebuild() >= 2
+    assert current() == recorded
+
+    stats = PackageStats.for_packages([package], 'de')
+    assert stats[package.id].lowest == 999
+
+
+def test_price_buckets():
+    package = Package.create(steamid='buckets')
+    start = datetime.datetime(2015, 9, 1)
+    for hours, price in ((0, 1000), (1, 500), (2, 1000), (30, 2000)):
+        PackageStats.record(Snapshot.create(
+            package=package,
+            timestamp=start + datetime.timedelta(hours=hours),
+            region='de',
+            price=price,
+            supports_linux=False,
+        ))
+    now = calendar.timegm((start + datetime.timedelta(hours=40)).timetuple())
+
+    history = price_buckets([package.id], 'de', 4, now)[package.id]
+    # the sale within the first period is kept,
+    # the second period has no snapshots but the price still holds
+    assert history == [(500, 1000), (1000, 1000), (1000, 1000), (1000, 2000)]
+    assert price_buckets([package.id], 'us', 4, now) == {}
 
 
 # AppPackage ------------------------------------------------------------------
@@ -311,11 +484,28 @@ def test_snapshot_recent():
     apidata3 = apidata0.copy()
     apidata3.update(price={'currency': 'EUR', 'final': 4000})
 
-    ss0 = pkg0.record_snapshot(apidata0)
+    pkg0.record_snapshot(apidata0)
     ss1 = pkg1.record_snapshot(apidata1)
     ss2 = pkg0.record_snapshot(apidata2)
     ss3 = pkg1.record_snapshot(apidata3)
 
     recent = Snapshot.recent(limit=3)
     assert len(recent) == 3
-    assert recent[0].timestamp > recent[1].timestamp
+    assert recent[0].timestamp >= recent[1].timestamp
+    # within the same second, the last recorded comes first
+    assert [s.id for s in recent] == [ss3.id, ss2.id, ss1.id]
+
+
+def test_currency_rollback():
+    pkg = Package.create(steamid='currency-rollback')
+    with pytest.raises(ValueError):
+        with _db.atomic():
+            Snapshot.create(package=pkg, currency='XYZ', supports_linux=True)
+            raise ValueError
+
+    snapshot = Snapshot.create(package=pkg, currency='XYZ',
+                               supports_linux=True)
+    stored = _db.execute_sql(
+        'SELECT currency FROM snapshot_full WHERE id = ?',
+        (snapshot.id,)).fetchone()
+    assert stored == ('XYZ',)
@@ -2,13 +2,24 @@
 '''
 [Module Documentation here]
 '''
-import pytest
-
+import argparse
+import io
+import json
 
-# Style ----------------------------------------------------------------------
+import pytest
 
 from steamwatch.render import red
 from steamwatch.render import bold
+from steamwatch.render import JsonRenderer
+from steamwatch.render import NdjsonRenderer
+from steamwatch.render import Renderer
+from steamwatch.render import TabularRenderer
+from steamwatch.render import _cell
+from steamwatch.render import _lookahead
+from steamwatch.render import _sparkline
+
+
+# Style ----------------------------------------------------------------------
 
 
 def test_simple():
@@ -181,3 +192,125 @@ def test_join():
     styled = red('-')
     joined = styled.join(['a', 'b'])
     assert joined == 'a' + '\033[31m' + '-' + '\033[0m' + 'b'
+
+
+# Helpers --------------------------------------------------------------------
+
+
+def test_lookahead():
+    assert list(_lookahead([])) == []
+    assert list(_lookahead(['a'])) == [('a', True)]
+    items = (c for c in 'abc')  # length is unknown
+    assert list(_lookahead(items)) == [('a', False), ('b', False), ('c', True)]
+
+
+def test_cell():
+    assert _cell(4).format('ab') == 'ab  '
+    assert _cell(4).format('abcdef') == 'abcd'
+
+
+def test_sparkline():
+    assert _sparkline(None) == ''
+    assert _sparkline([(None, None)] * 2) == '  '
+    # the dip and the spike show in periods that also have other prices
+    line = _sparkline([(None, None), (400, 400), (100, 400), (400, 900)])
+    assert line == ' \u2584\u2581\u2588'
+
+
+# Renderer -------------------------------------------------------------------
+
+
+def test_buffered_write():
+    out = io.StringIO()
+    renderer = Renderer(out, argparse.Namespace(render_buffer=4))
+    renderer.write('ab')
+    assert out.getvalue() == ''
+    renderer.writeln('cd')
+    assert out.getvalue() == 'abcd'  # flushed at 4 characters
+    renderer.write('e')
+    renderer.flush()
+    assert out.getvalue() == 'abcd\ne'
+
+
+def test_tabular_row():
+    renderer = TabularRenderer(io.StringIO(), argparse.Namespace())
+    grid = renderer._grid('+', '-', '+', '+', (1, 3))
+    assert grid == '+---+-----+\n'
+    row = renderer._row(['{}', _cell(3)])
+    cells = row.format('a', 'bcde')
+    assert cells == ' '.join((renderer.left, 'a', renderer.center,
+                              'bcd', renderer.right + '\n'))
+    assert len(row.format('a', 'b')) == len(grid)
+
+
+def test_tabular_sparkline():
+    out = io.StringIO()
+    renderer = TabularRenderer(out, argparse.Namespace())
+    app = argparse.Namespace(steamid='1', name='Game')
+    package = argparse.Namespace(steamid='11', name='One', price_stats=None,
+                                 price_history=[(100, 100), (100, 200)])
+    snapshots = [
+        argparse.Namespace(timestamp=None, supports_linux=True, price=200)
+    ] * 2
+    renderer.render_report([(app, [(package, snapshots)])])
+    lines = out.getvalue().splitlines()
+    assert len(set(len(line) for line in lines)) == 1
+    assert 'History' in lines[2]
+    assert '\u2581\u2588' in lines[6]  # next to the current price
+    assert '\u2581' not in lines[8]
+
+    # without a price history, there is no column for it
+    out = io.StringIO()
+    renderer = TabularRenderer(out, argparse.Namespace(sparkline=True))
+    del package.price_history
+    renderer.render_report([(app, [(package, snapshots)])])
+    assert 'History' not in out.getvalue()
+
+
+def test_renderer_style():
+    renderer = Renderer(io.StringIO(), argparse.Namespace())
+    assert renderer.bold('text') == 'text'
+    renderer.use_color = True
+    styled = renderer.red('text')
+    assert type(styled) is str
+    assert styled == str(red('text'))
+
+
+def test_ndjson():
+    out = io.StringIO()
+    renderer = NdjsonRenderer(out, argparse.Namespace())
+    renderer.render_ls([
+        ('1', 'Gäme', 'game', 1, 0, '11', 'One', None, None, 0,
+         None, None, None),
+        ('1', 'Gäme', 'game', 1, 0, '12', 'Two', '2015-09-01', 1, 1,
+         499, 999, '2015-08-01T12:00:00Z'),
+        ('2', 'Other', 'dlc', 0, 0) + (None,) * 8,
+    ])
+    objects = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [(o['type'], o['steamid']) for o in objects] == [
+        ('app', '1'), ('package', '11'), ('package', '12'), ('app', '2')]
+    assert objects[0]['name'] == 'Gäme'
+    assert objects[2] == {
+        'type': 'package', 'app': '1', 'steamid': '12', 'name': 'Two',
+        'release_date': '2015-09-01', 'coming_soon': True,
+        'quarantined': True, 'lowest': 499, 'highest': 999,
+        'last_change': '2015-08-01T12:00:00Z',
+    }
+    assert objects[3]['enabled'] is False
+
+
+def test_json():
+    out = io.StringIO()
+    renderer = JsonRenderer(out, argparse.Namespace())
+    renderer.render_recent([
+        ('11', 'One', None, None, 0, None, None, None,
+         7, 'us', '2015-09-01T12:00:00Z', 'USD', 999, None, 0, 1),
+    ])
+    objects = json.loads(out.getvalue())
+    assert [o['type'] for o in objects] == ['package', 'snapshot']
+    assert objects[1]['package'] == '11'
+    assert objects[1]['price'] == 999
+
+    out = io.StringIO()
+    JsonRenderer(out, argparse.Namespace()).render_recent([])
+    assert json.loads(out.getvalue()) == []
@@ -0,0 +1,61 @@
+#-*- coding: utf-8 -*-
+'''
+Tests for the log of raw store API responses.
+'''
+import gzip
+import json
+
+from steamwatch import responselog
+from steamwatch import storeapi
+
+
+def test_write_read(tmp_path):
+    directory = str(tmp_path / 'responses')
+    log = responselog.ResponseLog(directory, segment_size=1)
+    log.write('appdetails', '1', 'us', {'1': {'success': False}})
+    log.write('packagedetails', '2', None, {'2': {'success': False}})
+    log.close()
+
+    # every record starts a new segment
+    segments = responselog.segments([directory])
+    assert len(segments) == 2
+    records = [r for path in segments for r in responselog.read(path)]
+    assert [r['endpoint'] for r in records] == ['appdetails', 'packagedetails']
+    assert records[0]['cc'] == 'us'
+    assert records[1]['response'] == {'2': {'success': False}}
+    assert records[1]['time'] >= records[0]['time']
+
+
+def test_read_incomplete(tmp_path):
+    path = str(tmp_path / 'cut.jsonl.gz')
+    line = json.dumps({'endpoint': 'appdetails', 'id': '1'})
+    data = gzip.compress((line + '\n' + line).encode('utf-8'))
+    with open(path, 'wb') as segment:
+        segment.write(data[:-8])  # without the gzip trailer
+    assert [r['id'] for r in responselog.read(path)] == ['1']
+
+
+def test_record_responses(tmp_path, monkeypatch):
+
+    class Response(object):
+        def getheader(self, unused):
+            return 'application/json; charset=utf-8'
+
+        def read(self):
+            data = {'12': {'success': True, 'data': {'name': 'Package'}}}
+            return json.dumps(data).encode('utf-8')
+
+    monkeypatch.setattr(storeapi, '_get', lambda url: Response())
+    log = responselog.ResponseLog(str(tmp_path))
+    storeapi.record_responses(log)
+    try:
+        storeapi.packagedetails('12', country_code='de')
+    finally:
+        storeapi.record_responses(None)
+        log.close()
+
+    path, = responselog.segments([str(tmp_path)])
+    record, = responselog.read(path)
+    assert record['endpoint'] == 'packagedetails'
+    assert record['cc'] == 'de'
+    assert record['response']['12']['data']['name'] == 'Package'
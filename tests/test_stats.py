@@ -0,0 +1,55 @@
+#-*- coding: utf-8 -*-
+'''
+Tests for price statistics.
+'''
+import array
+
+import pytest
+
+from steamwatch import stats
+
+
+DAY = stats.DAY
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def compute(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(stats, 'numpy', None)
+    return stats.compute
+
+
+def _columns(rows):
+    return [array.array('q', column) for column in zip(*rows)]
+
+
+def test_compute(compute):
+    packages, timestamps, prices = _columns([
+        (1, 0 * DAY, 1000),
+        (1, 10 * DAY, 500),
+        (1, 12 * DAY, 1000),
+        (1, 20 * DAY, 1000),
+        (2, 5 * DAY, 300),
+    ])
+    result = compute(packages, timestamps, prices, now=30 * DAY)
+    assert result == [
+        (1, 500, 1000, 1000.0, 0.0, 18.0, 2, 2.0),
+        (2, 300, 300, 300.0, 0.0, 25.0, 0, 0.0),
+    ]
+
+
+def test_compute_discount(compute):
+    packages, timestamps, prices = _columns([
+        (7, 0, 1000),
+        (7, DAY, 1000),
+        (7, 2 * DAY, 250),
+    ])
+    result = compute(packages, timestamps, prices, now=4 * DAY)
+    assert result == [(7, 250, 250, 1000.0, 75.0, 2.0, 1, 2.0)]
+
+
+def test_compute_empty(compute):
+    empty = array.array('q')
+    assert compute(empty, empty, empty, now=0) == []